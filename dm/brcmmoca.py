@@ -20,16 +20,20 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import collections
 import re
-import subprocess
 import pynetlinux
+import tr.cmdcache
 import tr.core
+import tr.cwmp_session
 import tr.tr181_v2_2
 import netdev
 
 
 BASE181MOCA = tr.tr181_v2_2.Device_v2_2.Device.MoCA
 MOCACTL = '/bin/mocactl'
+MOCACTL_TTL = 2  # seconds, see tr/cmdcache.py
+MOCA_NODE_FANOUT = 4  # per-node mocactl commands to run at once
 PYNETIFCONF = pynetlinux.ifconfig.Interface
 
 
@@ -46,6 +50,243 @@ def FloatOrZero(arg):
     return 0.0
 
 
+def _MocaCtlPrefetch(*args):
+  """Start fetching mocactl output, see tr.core.Exporter.DeclarePrefetch."""
+  return tr.cmdcache.Instance().GetDeferred([MOCACTL] + list(args),
+                                            ttl=MOCACTL_TTL)
+
+
+# mocactl prints one or two 'key : value' columns per line, ex:
+# vendorId              : 999999999   HwVersion             : 0x12345678
+# A key starts a line or follows a gap of at least two spaces, so the
+# units after a value ('999 Mhz') don't become part of the next key.
+FIELD_RE = re.compile(r'(?:^|\s{2,})(\S(?:[^:]*?\S)?)\s*:\s+(\S+)')
+
+
+def _ParseFields(out):
+  """Return a dict of every 'key : value' pair in mocactl output."""
+  fields = {}
+  for line in out.splitlines():
+    for key, value in FIELD_RE.findall(line):
+      fields.setdefault(key, value)
+  return fields
+
+
+def _ParseDuration(duration):
+  """Convert a mocactl time like '23h:41m:30s' to seconds."""
+  secs = 0
+  for t in duration.split(':'):
+    if not t:
+      continue
+    num = IntOrZero(t[:-1])
+    if t[-1] == 'y':
+      secs += int(num * (365.25 * 24.0 * 60.0 * 60.0))
+    elif t[-1] == 'w':
+      secs += num * (7 * 24 * 60 * 60)
+    elif t[-1] == 'd':
+      secs += num * (24 * 60 * 60)
+    elif t[-1] == 'h':
+      secs += num * (60 * 60)
+    elif t[-1] == 'm':
+      secs += num * 60
+    elif t[-1] == 's':
+      secs += num
+  return secs
+
+
+# The parts of each mocactl view which BrcmMocaInterface reports on.
+MocaStatus = collections.namedtuple(
+    'MocaStatus', ('sw_version', 'highest_version', 'current_version',
+                   'nc_node_id', 'node_id', 'backup_nc_id', 'link_up_secs',
+                   'rf_channel'))
+MocaInitParms = collections.namedtuple(
+    'MocaInitParms', ('privacy', 'last_oper_freq', 'qam256'))
+MocaConfig = collections.namedtuple('MocaConfig', ('max_pkt_aggr',))
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def MocaCtlStatus(mocactl):
+  """Run mocactl show --status at most once per tick.
+
+  Args:
+    mocactl: the path to mocactl, part of the cache key.
+  Returns:
+    a MocaStatus.
+  """
+  fields = _ParseFields(tr.cmdcache.Instance().Get(
+      [mocactl, 'show', '--status'], ttl=MOCACTL_TTL))
+  return MocaStatus(
+      sw_version=fields.get('SwVersion', ''),
+      highest_version=fields.get('self MoCA Version'),
+      current_version=fields.get('networkVersionNumber'),
+      nc_node_id=IntOrZero(fields.get('ncNodeId', '')),
+      node_id=IntOrZero(fields.get('nodeId', '')),
+      backup_nc_id=fields.get('backupNcId', ''),
+      link_up_secs=_ParseDuration(fields.get('linkUpTime', '')),
+      rf_channel=IntOrZero(fields.get('rfChannel', '')))
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def MocaCtlInitParms(mocactl):
+  """Run mocactl show --initparms at most once per tick, see MocaCtlStatus."""
+  fields = _ParseFields(tr.cmdcache.Instance().Get(
+      [mocactl, 'show', '--initparms'], ttl=MOCACTL_TTL))
+  return MocaInitParms(
+      privacy=fields.get('Privacy') == 'enabled',
+      last_oper_freq=IntOrZero(fields.get('Nv Params - Last Oper Freq', '')),
+      qam256=fields.get('qam256Capability') == 'on')
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def MocaCtlConfig(mocactl):
+  """Run mocactl show --config at most once per tick, see MocaCtlStatus."""
+  fields = _ParseFields(tr.cmdcache.Instance().Get(
+      [mocactl, 'show', '--config'], ttl=MOCACTL_TTL))
+  return MocaConfig(max_pkt_aggr=IntOrZero(fields.get('maxPktAggr', '')))
+
+
+# What BrcmMocaAssociatedDevice reports about one node.
+MocaNode = collections.namedtuple(
+    'MocaNode', ('MACAddress PreferredNC PHYTxRate PHYRxRate '
+                 'TxPowerControlReduction RxPowerLevel TxBcastRate '
+                 'RxBcastPowerLevel TxPackets RxPackets '
+                 'RxErroredAndMissedPackets QAM256Capable '
+                 'PacketAggregationCapability RxSNR'))
+
+NODE_RE = re.compile(r'\ANode\s*: (\d+)')
+MAC_RE = re.compile(r'^MAC Address\s+: ((?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2})')
+PNC_RE = re.compile(r'Preferred NC\s+: (\d+)')
+PTX_RE = re.compile(r'\ATxUc.+?(\d+[.]?\d*)\s+dBm.*?(\d+)\s+bps')
+PRX_RE = re.compile(r'\ARxUc.+?(\d+[.]?\d*)\s+dBm.*?(\d+)\s+bps'
+                    r'\s+(\d+[.]?\d*) dB')
+RXB_RE = re.compile(r'\ARxBc.+?(\d+[.]?\d*)\s+dBm.*?(\d+)\s+bps')
+QAM_RE = re.compile(r'256 QAM capable\s+:\s+(\d+)')
+AGG_RE = re.compile(r'Aggregated PDUs\s+:\s+(\d+)')
+TX_RE = re.compile(r'Unicast Tx Pkts To Node\s+: (\d+)')
+RX_RE = re.compile(r'Unicast Rx Pkts From Node\s+: (\d+)')
+E1_RE = re.compile(r'Rx CodeWord ErrorAndUnCorrected\s+: (\d+)')
+E2_RE = re.compile(r'Rx NoSync Errors\s+: (\d+)')
+
+
+def _NodeCommands(nodeid):
+  """The mocactl commands which MocaNode is parsed from."""
+  return [['show', '--nodestatus', str(nodeid)],
+          ['show', '--nodestats', str(nodeid)]]
+
+
+def _ParseNode(status, stats):
+  """Parse mocactl show --nodestatus and --nodestats output for one node."""
+  node = dict((f, 0) for f in MocaNode._fields)
+  node.update(MACAddress='', PreferredNC=False, QAM256Capable=False)
+  for line in status.splitlines():
+    mac = MAC_RE.search(line)
+    if mac is not None:
+      node['MACAddress'] = mac.group(1)
+    pnc = PNC_RE.search(line)
+    if pnc is not None:
+      node['PreferredNC'] = pnc.group(1) != '0'
+    ptx = PTX_RE.search(line)
+    if ptx is not None:
+      node['PHYTxRate'] = IntOrZero(ptx.group(2)) / 1000000
+      node['TxPowerControlReduction'] = int(FloatOrZero(ptx.group(1)))
+    prx = PRX_RE.search(line)
+    if prx is not None:
+      node['PHYRxRate'] = IntOrZero(prx.group(2)) / 1000000
+      node['RxPowerLevel'] = int(FloatOrZero(prx.group(1)))
+      # TODO(dgentry) This cannot be right. SNR should be dB, not an integer.
+      node['RxSNR'] = int(FloatOrZero(prx.group(3)))
+    rxb = RXB_RE.search(line)
+    if rxb is not None:
+      node['TxBcastRate'] = IntOrZero(rxb.group(2)) / 1000000
+      node['RxBcastPowerLevel'] = int(FloatOrZero(rxb.group(1)))
+    qam = QAM_RE.search(line)
+    if qam is not None:
+      node['QAM256Capable'] = qam.group(1) != '0'
+    agg = AGG_RE.search(line)
+    if agg is not None:
+      node['PacketAggregationCapability'] = IntOrZero(agg.group(1))
+  for line in stats.splitlines():
+    tx = TX_RE.search(line)
+    if tx is not None:
+      node['TxPackets'] = IntOrZero(tx.group(1))
+    rx = RX_RE.search(line)
+    if rx is not None:
+      node['RxPackets'] = IntOrZero(rx.group(1))
+    e1 = E1_RE.search(line)
+    if e1 is not None:
+      node['RxErroredAndMissedPackets'] += IntOrZero(e1.group(1))
+    e2 = E2_RE.search(line)
+    if e2 is not None:
+      node['RxErroredAndMissedPackets'] += IntOrZero(e2.group(1))
+  return MocaNode(**node)
+
+
+def _GetNode(mocactl, nodeid):
+  status, stats = [tr.cmdcache.Instance().Get([mocactl] + cmd,
+                                              ttl=MOCACTL_TTL)
+                   for cmd in _NodeCommands(nodeid)]
+  return _ParseNode(status, stats)
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def MocaNodeIDs(mocactl):
+  """Return a sorted list of active MoCA Node IDs, once per tick.
+
+  Args:
+    mocactl: the path to mocactl, part of the cache key.
+  Returns:
+    a list of integers.
+  """
+  out = tr.cmdcache.Instance().Get([mocactl, 'showtbl', '--nodestats'],
+                                   ttl=MOCACTL_TTL)
+  nodes = set()
+  for line in out.splitlines():
+    node = NODE_RE.search(line)
+    if node is not None:
+      nodes.add(int(node.group(1)))
+  return sorted(nodes)
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def MocaNodeTable(mocactl):
+  """Return a dict of NodeID to MocaNode for every active node, once per tick.
+
+  This runs the per-node commands one after another, unless
+  FetchMocaNodeTable() already put their output in tr.cmdcache.
+
+  Args:
+    mocactl: the path to mocactl, part of the cache key.
+  """
+  return dict((nodeid, _GetNode(mocactl, nodeid))
+              for nodeid in MocaNodeIDs(mocactl))
+
+
+def FetchMocaNodeTable():
+  """Start fetching everything MocaNodeTable() needs.
+
+  The node list comes first, then the commands for all nodes are run
+  concurrently, at most MOCA_NODE_FANOUT at a time.  Failures are left
+  for MocaNodeTable() to find.
+
+  Returns:
+    a tr.core.Deferred which is done when all of them are.
+  """
+  limiter = tr.core.Limiter(MOCA_NODE_FANOUT)
+
+  def FetchNodes(unused_out):
+    fetches = []
+    for nodeid in MocaNodeIDs(MOCACTL):
+      for cmd in _NodeCommands(nodeid):
+        fetches.append(limiter.Run(tr.cmdcache.Instance().GetDeferred,
+                                   [MOCACTL] + cmd, MOCACTL_TTL))
+    return tr.core.Gather(fetches)
+
+  done = tr.core.Deferred()
+  d = _MocaCtlPrefetch('showtbl', '--nodestats').Then(FetchNodes)
+  d.AddCallback(lambda unused_d: done.Resolve(None))
+  return done
+
+
 class BrcmMocaInterface(BASE181MOCA.Interface):
   """An implementation of tr181 Device.MoCA.Interface for Broadcom chipsets."""
 
@@ -75,6 +316,17 @@ class BrcmMocaInterface(BASE181MOCA.Interface):
     self.Unexport('TxBcastPowerReduction')
     self.Unexport(objects='QoS')
 
+    self.DeclarePrefetch(['LastChange', 'FirmwareVersion', 'HighestVersion',
+                          'CurrentVersion', 'NetworkCoordinator', 'NodeID',
+                          'BackupNC', 'CurrentOperFreq'],
+                         _MocaCtlPrefetch, 'show', '--status')
+    self.DeclarePrefetch(['PrivacyEnabled', 'LastOperFreq', 'QAM256Capable'],
+                         _MocaCtlPrefetch, 'show', '--initparms')
+    self.DeclarePrefetch(['PacketAggregationCapability'],
+                         _MocaCtlPrefetch, 'show', '--config')
+    self.DeclarePrefetch(['AssociatedDeviceNumberOfEntries'],
+                         _MocaCtlPrefetch, 'showtbl', '--nodestats')
+
     self.AssociatedDeviceList = tr.core.AutoDict(
         'AssociatedDeviceList', iteritems=self.IterAssociatedDevices,
         getitem=self.GetAssociatedDeviceByIndex)
@@ -83,48 +335,14 @@ class BrcmMocaInterface(BASE181MOCA.Interface):
   def Stats(self):
     return BrcmMocaInterfaceStatsLinux26(self._ifname)
 
-  # TODO(dgentry) need @sessioncache decorator
-  def _MocaCtlShowStatus(self):
-    """Return output of mocactl show --status."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--status'], stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
-    return out.splitlines()
-
-  # TODO(dgentry) need @sessioncache decorator
-  def _MocaCtlShowInitParms(self):
-    """Return output of mocactl show --initparms."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--initparms'],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
-    return out.splitlines()
-
-  # TODO(dgentry) need @sessioncache decorator
-  def _MocaCtlShowConfig(self):
-    """Return output of mocactl show --config."""
-    mc = subprocess.Popen([MOCACTL, 'show', '--config'], stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
-    return out.splitlines()
-
-  def _MocaCtlGetField(self, outfcn, field):
-    """Look for one field in a mocactl command.
-
-    ex: field='SwVersion' would return 5.6.789 from
-    vendorId              : 999999999   HwVersion             : 0x12345678
-    SwVersion             : 5.6.789     self MoCA Version     : 0x11
-
-    Args:
-      outfcn: a function to call, which must return a list of text lines.
-      field: the text string to look for.
-    Returns:
-      The value of the field, or None.
-    """
-
-    m_re = re.compile(field + '\s*:\s+(\S+)')
-    for line in outfcn():
-      mr = m_re.search(line)
-      if mr is not None:
-        return mr.group(1)
-    return None
+  def _Status(self):
+    return MocaCtlStatus(MOCACTL)
+
+  def _InitParms(self):
+    return MocaCtlInitParms(MOCACTL)
+
+  def _Config(self):
+    return MocaCtlConfig(MOCACTL)
 
   @property
   def Enable(self):
@@ -147,24 +365,7 @@ class BrcmMocaInterface(BASE181MOCA.Interface):
 
   @property
   def LastChange(self):
-    up = self._MocaCtlGetField(self._MocaCtlShowStatus, 'linkUpTime').split(':')
-    secs = 0
-    for t in up:
-      # linkUpTime ex: '23h:41m:30s'
-      num = IntOrZero(t[:-1])
-      if t[-1] == 'y':
-        secs += int(num * (365.25 * 24.0 * 60.0 * 60.0))
-      elif t[-1] == 'w':
-        secs += num * (7 * 24 * 60 * 60)
-      elif t[-1] == 'd':
-        secs += num * (24 * 60 * 60)
-      elif t[-1] == 'h':
-        secs += num * (60 * 60)
-      elif t[-1] == 'm':
-        secs += num * 60
-      elif t[-1] == 's':
-        secs += num
-    return secs
+    return self._Status().link_up_secs
 
   @property
   def LowerLayers(self):
@@ -181,7 +382,7 @@ class BrcmMocaInterface(BASE181MOCA.Interface):
 
   @property
   def FirmwareVersion(self):
-    ver = self._MocaCtlGetField(self._MocaCtlShowStatus, 'SwVersion')
+    ver = self._Status().sw_version
     return ver if ver else '0'
 
   def _RegToMoCA(self, regval):
@@ -190,94 +391,60 @@ class BrcmMocaInterface(BASE181MOCA.Interface):
 
   @property
   def HighestVersion(self):
-    reg = self._MocaCtlGetField(self._MocaCtlShowStatus, 'self MoCA Version')
-    return self._RegToMoCA(reg)
+    return self._RegToMoCA(self._Status().highest_version)
 
   @property
   def CurrentVersion(self):
-    reg = self._MocaCtlGetField(self._MocaCtlShowStatus, 'networkVersionNumber')
-    return self._RegToMoCA(reg)
+    return self._RegToMoCA(self._Status().current_version)
 
   @property
   def NetworkCoordinator(self):
-    nodeid = self._MocaCtlGetField(self._MocaCtlShowStatus, 'ncNodeId')
-    return IntOrZero(nodeid)
+    return self._Status().nc_node_id
 
   @property
   def NodeID(self):
-    nodeid = self._MocaCtlGetField(self._MocaCtlShowStatus, 'nodeId')
-    return IntOrZero(nodeid)
+    return self._Status().node_id
 
   @property
   def BackupNC(self):
-    bnc = nodeid = self._MocaCtlGetField(self._MocaCtlShowStatus, 'backupNcId')
-    return bnc if bnc else ''
+    return self._Status().backup_nc_id
 
   @property
   def PrivacyEnabled(self):
-    private = self._MocaCtlGetField(self._MocaCtlShowInitParms, 'Privacy')
-    return True if private == 'enabled' else False
+    return self._InitParms().privacy
 
   @property
   def CurrentOperFreq(self):
-    freq = self._MocaCtlGetField(self._MocaCtlShowStatus, 'rfChannel')
-    if freq:
-      return IntOrZero(freq.split()[0])
-    return 0
+    return self._Status().rf_channel
 
   @property
   def LastOperFreq(self):
-    last = self._MocaCtlGetField(self._MocaCtlShowInitParms,
-                                 'Nv Params - Last Oper Freq')
-    if last:
-      return IntOrZero(last.split()[0])
-    return 0
+    return self._InitParms().last_oper_freq
 
   @property
   def QAM256Capable(self):
-    qam = self._MocaCtlGetField(self._MocaCtlShowInitParms, 'qam256Capability')
-    return True if qam == 'on' else False
+    return self._InitParms().qam256
 
   @property
   def PacketAggregationCapability(self):
-    # example: "maxPktAggr   : 10 pkts"
-    pkts = self._MocaCtlGetField(self._MocaCtlShowConfig, 'maxPktAggr')
-    if pkts:
-      return IntOrZero(pkts.split()[0])
-    return 0
+    return self._Config().max_pkt_aggr
 
   @property
   def AssociatedDeviceNumberOfEntries(self):
-    return len(self.AssociatedDeviceList)
-
-  def _MocaCtlGetNodeIDs(self):
-    """Return a list of active MoCA Node IDs."""
-    mc = subprocess.Popen([MOCACTL, 'showtbl', '--nodestats'],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
-    node_re = re.compile('\ANode\s*: (\d+)')
-    nodes = set()
-    for line in out.splitlines():
-      node = node_re.search(line)
-      if node is not None:
-        nodes.add(int(node.group(1)))
-    return list(nodes)
+    return len(MocaNodeIDs(MOCACTL))
 
   def GetAssociatedDevice(self, nodeid):
     """Get an AssociatedDevice object for the given NodeID."""
-    ad = BrcmMocaAssociatedDevice(nodeid)
-    if ad:
-      ad.ValidateExports()
-    return ad
+    return BrcmMocaAssociatedDevice(nodeid)
 
   def IterAssociatedDevices(self):
     """Retrieves a list of all associated devices."""
-    mocanodes = self._MocaCtlGetNodeIDs()
+    mocanodes = MocaNodeIDs(MOCACTL)
     for idx, nodeid in enumerate(mocanodes):
       yield idx, self.GetAssociatedDevice(nodeid)
 
   def GetAssociatedDeviceByIndex(self, index):
-    mocanodes = self._MocaCtlGetNodeIDs()
+    mocanodes = MocaNodeIDs(MOCACTL)
     return self.GetAssociatedDevice(mocanodes[index])
 
 
@@ -296,92 +463,19 @@ class BrcmMocaAssociatedDevice(BASE181MOCA.Interface.AssociatedDevice):
   def __init__(self, nodeid):
     BASE181MOCA.Interface.AssociatedDevice.__init__(self)
     self.NodeID = nodeid
-    self.MACAddress = ''
-    self.PreferredNC = False
     self.Unexport('HighestVersion')
-    self.PHYTxRate = 0
-    self.PHYRxRate = 0
-    self.TxPowerControlReduction = 0
-    self.RxPowerLevel = 0
-    self.TxBcastRate = 0
-    self.RxBcastPowerLevel = 0
-    self.TxPackets = 0
-    self.RxPackets = 0
-    self.RxErroredAndMissedPackets = 0
-    self.QAM256Capable = 0
-    self.PacketAggregationCapability = 0
-    self.RxSNR = 0
     self.Unexport('Active')
-
-    self.ParseNodeStatus()
-    self.ParseNodeStats()
-
-  def ParseNodeStatus(self):
-    """Run mocactl show --nodestatus for this node, parse the output."""
-    mac_re = re.compile(
-        '^MAC Address\s+: ((?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2})')
-    pnc_re = re.compile('Preferred NC\s+: (\d+)')
-    ptx_re = re.compile('\ATxUc.+?(\d+[.]?\d*)\s+dBm.*?(\d+)\s+bps')
-    prx_re = re.compile('\ARxUc.+?(\d+[.]?\d*)\s+dBm.*?(\d+)\s+bps'
-                        '\s+(\d+[.]?\d*) dB')
-    rxb_re = re.compile('\ARxBc.+?(\d+[.]?\d*)\s+dBm.*?(\d+)\s+bps')
-    qam_re = re.compile('256 QAM capable\s+:\s+(\d+)')
-    agg_re = re.compile('Aggregated PDUs\s+:\s+(\d+)')
-    mc = subprocess.Popen([MOCACTL, 'show', '--nodestatus', str(self.NodeID)],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
-    for line in out.splitlines():
-      mac = mac_re.search(line)
-      if mac is not None:
-        self.MACAddress = mac.group(1)
-      pnc = pnc_re.search(line)
-      if pnc is not None:
-        self.PreferredNC = False if pnc.group(1) is '0' else True
-      ptx = ptx_re.search(line)
-      if ptx is not None:
-        self.PHYTxRate = IntOrZero(ptx.group(2)) / 1000000
-        self.TxPowerControlReduction = int(FloatOrZero(ptx.group(1)))
-      prx = prx_re.search(line)
-      if prx is not None:
-        self.PHYRxRate = IntOrZero(prx.group(2)) / 1000000
-        self.RxPowerLevel = int(FloatOrZero(prx.group(1)))
-        # TODO(dgentry) This cannot be right. SNR should be dB, not an integer.
-        self.RxSNR = int(FloatOrZero(prx.group(3)))
-      rxb = rxb_re.search(line)
-      if rxb is not None:
-        self.TxBcastRate = IntOrZero(rxb.group(2)) / 1000000
-        self.RxBcastPowerLevel = int(FloatOrZero(rxb.group(1)))
-      qam = qam_re.search(line)
-      if qam is not None:
-        self.QAM256Capable = False if qam.group(1) is '0' else True
-      agg = agg_re.search(line)
-      if agg is not None:
-        self.PacketAggregationCapability = IntOrZero(agg.group(1))
-
-  def ParseNodeStats(self):
-    """Run mocactl show --nodestats for this node, parse the output."""
-    tx_re = re.compile('Unicast Tx Pkts To Node\s+: (\d+)')
-    rx_re = re.compile('Unicast Rx Pkts From Node\s+: (\d+)')
-    e1_re = re.compile('Rx CodeWord ErrorAndUnCorrected\s+: (\d+)')
-    e2_re = re.compile('Rx NoSync Errors\s+: (\d+)')
-    mc = subprocess.Popen([MOCACTL, 'show', '--nodestats', str(self.NodeID)],
-                          stdout=subprocess.PIPE)
-    out, _ = mc.communicate(None)
-    rx_err = 0
-    for line in out.splitlines():
-      tx = tx_re.search(line)
-      if tx is not None:
-        self.TxPackets = IntOrZero(tx.group(1))
-      rx = rx_re.search(line)
-      if rx is not None:
-        self.RxPackets = IntOrZero(rx.group(1))
-      e1 = e1_re.search(line)
-      if e1 is not None:
-        rx_err += IntOrZero(e1.group(1))
-      e2 = e2_re.search(line)
-      if e2 is not None:
-        rx_err += IntOrZero(e2.group(1))
-    self.RxErroredAndMissedPackets = rx_err
+    self.DeclarePrefetch(MocaNode._fields, FetchMocaNodeTable)
+
+  def __getattr__(self, name):
+    # The node table is only built when a parameter is actually asked for.
+    if not name.startswith('_') and name in MocaNode._fields:
+      node = MocaNodeTable(MOCACTL).get(self.NodeID)
+      if node is None:
+        node = _GetNode(MOCACTL, self.NodeID)  # not in the node list
+      return getattr(node, name)
+    else:
+      raise AttributeError
 
 
 class BrcmMoca(BASE181MOCA):
@@ -20,8 +20,16 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import datetime
+import os
+import shutil
+import tempfile
 import unittest
 import google3
+import tornado.ioloop
+import tr.api
+import tr.cmdcache
+import tr.cwmp_session
 import brcmmoca
 import netdev
 
@@ -30,6 +38,8 @@ class MocaTest(unittest.TestCase):
   """Tests for brcmmoca.py."""
 
   def setUp(self):
+    tr.cmdcache.Instance().Flush()
+    tr.cwmp_session.cache.new_tick()
     self.old_MOCACTL = brcmmoca.MOCACTL
     self.old_PYNETIFCONF = brcmmoca.PYNETIFCONF
     self.old_PROC_NET_DEV = netdev.PROC_NET_DEV
@@ -132,6 +142,57 @@ class MocaTest(unittest.TestCase):
     brcmmoca.MOCACTL = 'testdata/brcmmoca/mocactl_up2'
     self.assertEqual(moca.LastChange, 119728800)
 
+  def testParseFields(self):
+    out = ('rfChannel                 : 999 Mhz     bwStatus    : 0x0\n'
+           'Nv Params - Last Oper Freq : 899 Mhz\n'
+           'HighPrioAlloc (Resv:Limit)  : 1:300\n'
+           'linkUpTime  : 1h:00m:01s  backupNcId  : 5\n')
+    self.assertEqual(brcmmoca._ParseFields(out),
+                     {'rfChannel': '999', 'bwStatus': '0x0',
+                      'Nv Params - Last Oper Freq': '899',
+                      'linkUpTime': '1h:00m:01s', 'backupNcId': '5'})
+
+  def testSnapshotForks(self):
+    brcmmoca.PYNETIFCONF = MockPynet
+    tmpdir = tempfile.mkdtemp()
+    log = os.path.join(tmpdir, 'log')
+    brcmmoca.MOCACTL = os.path.join(tmpdir, 'mocactl')
+    f = open(brcmmoca.MOCACTL, 'w')
+    f.write('#!/bin/sh\necho $* >>%s\nexec %s "$@"\n' % (
+        log, os.path.abspath('../platform/gfmedia/testdata/device/mocactl')))
+    f.close()
+    os.chmod(brcmmoca.MOCACTL, 0755)
+    params = ['LastChange', 'FirmwareVersion', 'HighestVersion',
+              'CurrentVersion', 'NetworkCoordinator', 'NodeID', 'BackupNC',
+              'PrivacyEnabled', 'CurrentOperFreq', 'LastOperFreq',
+              'QAM256Capable', 'PacketAggregationCapability']
+    try:
+      moca = brcmmoca.BrcmMocaInterface(ifname='foo0', upstream=False)
+      values = dict((p, moca.GetExport(p)) for p in params)
+      self.assertEqual(values['LastChange'], 3601)
+      self.assertEqual(values['FirmwareVersion'], '5.6.789')
+      self.assertEqual(values['NetworkCoordinator'], 1)
+      self.assertEqual(values['NodeID'], 2)
+      self.assertEqual(values['BackupNC'], '5')
+      self.assertEqual(values['CurrentOperFreq'], 999)
+      self.assertEqual(values['PacketAggregationCapability'], 10)
+
+      # every getter again, even with the command cache gone, is served
+      # from the snapshot: one fork per mocactl view.
+      tr.cmdcache.Instance().Flush()
+      for p in params:
+        self.assertEqual(moca.GetExport(p), values[p])
+      self.assertEqual(sorted(open(log).read().splitlines()),
+                       ['show --config', 'show --initparms', 'show --status'])
+
+      # the next tick takes a new snapshot.
+      tr.cmdcache.Instance().Flush()
+      tr.cwmp_session.cache.new_tick()
+      self.assertEqual(moca.NodeID, 2)
+      self.assertEqual(len(open(log).read().splitlines()), 4)
+    finally:
+      shutil.rmtree(tmpdir)
+
   def testAssociatedDevice(self):
     brcmmoca.MOCACTL = 'testdata/brcmmoca/mocactl'
     moca = brcmmoca.BrcmMocaInterface(ifname='foo0', upstream=False)
@@ -173,6 +234,98 @@ class MocaTest(unittest.TestCase):
     self.assertEqual(ad.PacketAggregationCapability, 7)
     self.assertEqual(ad.RxSNR, 38)
 
+  def testPrefetch(self):
+    brcmmoca.PYNETIFCONF = MockPynet
+    tmpdir = tempfile.mkdtemp()
+    log = os.path.join(tmpdir, 'log')
+    brcmmoca.MOCACTL = os.path.join(tmpdir, 'mocactl')
+    f = open(brcmmoca.MOCACTL, 'w')
+    f.write('#!/bin/sh\necho $* >>%s\nexec %s "$@"\n'
+            % (log, os.path.abspath('testdata/brcmmoca/mocactl')))
+    f.close()
+    os.chmod(brcmmoca.MOCACTL, 0755)
+    try:
+      moca = brcmmoca.BrcmMocaInterface(ifname='foo0', upstream=False)
+      cpe = tr.api.CPE(moca)
+      params = ['FirmwareVersion', 'HighestVersion', 'CurrentVersion',
+                'BackupNC', 'CurrentOperFreq', 'NodeID', 'PrivacyEnabled',
+                'LastOperFreq', 'QAM256Capable', 'PacketAggregationCapability']
+      result = cpe.GetParameterValues(params)
+      loop = tornado.ioloop.IOLoop.instance()
+      result.AddCallback(lambda unused_d: loop.stop())
+      tmo = loop.add_timeout(datetime.timedelta(seconds=10), loop.stop)
+      loop.start()
+      loop.remove_timeout(tmo)
+      values = dict(result.Get())
+      self.assertEqual(values['FirmwareVersion'], '5.6.789')
+      self.assertEqual(values['LastOperFreq'], 899)
+      self.assertEqual(values['PacketAggregationCapability'], 10)
+      # one invocation per mocactl command, not one per parameter.
+      self.assertEqual(sorted(open(log).read().splitlines()),
+                       ['show --config', 'show --initparms', 'show --status'])
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def testNodeTable(self):
+    brcmmoca.PYNETIFCONF = MockPynet
+    tmpdir = tempfile.mkdtemp()
+    log = os.path.join(tmpdir, 'log')
+    brcmmoca.MOCACTL = os.path.join(tmpdir, 'mocactl')
+    f = open(brcmmoca.MOCACTL, 'w')
+    f.write('#!/bin/sh\n'
+            'echo start $* >>%s\n'
+            'if [ "$1" = showtbl ]; then\n'
+            '  for i in $(seq 0 15); do echo "Node  : $i"; done\n'
+            'elif [ "$2" = --nodestatus ]; then\n'
+            '  sleep 0.05\n'
+            '  echo "MAC Address    : 00:01:00:11:23:$(printf %%02d $3)"\n'
+            'elif [ "$2" = --nodestats ]; then\n'
+            '  sleep 0.05\n'
+            '  echo "Unicast Tx Pkts To Node    : $3"\n'
+            'fi\n'
+            'echo end >>%s\n' % (log, log))
+    f.close()
+    os.chmod(brcmmoca.MOCACTL, 0755)
+    try:
+      moca = brcmmoca.BrcmMocaInterface(ifname='foo0', upstream=False)
+      cpe = tr.api.CPE(moca)
+      result = cpe.GetParameterValues(['AssociatedDeviceNumberOfEntries',
+                                       'AssociatedDevice.'])
+      loop = tornado.ioloop.IOLoop.instance()
+      result.AddCallback(lambda unused_d: loop.stop())
+      tmo = loop.add_timeout(datetime.timedelta(seconds=30), loop.stop)
+      loop.start()
+      loop.remove_timeout(tmo)
+      values = dict(result.Get())
+      self.assertEqual(values['AssociatedDeviceNumberOfEntries'], 16)
+      self.assertEqual(values['AssociatedDevice.15.MACAddress'],
+                       '00:01:00:11:23:15')
+      self.assertEqual(values['AssociatedDevice.3.TxPackets'], 3)
+
+      # the node list once, then two commands per node.
+      calls = [l for l in open(log).read().splitlines() if l != 'end']
+      self.assertEqual(len(calls), 1 + 2 * 16)
+      self.assertEqual(len(set(calls)), len(calls))
+
+      # several nodes were fetched at once, but no more than the limit.
+      inflight = peak = 0
+      for line in open(log):
+        inflight += -1 if line.strip() == 'end' else 1
+        peak = max(peak, inflight)
+      self.assertTrue(1 < peak <= brcmmoca.MOCA_NODE_FANOUT, peak)
+
+      # within a tick, the node table is built once for all nodes.
+      tr.cwmp_session.cache.new_tick()
+      misses = brcmmoca.MocaNodeTable.misses
+      for i in range(16):
+        ad = moca.GetAssociatedDeviceByIndex(i)
+        self.assertEqual(ad.TxPackets, i)
+      self.assertEqual(moca.AssociatedDeviceNumberOfEntries, 16)
+      self.assertEqual(brcmmoca.MocaNodeTable.misses, misses + 1)
+      self.assertEqual(len(open(log).read().splitlines()), 2 * len(calls))
+    finally:
+      shutil.rmtree(tmpdir)
+
 
 class MockPynet(object):
   v_is_up = True
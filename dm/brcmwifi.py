@@ -31,9 +31,11 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import collections
 import copy
+import datetime
 import re
 import subprocess
-import time
+import tornado.ioloop
+import tr.cmdcache
 import tr.core
 import tr.cwmpbool
 import tr.tr098_v1_4
@@ -54,9 +56,42 @@ EM_WAPI = 0x100  # Not enumerated in tr-98
 
 # Unit tests can override these.
 WL_EXE = '/usr/bin/wl'
+WL_TTL = 2  # seconds, see tr/cmdcache.py
+WL_STATIC_TTL = 300  # for things which only change when we change them
 WL_SLEEP = 3  # Broadcom recommendation for 3 second sleep before final join.
 # Broadcom recommendation for delay while scanning for a channel
 WL_AUTOCHAN_SLEEP = 2
+WL_STA_FANOUT = 4  # sta_info commands to run at once
+
+# The wl command each WLANConfiguration parameter is parsed from,
+# see tr.core.Exporter.DeclarePrefetch.
+WL_PREFETCH = {
+    'AutoRateFallBackEnabled': 'interference',
+    'BasicDataTransmitRates': 'rateset',
+    'BSSID': 'bssid',
+    'Channel': 'channel',
+    'IEEE11iAuthenticationMode': 'wpa_auth',
+    'IEEE11iEncryptionModes': 'wsec',
+    'OperationalDataTransmitRates': 'rateset',
+    'RadioEnabled': 'radio',
+    'RegulatoryDomain': 'country',
+    'SSID': 'ssid',
+    'SSIDAdvertisementEnabled': 'closed',
+    'Status': 'bss',
+    'TotalBytesReceived': 'counters',
+    'TotalBytesSent': 'counters',
+    'TotalPacketsReceived': 'counters',
+    'TotalPacketsSent': 'counters',
+    'TransmitPower': 'pwr_percent',
+    'WPAAuthenticationMode': 'wpa_auth',
+    'WPAEncryptionModes': 'wsec',
+}
+
+# A station, as reported by wl sta_info.
+AssociatedDevice = collections.namedtuple(
+    'AssociatedDevice', ('AssociatedDeviceMACAddress '
+                         'AssociatedDeviceAuthenticationState '
+                         'LastDataTransmitRate'))
 
 # Parameter enumerations
 BEACONS = frozenset(['None', 'Basic', 'WPA', '11i', 'BasicandWPA',
@@ -75,6 +110,26 @@ def IsInteger(value):
   return True
 
 
+def _ParseStaInfo(mac, out):
+  """Returns an AssociatedDevice for the output of wl sta_info mac."""
+  auth = False
+  rate = '0'
+  tx_re = re.compile('rate of last tx pkt: (\d+) kbps')
+  for line in out.splitlines():
+    if line.find('AUTHENTICATED') >= 0:
+      auth = True
+    tx_rate = tx_re.search(line)
+    if tx_rate is not None:
+      try:
+        mbps = int(tx_rate.group(1)) / 1000
+      except ValueError:
+        mbps = 0
+      rate = str(mbps)
+  return AssociatedDevice(AssociatedDeviceMACAddress=mac,
+                          AssociatedDeviceAuthenticationState=auth,
+                          LastDataTransmitRate=rate)
+
+
 class WifiConfig(object):
   """A dumb data object to store config settings."""
   pass
@@ -88,19 +143,34 @@ class Wl(object):
 
   This object cannot retain any state about the Wifi configuration, as
   both tr-98 and tr-181 can have instances of this object. It has to
-  consult the wl utility for all state information."""
+  consult the wl utility for all state information.  Its output is kept
+  for a few seconds in tr.cmdcache, so the getters in one request share
+  a single run of each wl command."""
 
   def __init__(self, interface):
     self._if = interface
+    self._sta_limiter = tr.core.Limiter(WL_STA_FANOUT)
+    self._sta_fetches = dict()
+
+  def _Argv(self, cmd):
+    return [WL_EXE, '-i', self._if] + list(cmd)
 
   def _SubprocessCall(self, cmd):
-    subprocess.check_call([WL_EXE, '-i', self._if] + cmd)
+    try:
+      subprocess.check_call([WL_EXE, '-i', self._if] + cmd)
+    finally:
+      self._Invalidate()
 
-  def _SubprocessWithOutput(self, cmd):
-    wl = subprocess.Popen([WL_EXE, '-i', self._if] + cmd,
-                          stdout=subprocess.PIPE)
-    out, _ = wl.communicate(None)
-    return out
+  def _SubprocessWithOutput(self, cmd, ttl=WL_TTL):
+    return tr.cmdcache.Instance().Get(self._Argv(cmd), ttl=ttl)
+
+  def Prefetch(self, cmd):
+    """Start fetching wl output, see tr.core.Exporter.DeclarePrefetch."""
+    return tr.cmdcache.Instance().GetDeferred(self._Argv([cmd]), ttl=WL_TTL)
+
+  def _Invalidate(self):
+    """We've changed the configuration, cached wl output is now wrong."""
+    tr.cmdcache.Instance().Invalidate([WL_EXE, '-i', self._if])
 
   def GetWlCounters(self):
     out = self._SubprocessWithOutput(['counters'])
@@ -129,19 +199,23 @@ class Wl(object):
     return sdict
 
   def DoAutoChannelSelect(self):
-    """Run the AP through an auto channel selection."""
+    """Run the AP through an auto channel selection.
+
+    This is a generator: it yields the number of seconds to wait before
+    continuing, see BrcmWifiWlanConfiguration._ContinueConfigure.
+    """
     # Make sure the interface is up, and ssid is the empty string.
     self._SubprocessCall(['down'])
     self._SubprocessCall(['spect', '0'])
     self._SubprocessCall(['mpc', '0'])
     self._SubprocessCall(['up'])
     self._SubprocessCall(['ssid', ''])
-    time.sleep(WL_SLEEP)
+    yield WL_SLEEP
     # This starts a scan, and we give it some time to complete.
     # TODO(jnewlin): Chat with broadcom about how long we need/should
     # wait before setting the autoscanned channel.
     self._SubprocessCall(['autochannel', '1'])
-    time.sleep(WL_AUTOCHAN_SLEEP)
+    yield WL_AUTOCHAN_SLEEP
     # This programs the channel with the best channel found during the
     # scan.
     self._SubprocessCall(['autochannel', '2'])
@@ -175,26 +249,31 @@ class Wl(object):
     Returns:
       An AssociatedDevice namedtuple.
     """
-    ad = collections.namedtuple(
-        'AssociatedDevice', ('AssociatedDeviceMACAddress '
-                             'AssociatedDeviceAuthenticationState '
-                             'LastDataTransmitRate'))
-    ad.AssociatedDeviceMACAddress = mac
-    ad.AssociatedDeviceAuthenticationState = False
-    ad.LastDataTransmitRate = '0'
     out = self._SubprocessWithOutput(['sta_info', mac.upper()])
-    tx_re = re.compile('rate of last tx pkt: (\d+) kbps')
-    for line in out.splitlines():
-      if line.find('AUTHENTICATED') >= 0:
-        ad.AssociatedDeviceAuthenticationState = True
-      tx_rate = tx_re.search(line)
-      if tx_rate is not None:
-        try:
-          mbps = int(tx_rate.group(1)) / 1000
-        except ValueError:
-          mbps = 0
-        ad.LastDataTransmitRate = str(mbps)
-    return ad
+    return _ParseStaInfo(mac, out)
+
+  def FetchAssociatedDevice(self, mac):
+    """Like GetAssociatedDevice(), but returns a tr.core.Deferred.
+
+    The Deferred is already done if tr.cmdcache has recent output.
+    Otherwise sta_info runs in the background, for at most WL_STA_FANOUT
+    stations at once, and callers asking about the same station while it
+    runs share the result.
+
+    Args:
+      mac: MAC address of the requested STA as a string, xx:xx:xx:xx:xx:xx
+    Returns:
+      a tr.core.Deferred for an AssociatedDevice namedtuple.
+    """
+    key = mac.upper()
+    d = self._sta_fetches.get(key)
+    if d is None:
+      d = self._sta_limiter.Run(tr.cmdcache.Instance().GetDeferred,
+                                self._Argv(['sta_info', key]), WL_TTL)
+      if not d.done:
+        self._sta_fetches[key] = d
+        d.AddCallback(lambda unused_d: self._sta_fetches.pop(key, None))
+    return d.Then(lambda out: _ParseStaInfo(mac, out))
 
   def GetAutoRateFallBackEnabled(self):
     """Return WLANConfiguration.AutoRateFallBackEnabled as a boolean."""
@@ -334,7 +413,7 @@ class Wl(object):
     self._SubprocessCall(['set_pmk', value])
 
   def GetPossibleChannels(self):
-    out = self._SubprocessWithOutput(['channels'])
+    out = self._SubprocessWithOutput(['channels'], ttl=WL_STATIC_TTL)
     if out:
       channels = [int(x) for x in out.split()]
       return wifi.ContiguousRanges(channels)
@@ -366,7 +445,7 @@ class Wl(object):
     self._SubprocessCall(['country', value])
 
   def ValidateRegulatoryDomain(self, value):
-    out = self._SubprocessWithOutput(['country', 'list'])
+    out = self._SubprocessWithOutput(['country', 'list'], ttl=WL_STATIC_TTL)
     countries = set()
     for line in out.splitlines():
       fields = line.split(' ')
@@ -446,6 +525,7 @@ class Wl(object):
     # We do not use check_call here because primary_key fails if no WEP
     # keys have been configured, but we keep the code simple to always set it.
     subprocess.call([WL_EXE, '-i', self._if, 'primary_key', str(index)])
+    self._Invalidate()
 
   def SetWepStatus(self, enable):
     status = 'on' if enable else 'off'
@@ -461,10 +541,14 @@ class Wl(object):
 class BrcmWifiWlanConfiguration(BASE98WIFI):
   """An implementation of tr98 WLANConfiguration for Broadcom Wifi chipsets."""
 
-  def __init__(self, ifname):
+  def __init__(self, ifname, ioloop=None):
     BASE98WIFI.__init__(self)
     self._ifname = ifname
+    self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
     self.wl = Wl(ifname)
+    self._configure = None
+    self._configure_done = None
+    self._configure_timer = None
 
     # Unimplemented, but not yet evaluated
     self.Unexport('Alias')
@@ -515,6 +599,9 @@ class BrcmWifiWlanConfiguration(BASE98WIFI):
     self.Unexport('PeerBSSID')
     self.Unexport('DistanceFromRoot')
 
+    for (param, cmd) in WL_PREFETCH.iteritems():
+      self.DeclarePrefetch([param], self.wl.Prefetch, cmd)
+
     self.config = self._GetDefaultSettings()
     self.old_config = None
 
@@ -550,8 +637,62 @@ class BrcmWifiWlanConfiguration(BASE98WIFI):
     self.old_config = None
 
   def CommitTransaction(self):
+    """Apply the new configuration to the wifi device.
+
+    The wl command sequence has to pause for the driver now and then.
+    It waits on ioloop timeouts instead of sleeping, so the rest of
+    cwmpd keeps running while the radio is reconfigured.
+
+    Returns:
+      a tr.core.Deferred which is done when the sequence is finished, or
+      None if it already finished without having to wait.
+    """
     self.old_config = None
-    self._ConfigureBrcmWifi()
+    if self._configure is not None:
+      # the new configuration supersedes one still being applied.
+      if self._configure_timer is not None:
+        self.ioloop.remove_timeout(self._configure_timer)
+      self._configure = None
+      self._configure_done.Resolve(None)
+    done = self._configure_done = tr.core.Deferred()
+    # Later SetParameterValues can change self.config and the key lists
+    # while this one is still being applied, so it works from a copy.
+    config = copy.copy(self.config)
+    psks = [psk.GetKeyDeferred(config.p_ssid)
+            for (unused_idx, psk) in sorted(self.PreSharedKeyList.items())]
+    weps = [(idx, wep.WEPKey)
+            for (idx, wep) in sorted(self.WEPKeyList.items())]
+    self._configure = self._ConfigureBrcmWifi(config, psks, weps)
+    self._ContinueConfigure()
+    if done.done:
+      done.Get()  # raise any exception right away, to our caller
+      return None
+    return done
+
+  def _ContinueConfigure(self):
+    """Run _ConfigureBrcmWifi until it wants to wait, or is finished."""
+    self._configure_timer = None
+    done = self._configure_done
+    configure = self._configure
+    try:
+      for delay in configure:
+        if isinstance(delay, tr.core.Deferred):
+          delay.AddCallback(lambda unused_d: self._Resume(configure))
+          return
+        if delay > 0:
+          self._configure_timer = self.ioloop.add_timeout(
+              datetime.timedelta(seconds=delay), self._ContinueConfigure)
+          return
+    except Exception:  #gpylint: disable-msg=W0703
+      self._configure = None
+      done.Fail()
+      return
+    self._configure = None
+    done.Resolve(None)
+
+  def _Resume(self, configure):
+    if self._configure is configure:  # not superseded while we waited
+      self._ContinueConfigure()
 
   @property
   def Name(self):
@@ -583,7 +724,7 @@ class BrcmWifiWlanConfiguration(BASE98WIFI):
 
   @property
   def TotalAssociations(self):
-    return len(self.AssociatedDeviceList)
+    return len(self.wl.GetAssociatedDevices())
 
   def GetAutoRateFallBackEnabled(self):
     return self.wl.GetAutoRateFallBackEnabled()
@@ -839,7 +980,7 @@ class BrcmWifiWlanConfiguration(BASE98WIFI):
   WPAEncryptionModes = property(GetEncryptionModes, SetWPAEncryptionModes, None,
                                 'WLANConfiguration.WPAEncryptionModes')
 
-  def _ConfigureBrcmWifi(self):
+  def _ConfigureBrcmWifi(self, config, psks, weps):
     """Issue commands to the wifi device to configure it.
 
     The Wifi driver is somewhat picky about the order of the commands.
@@ -847,71 +988,81 @@ class BrcmWifiWlanConfiguration(BASE98WIFI):
     Make sure any changes made in this routine work in a real system, unit
     tests do not (and realistically, cannot) model all behaviors of the
     real wl utility.
+
+    This is a generator: it yields the number of seconds to wait before
+    continuing, or a tr.core.Deferred to wait for, see _ContinueConfigure.
+
+    Args:
+      config: the WifiConfig to apply, not changed by anyone else.
+      psks: a list of tr.core.Deferred for the PreSharedKeyList keys.
+      weps: a list of (index, WEPKey) tuples.
     """
 
-    if not self.config.p_enable or not self.config.p_radio_enabled:
+    if not config.p_enable or not config.p_radio_enabled:
       self.wl.SetRadioEnabled(False)
       return
 
     self.wl.SetRadioEnabled(True)
     self.wl.SetApMode()
-    if self.config.p_auto_channel_enable:
-      self.wl.DoAutoChannelSelect()
+    if config.p_auto_channel_enable:
+      for delay in self.wl.DoAutoChannelSelect():
+        yield delay
     self.wl.SetBssStatus(False)
-    if self.config.p_auto_rate_fallback_enabled is not None:
+    if config.p_auto_rate_fallback_enabled is not None:
       self.wl.SetAutoRateFallBackEnabled(
-          self.config.p_auto_rate_fallback_enabled)
-    if self.config.p_bssid is not None:
-      self.wl.SetBSSID(self.config.p_bssid)
-    if self.config.p_channel is not None:
-      self.wl.SetChannel(self.config.p_channel)
-    if self.config.p_regulatory_domain is not None:
-      self.wl.SetRegulatoryDomain(self.config.p_regulatory_domain)
-    if self.config.p_ssid_advertisement_enabled is not None:
+          config.p_auto_rate_fallback_enabled)
+    if config.p_bssid is not None:
+      self.wl.SetBSSID(config.p_bssid)
+    if config.p_channel is not None:
+      self.wl.SetChannel(config.p_channel)
+    if config.p_regulatory_domain is not None:
+      self.wl.SetRegulatoryDomain(config.p_regulatory_domain)
+    if config.p_ssid_advertisement_enabled is not None:
       self.wl.SetSSIDAdvertisementEnabled(
-          self.config.p_ssid_advertisement_enabled)
-    if self.config.p_transmit_power is not None:
-      self.wl.SetTransmitPower(self.config.p_transmit_power)
+          config.p_ssid_advertisement_enabled)
+    if config.p_transmit_power is not None:
+      self.wl.SetTransmitPower(config.p_transmit_power)
 
     # sup_wpa should only be set WPA/WPA2 modes, not for Basic.
     sup_wpa = False
     amode = 0
-    if self.config.p_beacon_type.find('11i') >= 0:
-      crypto = self.wl.EM_StringToBitmap(self.config.p_ieee11i_encryption_modes)
+    if config.p_beacon_type.find('11i') >= 0:
+      crypto = self.wl.EM_StringToBitmap(config.p_ieee11i_encryption_modes)
       if crypto != EM_NONE:
         amode = 128
       sup_wpa = True
-    elif self.config.p_beacon_type.find('WPA') >= 0:
-      crypto = self.wl.EM_StringToBitmap(self.config.p_wpa_encryption_modes)
+    elif config.p_beacon_type.find('WPA') >= 0:
+      crypto = self.wl.EM_StringToBitmap(config.p_wpa_encryption_modes)
       if crypto != EM_NONE:
         amode = 4
       sup_wpa = True
-    elif self.config.p_beacon_type.find('Basic') >= 0:
-      crypto = self.wl.EM_StringToBitmap(self.config.p_basic_encryption_modes)
+    elif config.p_beacon_type.find('Basic') >= 0:
+      crypto = self.wl.EM_StringToBitmap(config.p_basic_encryption_modes)
     else:
       crypto = EM_NONE
     self.wl.SetEncryptionModes(crypto)
     self.wl.SetSupWpa(sup_wpa)
     self.wl.SetWpaAuth(amode)
 
-    for idx, psk in self.PreSharedKeyList.items():
-      key = psk.GetKey(self.config.p_ssid)
+    for d in psks:
+      if not d.done:
+        yield d  # PBKDF2 runs in a worker thread
+      key = d.Get()
       if key:
         self.wl.SetPMK(key)
 
-    if self.config.p_ssid is not None:
-      time.sleep(WL_SLEEP)
-      self.wl.SetSSID(self.config.p_ssid)
+    if config.p_ssid is not None:
+      yield WL_SLEEP
+      self.wl.SetSSID(config.p_ssid)
 
     # Setting WEP key has to come after setting SSID. (Doesn't make sense
     # to me, it just doesn't work if you do it before setting SSID.)
-    for idx, wep in self.WEPKeyList.items():
-      key = wep.WEPKey
+    for (idx, key) in weps:
       if key is None:
         self.wl.ClrWepKey(idx-1)
       else:
         self.wl.SetWepKey(idx-1, key)
-    self.wl.SetWepKeyIndex(self.config.p_wepkeyindex)
+    self.wl.SetWepKeyIndex(config.p_wepkeyindex)
 
   def GetTotalBytesReceived(self):
     # TODO(dgentry) cache for lifetime of session
@@ -944,9 +1095,8 @@ class BrcmWifiWlanConfiguration(BASE98WIFI):
 
   def GetAssociation(self, mac):
     """Get an AssociatedDevice object for the given STA."""
-    ad = BrcmWlanAssociatedDevice(self.wl.GetAssociatedDevice(mac))
-    if ad:
-      ad.ValidateExports()
+    ad = BrcmWlanAssociatedDevice(self.wl, mac)
+    ad.ValidateExports()
     return ad
 
   def IterAssociations(self):
@@ -971,17 +1121,28 @@ class BrcmWlanConfigurationStats(netdev.NetdevStatsLinux26, BASE98WIFI.Stats):
 class BrcmWlanAssociatedDevice(BASE98WIFI.AssociatedDevice):
   """Implementation of tr98 AssociatedDevice for Broadcom Wifi chipsets."""
 
-  def __init__(self, device):
+  def __init__(self, wl, mac):
     BASE98WIFI.AssociatedDevice.__init__(self)
-    self._device = device
+    self._wl = wl
+    self._mac = mac
     self.Unexport('AssociatedDeviceIPAddress')
     self.Unexport('LastPMKId')
     self.Unexport('LastRequestedUnicastCipher')
     self.Unexport('LastRequestedMulticastCipher')
 
+  @property
+  def AssociatedDeviceMACAddress(self):
+    return self._mac
+
   def __getattr__(self, name):
-    if hasattr(self._device, name):
-      return getattr(self._device, name)
+    # sta_info runs in the background, so each station's getters return
+    # a tr.core.Deferred until its output is in tr.cmdcache.  This lets
+    # a GetParameterValues fetch all of the stations at once.
+    if not name.startswith('_') and name in AssociatedDevice._fields:
+      d = self._wl.FetchAssociatedDevice(self._mac)
+      if d.done:
+        return getattr(d.Get(), name)
+      return d.Then(lambda ad: getattr(ad, name))
     else:
       raise AttributeError
 
@@ -20,18 +20,28 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import datetime
 import os
+import shutil
 import stat
 import tempfile
+import time
 import unittest
 
 import google3
+import tornado.ioloop
+import tr.api
+import tr.cmdcache
+import tr.core
+import tr.cwmp_session
 import brcmwifi
 import netdev
 
 
 class BrcmWifiTest(unittest.TestCase):
   def setUp(self):
+    tr.cmdcache.Instance().Flush()
+    tr.cwmp_session.cache.new_tick()
     self.old_WL_EXE = brcmwifi.WL_EXE
     brcmwifi.WL_EXE = 'testdata/brcmwifi/wlempty'
     brcmwifi.WL_SLEEP = 0
@@ -629,6 +639,18 @@ class BrcmWifiTest(unittest.TestCase):
     self.assertTrue(self.RmFromList(outlist, 'set_pmk password1'))
     self.assertFalse(outlist)
 
+  def Resolve(self, value):
+    """Run the ioloop until a tr.core.Deferred value is done."""
+    if not isinstance(value, tr.core.Deferred):
+      return value
+    if not value.done:
+      loop = tornado.ioloop.IOLoop.instance()
+      value.AddCallback(lambda unused_d: loop.stop())
+      tmo = loop.add_timeout(datetime.timedelta(seconds=5), loop.stop)
+      loop.start()
+      loop.remove_timeout(tmo)
+    return value.Get()
+
   def testStats(self):
     netdev.PROC_NET_DEV = 'testdata/brcmwifi/proc_net_dev'
     bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0')
@@ -665,17 +687,165 @@ class BrcmWifiTest(unittest.TestCase):
     for ad in bw.AssociatedDeviceList.values():
       ad.ValidateExports()
       mac = ad.AssociatedDeviceMACAddress.lower()
-      self.assertEqual(ad.LastDataTransmitRate, speeds[mac])
-      self.assertEqual(ad.AssociatedDeviceAuthenticationState, auth[mac])
+      self.assertEqual(self.Resolve(ad.LastDataTransmitRate), speeds[mac])
+      self.assertEqual(self.Resolve(ad.AssociatedDeviceAuthenticationState),
+                       auth[mac])
       seen.add(mac)
     self.assertEqual(len(seen), 3)
 
+  def testCommitDoesNotStallIoloop(self):
+    (script, out) = self.MakeTestScript()
+    brcmwifi.WL_EXE = script.name
+    brcmwifi.WL_SLEEP = 0.2
+    brcmwifi.WL_AUTOCHAN_SLEEP = 0.2
+    loop = tornado.ioloop.IOLoop()
+    try:
+      bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0', ioloop=loop)
+      cpe = tr.api.CPE(bw)
+      ticks = []
+      timer = tornado.ioloop.PeriodicCallback(
+          lambda: ticks.append(time.time()), 10, io_loop=loop)
+      timer.start()
+      start = time.time()
+      # Status 1: committed, but still being applied.
+      self.assertEqual(cpe.SetParameterValues(
+          [('Enable', 'True'), ('RadioEnabled', 'True'),
+           ('AutoChannelEnable', 'True'), ('SSID', 'myssid')], 0), 1)
+      self.assertTrue(time.time() - start < 0.2)
+      bw._configure_done.AddCallback(lambda unused_d: loop.stop())
+      loop.start()
+      timer.stop()
+      self.assertTrue(time.time() - start >= 0.6)
+      output = out.read()
+      self.assertTrue('-i wifi0 autochannel 2' in output)
+      self.assertTrue('-i wifi0 ssid myssid' in output)
+      # the ioloop kept running while we waited for the driver.
+      stall = max([b - a for (a, b) in zip(ticks, ticks[1:])])
+      self.assertTrue(stall < 0.1, stall)
+    finally:
+      brcmwifi.WL_SLEEP = 0
+      brcmwifi.WL_AUTOCHAN_SLEEP = 0
+      loop.close(all_fds=True)
+
+  def testCommitSupersedesPending(self):
+    (script, out) = self.MakeTestScript()
+    brcmwifi.WL_EXE = script.name
+    brcmwifi.WL_SLEEP = 30
+    loop = tornado.ioloop.IOLoop()
+    try:
+      bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0', ioloop=loop)
+      bw.StartTransaction()
+      bw.Enable = 'True'
+      bw.RadioEnabled = 'True'
+      bw.SSID = 'first'
+      first = bw.CommitTransaction()
+      self.assertFalse(first.done)
+      bw.StartTransaction()
+      bw.RadioEnabled = 'False'
+      self.assertEqual(bw.CommitTransaction(), None)
+      self.assertTrue(first.done)
+      self.assertFalse('ssid first' in out.read())
+    finally:
+      brcmwifi.WL_SLEEP = 0
+      loop.close(all_fds=True)
+
+  def testCommitUsesConfigAtCommit(self):
+    (script, out) = self.MakeTestScript()
+    brcmwifi.WL_EXE = script.name
+    brcmwifi.WL_SLEEP = 0.2
+    loop = tornado.ioloop.IOLoop()
+    try:
+      bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0', ioloop=loop)
+      bw.StartTransaction()
+      bw.Enable = 'True'
+      bw.RadioEnabled = 'True'
+      bw.AutoChannelEnable = 'False'
+      bw.SSID = 'first'
+      bw.WEPKeyList[1].WEPKey = 'firstkey'
+      done = bw.CommitTransaction()
+      self.assertFalse(done.done)
+      # a new transaction starts while the first is still being applied.
+      bw.StartTransaction()
+      bw.SSID = 'second'
+      bw.WEPKeyList[1].WEPKey = 'secondkey'
+      done.AddCallback(lambda unused_d: loop.stop())
+      loop.start()
+      output = out.read()
+      self.assertTrue('-i wifi0 ssid first' in output)
+      self.assertTrue('-i wifi0 addwep 0 firstkey' in output)
+      self.assertFalse('second' in output)
+    finally:
+      brcmwifi.WL_SLEEP = 0
+      loop.close(all_fds=True)
+
+  def testManyStations(self):
+    tmpdir = tempfile.mkdtemp()
+    log = os.path.join(tmpdir, 'log')
+    brcmwifi.WL_EXE = os.path.join(tmpdir, 'wl')
+    latency = 0.05
+    f = open(brcmwifi.WL_EXE, 'w')
+    f.write('#!/bin/sh\n'
+            'echo $* >>%s\n'
+            'if [ "$3" = assoclist ]; then\n'
+            '  for i in $(seq 10 73); do echo assoclist A0:B0:C0:00:00:$i; done\n'
+            'elif [ "$3" = sta_info ]; then\n'
+            '  sleep %s\n'
+            '  echo "   state: AUTHENTICATED ASSOCIATED"\n'
+            '  echo "   rate of last tx pkt: 54000 kbps"\n'
+            'fi\n' % (log, latency))
+    f.close()
+    os.chmod(brcmwifi.WL_EXE, 0755)
+    try:
+      bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0')
+      cpe = tr.api.CPE(bw)
+      start = time.time()
+      result = cpe.GetParameterValues(['AssociatedDevice.'])
+      loop = tornado.ioloop.IOLoop.instance()
+      result.AddCallback(lambda unused_d: loop.stop())
+      tmo = loop.add_timeout(datetime.timedelta(seconds=30), loop.stop)
+      loop.start()
+      loop.remove_timeout(tmo)
+      elapsed = time.time() - start
+      values = result.Get()
+      rates = [v for (p, v) in values if p.endswith('LastDataTransmitRate')]
+      self.assertEqual(rates, ['54'] * 64)
+      calls = open(log).read().splitlines()
+      self.assertEqual(len([c for c in calls if 'sta_info' in c]), 64)
+      self.assertEqual(len([c for c in calls if 'assoclist' in c]), 1)
+      # sta_info ran in parallel, not as 64 back to back calls.
+      self.assertTrue(elapsed < 64 * latency, elapsed)
+    finally:
+      shutil.rmtree(tmpdir)
+
   def testKeyPassphrase(self):
     netdev.PROC_NET_DEV = 'testdata/brcmwifi/proc_net_dev'
     bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0')
     bw.KeyPassphrase = 'testpassword'
     self.assertEqual(bw.KeyPassphrase, bw.PreSharedKeyList[1].KeyPassphrase)
 
+  def testKeyPassphraseCommit(self):
+    (script, out) = self.MakeTestScript()
+    brcmwifi.WL_EXE = script.name
+    bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0')
+    bw.StartTransaction()
+    bw.Enable = 'True'
+    bw.RadioEnabled = 'True'
+    bw.SSID = 'ThisIsASSID'
+    bw.KeyPassphrase = 'ThisIsAPassword%f' % time.time()  # not cached yet
+    done = bw.CommitTransaction()
+    # PBKDF2 is running in a thread, so the commit continues later.
+    self.assertFalse(done.done)
+    self.assertFalse('set_pmk' in out.read())
+    loop = tornado.ioloop.IOLoop.instance()
+    done.AddCallback(lambda unused_d: loop.stop())
+    tmo = loop.add_timeout(datetime.timedelta(seconds=10), loop.stop)
+    loop.start()
+    loop.remove_timeout(tmo)
+    done.Get()
+    out.seek(0)
+    key = bw.PreSharedKeyList[1].GetKey('ThisIsASSID')
+    self.assertTrue('-i wifi0 set_pmk %s' % key in out.read())
+
   def testAutoChannel(self):
     (script, out) = self.MakeTestScript()
     brcmwifi.WL_EXE = script.name
@@ -704,5 +874,57 @@ class BrcmWifiTest(unittest.TestCase):
     self.assertTrue(self.RmFromList(outlist, 'mpc 1'))
     self.assertTrue(self.RmFromList(outlist, 'spect 1'))
 
+  def testPrefetch(self):
+    (script, out) = self.MakeTestScript()
+    brcmwifi.WL_EXE = script.name
+    bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0')
+    cpe = tr.api.CPE(bw)
+    result = cpe.GetParameterValues(
+        ['TotalBytesReceived', 'TotalBytesSent', 'TotalPacketsReceived',
+         'TotalPacketsSent', 'BasicDataTransmitRates',
+         'OperationalDataTransmitRates', 'Channel', 'BeaconType'])
+    loop = tornado.ioloop.IOLoop.instance()
+    result.AddCallback(lambda unused_d: loop.stop())
+    tmo = loop.add_timeout(datetime.timedelta(seconds=10), loop.stop)
+    loop.start()
+    loop.remove_timeout(tmo)
+    self.assertEqual(len(result.Get()), 8)
+    # one invocation per wl command, not one per parameter.
+    self.assertEqual(sorted(out.read().splitlines()),
+                     ['-i wifi0 channel', '-i wifi0 counters',
+                      '-i wifi0 rateset'])
+    out.close()
+
+  def testWlInvocationsPerGpv(self):
+    (script, out) = self.MakeTestScript()
+    brcmwifi.WL_EXE = script.name
+    bw = brcmwifi.BrcmWifiWlanConfiguration('wifi0')
+    cpe = tr.api.CPE(bw)
+    params = sorted(brcmwifi.WL_PREFETCH)
+    # before: each getter ran wl for itself.  Emptying tr.cmdcache ahead
+    # of every parameter does the same.
+    for param in params:
+      tr.cmdcache.Instance().Flush()
+      tr.cwmp_session.cache.new_tick()
+      bw.GetExport(param)
+    before = len(out.read().splitlines())
+    self.assertEqual(before, len(params))
+
+    tr.cmdcache.Instance().Flush()
+    tr.cwmp_session.cache.new_tick()
+    result = cpe.GetParameterValues(params)
+    loop = tornado.ioloop.IOLoop.instance()
+    result.AddCallback(lambda unused_d: loop.stop())
+    tmo = loop.add_timeout(datetime.timedelta(seconds=10), loop.stop)
+    loop.start()
+    loop.remove_timeout(tmo)
+    self.assertEqual(len(result.Get()), len(params))
+    # after: the getters share one run of each distinct command.
+    after = len(out.read().splitlines())
+    out.close()
+    self.assertEqual(after, len(set(brcmwifi.WL_PREFETCH.values())))
+    self.assertTrue(after < before)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -23,7 +23,11 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 import json
 import sys
 import google3
+import tr.cmdcache
 import tr.core
+import tr.cwmp_session
+import tr.filecache
+import tr.scheduler
 import tr.x_catawampus_1_0
 
 BASEDM = tr.x_catawampus_1_0.X_CATAWAMPUS_ORG_CATAWAMPUS_v1_0
@@ -52,6 +56,16 @@ class CatawampusDm(BASEDM):
 
     return json.dumps(env)
 
+  @property
+  def RuntimeStats(self):
+    """Return string of counters from our caches, for monitoring."""
+    stats = dict()
+    stats['session_cache'] = tr.cwmp_session.cache.stats()
+    stats['cmdcache'] = tr.cmdcache.Instance().Stats()
+    stats['filecache'] = tr.filecache.Instance().Stats()
+    stats['scheduler'] = tr.scheduler.Instance().Stats()
+    return json.dumps(stats)
+
 
 if __name__ == '__main__':
   sys.path.append('../')
@@ -25,11 +25,16 @@ by http://www.broadband-forum.org/cwmp/tr-181-2-2-0.html
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import abc
-import glob
+import collections
 import os
+import re
 import tornado.ioloop
 import temperature
 import tr.core
+import tr.cwmp_session
+import tr.filecache
+import tr.helpers
+import tr.scheduler
 import tr.tr098_v1_4
 import tr.tr181_v2_2
 
@@ -38,12 +43,16 @@ BASE181DEVICE = tr.tr181_v2_2.Device_v2_2
 CATA181DEVICE = tr.x_catawampus_tr181_2_0.X_CATAWAMPUS_ORG_Device_v2_0
 
 # Unit tests can override these with fake data
-PERIODICCALL = tornado.ioloop.PeriodicCallback
+PERIODICCALL = tr.scheduler.PeriodicCallback
 PROC_MEMINFO = '/proc/meminfo'
 PROC_NET_DEV = '/proc/net/dev'
 PROC_UPTIME = '/proc/uptime'
 PROC_STAT = '/proc/stat'
 SLASH_PROC = '/proc'
+CPU_SAMPLE_INTERVAL = 5  # seconds
+MEMINFO_MIN_INTERVAL = 1.0  # seconds
+MEMINFO_BUFSIZE = 8192
+TIMENOW = tr.helpers.monotime
 
 
 class DeviceIdMeta(object):
@@ -105,7 +114,7 @@ class DeviceIdMeta(object):
 
 def _GetUptime():
   """Return a string of the number of integer seconds since boot."""
-  uptime = float(open(PROC_UPTIME).read().split()[0])
+  uptime = float(tr.filecache.Read(PROC_UPTIME).split()[0])
   return str(int(uptime))
 
 
@@ -173,69 +182,173 @@ class DeviceInfo181Linux26(CATA181DEVICE.DeviceInfo):
     self._next_led_number += 1
 
 
-class MemoryStatusLinux26(BASE181DEVICE.DeviceInfo.MemoryStatus):
+class MemoryStatusLinux26(CATA181DEVICE.DeviceInfo.MemoryStatus):
   """Abstraction to get memory information from the underlying platform.
 
-  Reads /proc/meminfo to find TotalMem and FreeMem.
+  Reads /proc/meminfo when a value is asked for, at most once every
+  MEMINFO_MIN_INTERVAL seconds.  The file stays open; each sample is one
+  read of the whole thing from offset 0.
   """
 
+  # the keys we report, from /proc/meminfo.
+  _MEMINFO_RE = re.compile(
+      r'^(MemTotal|MemFree|Buffers|Cached|MemAvailable):\s+(\d+)', re.M)
+
   def __init__(self):
     super(MemoryStatusLinux26, self).__init__()
-    (self._totalmem, self._freemem) = self._GetMemInfo()
+    self._fd = None
+    self._filename = None
+    self._sampled = None
+    self._meminfo = dict()
+
+  def __del__(self):
+    self._Close()
 
   @property
   def Total(self):
-    return self._totalmem
+    return self._Get('MemTotal')
 
   @property
   def Free(self):
-    return self._freemem
+    return self._Get('MemFree')
+
+  @property
+  def X_CATAWAMPUS_ORG_Cached(self):
+    return self._Get('Cached')
+
+  @property
+  def X_CATAWAMPUS_ORG_Buffers(self):
+    return self._Get('Buffers')
+
+  @property
+  def X_CATAWAMPUS_ORG_Available(self):
+    available = self._Get('MemAvailable', None)
+    if available is None:
+      # kernels before 3.14 don't estimate it for us.
+      available = (self._Get('MemFree') + self._Get('Buffers') +
+                   self._Get('Cached'))
+    return available
+
+  def _Get(self, key, default=0):
+    now = TIMENOW()
+    if self._sampled is None or now - self._sampled >= MEMINFO_MIN_INTERVAL:
+      self._meminfo = self._GetMemInfo()
+      self._sampled = now
+    return self._meminfo.get(key, default)
+
+  def _Close(self):
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
 
   def _GetMemInfo(self):
-    """Fetch TotalMem and FreeMem from the underlying platform.
+    """Fetch the keys we report from the underlying platform.
 
     Returns:
-      a list of two integers, (totalmem, freemem)
+      a dict of /proc/meminfo key, like 'MemTotal', to an integer in KiB.
     """
-    totalmem = 0
-    freemem = 0
-    with open(PROC_MEMINFO) as pfile:
-      for line in pfile:
-        fields = line.split()
-        name = fields[0]
-        value = fields[1]
-        if name == 'MemTotal:':
-          totalmem = int(value)
-        elif name == 'MemFree:':
-          freemem = int(value)
-    return (totalmem, freemem)
-
-
-class ProcessStatusLinux26(BASE181DEVICE.DeviceInfo.ProcessStatus):
+    if self._filename != PROC_MEMINFO:
+      self._Close()
+    try:
+      if self._fd is None:
+        self._fd = os.open(PROC_MEMINFO, os.O_RDONLY)
+        self._filename = PROC_MEMINFO
+      os.lseek(self._fd, 0, os.SEEK_SET)
+      data = os.read(self._fd, MEMINFO_BUFSIZE)
+    except OSError, e:
+      print 'MemoryStatus: %s: %s' % (PROC_MEMINFO, e)
+      self._Close()
+      return dict()
+    return dict((key, int(value))
+                for (key, value) in self._MEMINFO_RE.findall(data))
+
+
+# Field ordering in /proc/<pid>/stat, counting from the state.
+_STAT_STATE = 0
+_STAT_UTIME = 11
+_STAT_STIME = 12
+_STAT_PRIO = 15
+_STAT_STARTTIME = 19
+_STAT_RSS = 21
+
+
+# One process, from /proc/<pid>/stat.
+# jiffies: utime + stime, the CPU time it has used.
+# starttime: jiffies after boot when it started, to notice a pid being reused.
+ProcStat = collections.namedtuple(
+    'ProcStat', ('pid', 'command', 'state', 'priority', 'rss', 'jiffies',
+                 'starttime'))
+
+
+def ProcessTable():
+  """Return every process in SLASH_PROC, read at most once per tick.
+
+  Returns:
+    a dict of pid to ProcStat.
+  """
+  return _ReadProcessTable(SLASH_PROC)
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def _ReadProcessTable(slash_proc):
+  table = dict()
+  for name in os.listdir(slash_proc):
+    if name.isdigit():
+      proc = _ReadProcStat(slash_proc, name)
+      if proc is not None:
+        table[proc.pid] = proc
+  return table
+
+
+def _ReadProcStat(slash_proc, pid):
+  """Parse /proc/<pid>/stat, returning a ProcStat or None if it has exited."""
+  try:
+    with open('%s/%s/stat' % (slash_proc, pid)) as f:
+      data = f.read()
+  except IOError:
+    # This isn't an error. If a process exits after we listed the
+    # directory but before we get around to reading it, its /proc files
+    # will go away.
+    return None
+  # The command is in parens and can contain spaces and parens itself,
+  # so everything after the last ')' is numbered from the state.
+  (head, unused_paren, tail) = data.rpartition(')')
+  (pidstr, unused_paren, command) = head.partition('(')
+  fields = tail.split()
+  return ProcStat(pid=int(pidstr),
+                  command=command,
+                  state=fields[_STAT_STATE],
+                  priority=int(fields[_STAT_PRIO]),
+                  rss=int(fields[_STAT_RSS]),
+                  jiffies=int(fields[_STAT_UTIME]) + int(fields[_STAT_STIME]),
+                  starttime=int(fields[_STAT_STARTTIME]))
+
+
+class ProcessStatusLinux26(CATA181DEVICE.DeviceInfo.ProcessStatus):
   """Get information about running processes on Linux 2.6.
 
-  Reads /proc/<pid> to get information about processes.
+  Reads /proc/<pid> to get information about processes.  All of the
+  parameters fetched in one tick share one walk of /proc, see
+  ProcessTable().  Every CPU_SAMPLE_INTERVAL seconds we also keep a sample
+  of the process table and /proc/stat; the difference from the previous
+  sample gives CPUUsage, and each process' share of it.
   """
-  # Field ordering in /proc/<pid>/stat
-  _PID = 0
-  _COMM = 1
-  _STATE = 2
-  _UTIME = 13
-  _STIME = 14
-  _PRIO = 17
-  _RSS = 23
 
   def __init__(self, ioloop=None):
     super(ProcessStatusLinux26, self).__init__()
     tick = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
     self._msec_per_jiffy = 1000.0 / tick
     self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
-    self.scheduler = PERIODICCALL(self.CpuUsageTimer, 300 * 1000,
-                                  io_loop=self.ioloop)
+    self.scheduler = PERIODICCALL(self.CpuUsageTimer,
+                                  CPU_SAMPLE_INTERVAL * 1000,
+                                  io_loop=self.ioloop,
+                                  name='CpuUsageTimer')
     self.scheduler.start()
     self.cpu_usage = 0.0
     self.cpu_used = 0
     self.cpu_total = 0
+    self.process_usage = dict()
+    self._last_sample = dict()
     self.ProcessList = tr.core.AutoDict('ProcessList',
                                         iteritems=self.IterProcesses,
                                         getitem=self.GetProcess)
@@ -259,16 +372,8 @@ class ProcessStatusLinux26(BASE181DEVICE.DeviceInfo.ProcessStatus):
         'W': 'Uninterruptible'}
     return mapping.get(linux_state, 'Sleeping')
 
-  def _JiffiesToMsec(self, utime, stime):
-    ticks = int(utime) + int(stime)
-    msecs = ticks * self._msec_per_jiffy
-    return int(msecs)
-
-  def _RemoveParens(self, command):
-    return command[1:-1]
-
-  def _ProcFileName(self, pid):
-    return '%s/%s/stat' % (SLASH_PROC, pid)
+  def _JiffiesToMsec(self, jiffies):
+    return int(jiffies * self._msec_per_jiffy)
 
   def _ParseProcStat(self):
     """Compute CPU utilization using /proc/stat.
@@ -297,14 +402,22 @@ class ProcessStatusLinux26(BASE181DEVICE.DeviceInfo.ProcessStatus):
   def CpuUsageTimer(self):
     """Called periodically to compute CPU utilization since last call."""
     (new_used, new_total) = self._ParseProcStat()
+    table = ProcessTable()
     total = new_total - self.cpu_total
     used = new_used - self.cpu_used
+    usage = dict()
     if total == 0:
       self.cpu_usage = 0.0
     else:
       self.cpu_usage = (used / total) * 100.0
+      for (pid, proc) in table.iteritems():
+        old = self._last_sample.get(pid)
+        if old is not None and old.starttime == proc.starttime:
+          usage[pid] = (proc.jiffies - old.jiffies) / total * 100.0
     self.cpu_total = new_total
     self.cpu_used = new_used
+    self.process_usage = usage
+    self._last_sample = table
 
   @property
   def CPUUsage(self):
@@ -312,34 +425,41 @@ class ProcessStatusLinux26(BASE181DEVICE.DeviceInfo.ProcessStatus):
 
   @property
   def ProcessNumberOfEntries(self):
-    return len(self.ProcessList)
+    return len(ProcessTable())
+
+  def _NewProcess(self, **params):
+    # The vendor extension's constructor doesn't pass defaults through.
+    p = self.Process()
+    for (name, value) in params.iteritems():
+      setattr(p, name, value)
+    return p
+
+  def _MakeProcess(self, proc):
+    return self._NewProcess(
+        PID=proc.pid,
+        Command=proc.command,
+        Size=proc.rss,
+        Priority=proc.priority,
+        CPUTime=self._JiffiesToMsec(proc.jiffies),
+        State=self._LinuxStateToTr181(proc.state),
+        X_CATAWAMPUS_ORG_CPUUsage=int(self.process_usage.get(proc.pid, 0)))
 
   def GetProcess(self, pid):
     """Get a self.Process() object for the given pid."""
-    try:
-      with open(self._ProcFileName(pid)) as f:
-        fields = f.read().split()
-      p = self.Process(PID=int(fields[self._PID]),
-                       Command=self._RemoveParens(fields[self._COMM]),
-                       Size=int(fields[self._RSS]),
-                       Priority=int(fields[self._PRIO]),
-                       CPUTime=self._JiffiesToMsec(fields[self._UTIME],
-                                                   fields[self._STIME]),
-                       State=self._LinuxStateToTr181(fields[self._STATE]))
-    except IOError:
-      # This isn't an error. We have a list of files which existed the
-      # moment the glob.glob was run. If a process exits before we get
-      # around to reading it, its /proc files will go away.
-      p = self.Process(PID=pid, Command='<exited>', Size=0, Priority=0,
-                       CPUTime=0, State='X_CATAWAMPUS-ORG_Exited')
-    return p
+    proc = ProcessTable().get(int(pid))
+    if proc is None:
+      # it might have started since the table was read.
+      proc = _ReadProcStat(SLASH_PROC, pid)
+    if proc is None:
+      return self._NewProcess(PID=pid, Command='<exited>', Size=0, Priority=0,
+                              CPUTime=0, State='X_CATAWAMPUS-ORG_Exited',
+                              X_CATAWAMPUS_ORG_CPUUsage=0)
+    return self._MakeProcess(proc)
 
   def IterProcesses(self):
-    """Walks through /proc/<pid>/stat to return a list of all processes."""
-    for filename in glob.glob(self._ProcFileName('[0123456789]*')):
-      pid = int(filename.split('/')[-2])
-      proc = self.GetProcess(pid)
-      yield pid, proc
+    """Returns the processes in this tick's snapshot of /proc."""
+    for (pid, proc) in sorted(ProcessTable().iteritems()):
+      yield pid, self._MakeProcess(proc)
 
 
 class LedStatusReadFromFile(CATA181DEVICE.DeviceInfo.X_CATAWAMPUS_ORG_LedStatus):
@@ -356,7 +476,7 @@ class LedStatusReadFromFile(CATA181DEVICE.DeviceInfo.X_CATAWAMPUS_ORG_LedStatus)
 
   @property
   def Status(self):
-    return open(self._filename).readline().strip()
+    return tr.filecache.Open(self._filename).readline().strip()
 
 
 class DeviceInfo98Linux26(BASE98IGD.DeviceInfo):
@@ -21,10 +21,14 @@
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import os
+import shutil
+import tempfile
+import time
 import unittest
 
 import google3
 import tr.core
+import tr.cwmp_session
 import device_info
 import tornado.testing
 
@@ -66,7 +70,7 @@ class TestDeviceId(device_info.DeviceIdMeta):
 
 fake_periodics = []
 class FakePeriodicCallback(object):
-  def __init__(self, callback, callback_time, io_loop=None):
+  def __init__(self, callback, callback_time, io_loop=None, name=None):
     self.callback = callback
     self.callback_time = callback_time
     self.io_loop = io_loop
@@ -94,11 +98,16 @@ class DeviceInfoTest(tornado.testing.AsyncTestCase):
     self.old_PROC_MEMINFO = device_info.PROC_MEMINFO
     self.old_PROC_NET_DEV = device_info.PROC_NET_DEV
     self.old_PROC_UPTIME = device_info.PROC_UPTIME
+    self.old_PROC_STAT = device_info.PROC_STAT
     self.old_SLASH_PROC = device_info.SLASH_PROC
+    self.old_MEMINFO_MIN_INTERVAL = device_info.MEMINFO_MIN_INTERVAL
+    self.old_TIMENOW = device_info.TIMENOW
     device_info.PERIODICCALL = FakePeriodicCallback
     device_info.PROC_MEMINFO = 'testdata/device_info/meminfo'
     device_info.PROC_UPTIME = 'testdata/device_info/uptime'
     device_info.SLASH_PROC = 'testdata/device_info/processes'
+    tr.cwmp_session.cache.new_tick()
+    self.tmpdir = tempfile.mkdtemp()
 
   def tearDown(self):
     super(DeviceInfoTest, self).tearDown()
@@ -106,7 +115,39 @@ class DeviceInfoTest(tornado.testing.AsyncTestCase):
     device_info.PROC_MEMINFO = self.old_PROC_MEMINFO
     device_info.PROC_NET_DEV = self.old_PROC_NET_DEV
     device_info.PROC_UPTIME = self.old_PROC_UPTIME
+    device_info.PROC_STAT = self.old_PROC_STAT
     device_info.SLASH_PROC = self.old_SLASH_PROC
+    device_info.MEMINFO_MIN_INTERVAL = self.old_MEMINFO_MIN_INTERVAL
+    device_info.TIMENOW = self.old_TIMENOW
+    shutil.rmtree(self.tmpdir)
+
+  def MakeProc(self, processes, cpu_used, cpu_idle):
+    """Write a synthetic /proc into self.tmpdir.
+
+    Args:
+      processes: a list of (pid, command, jiffies, starttime).
+      cpu_used: jiffies the CPUs have been busy, for /proc/stat.
+      cpu_idle: jiffies the CPUs have been idle, for /proc/stat.
+    """
+    slash_proc = os.path.join(self.tmpdir, 'proc')
+    if os.path.exists(slash_proc):
+      shutil.rmtree(slash_proc)
+    os.mkdir(slash_proc)
+    for (pid, command, jiffies, starttime) in processes:
+      os.mkdir(os.path.join(slash_proc, str(pid)))
+      f = open(os.path.join(slash_proc, str(pid), 'stat'), 'w')
+      f.write('%d (%s) S 1 %d %d 0 -1 4202752 100 0 0 0 %d 0 0 0 20 0 1 0 '
+              '%d 4096000 123 18446744073709551615 1 1 0 0 0 0 0 0 0 0 0 0 '
+              '17 0 0 0 0 0 0\n' % (pid, command, pid, pid, jiffies,
+                                     starttime))
+      f.close()
+    f = open(os.path.join(self.tmpdir, 'stat'), 'w')
+    f.write('cpu  %d 0 0 %d 0 0 0 0 0 0\n' % (cpu_used, cpu_idle))
+    f.close()
+    os.mkdir(os.path.join(slash_proc, 'self'))
+    device_info.SLASH_PROC = slash_proc
+    device_info.PROC_STAT = os.path.join(self.tmpdir, 'stat')
+    tr.cwmp_session.cache.new_tick()
 
   def testValidate181(self):
     di = device_info.DeviceInfo181Linux26(TestDeviceId())
@@ -155,6 +196,75 @@ class DeviceInfoTest(tornado.testing.AsyncTestCase):
     self.assertEqual(mi.Total, 0)
     self.assertEqual(mi.Free, 654321)
 
+  def testMemoryStatusExtras(self):
+    device_info.PROC_MEMINFO = 'testdata/device_info/meminfo'
+    mi = device_info.MemoryStatusLinux26()
+    mi.ValidateExports()
+    self.assertEqual(mi.X_CATAWAMPUS_ORG_Cached, 100000)
+    self.assertEqual(mi.X_CATAWAMPUS_ORG_Buffers, 100000)
+    # no MemAvailable in this one, so it is estimated.
+    self.assertEqual(mi.X_CATAWAMPUS_ORG_Available, 854321)
+
+  def testMemoryStatusRefresh(self):
+    now = [1000.0]
+    device_info.TIMENOW = lambda: now[0]
+    meminfo = os.path.join(self.tmpdir, 'meminfo')
+    device_info.PROC_MEMINFO = meminfo
+
+    def WriteMeminfo(free):
+      f = open(meminfo, 'w')
+      f.write('MemTotal:        1000 kB\nMemFree:          %d kB\n'
+              'MemAvailable:      700 kB\nBuffers:            10 kB\n'
+              'Cached:             20 kB\nSwapCached:        999 kB\n' % free)
+      f.close()
+    WriteMeminfo(500)
+    mi = device_info.MemoryStatusLinux26()
+    self.assertEqual(mi.Free, 500)
+    self.assertEqual(mi.X_CATAWAMPUS_ORG_Available, 700)
+    self.assertEqual(mi.X_CATAWAMPUS_ORG_Cached, 20)
+
+    # rewritten in place, so the open file sees the new contents.
+    WriteMeminfo(400)
+    now[0] += device_info.MEMINFO_MIN_INTERVAL / 2
+    self.assertEqual(mi.Free, 500)
+    now[0] += device_info.MEMINFO_MIN_INTERVAL
+    self.assertEqual(mi.Free, 400)
+    self.assertEqual(mi.Total, 1000)
+
+    device_info.PROC_MEMINFO = os.path.join(self.tmpdir, 'does_not_exist')
+    now[0] += device_info.MEMINFO_MIN_INTERVAL
+    self.assertEqual(mi.Free, 0)
+
+  def testMemoryStatusSyscalls(self):
+    now = [1000.0]
+    device_info.TIMENOW = lambda: now[0]
+    calls = []
+    (old_open, old_read) = (os.open, os.read)
+
+    def CountingOpen(*args):
+      calls.append('open')
+      return old_open(*args)
+
+    def CountingRead(*args):
+      calls.append('read')
+      return old_read(*args)
+    os.open = CountingOpen
+    os.read = CountingRead
+    try:
+      mi = device_info.MemoryStatusLinux26()
+      for unused_i in range(1000):
+        (mi.Total, mi.Free, mi.X_CATAWAMPUS_ORG_Available)
+      # everything asked for within MEMINFO_MIN_INTERVAL shares one read.
+      self.assertEqual(calls, ['open', 'read'])
+      for unused_i in range(5):
+        now[0] += device_info.MEMINFO_MIN_INTERVAL
+        (mi.Total, mi.Free)
+      # the file stays open, so each later sample is a single read.
+      self.assertEqual(calls, ['open'] + ['read'] * 6)
+    finally:
+      os.open = old_open
+      os.read = old_read
+
   def testCPUUsage(self):
     ps = device_info.ProcessStatusLinux26(self.io_loop)
     self.assertEqual(len(fake_periodics), 1)
@@ -178,26 +288,32 @@ class DeviceInfoTest(tornado.testing.AsyncTestCase):
       self.assertTrue(processes)
 
   def testProcessStatusFakeData(self):
-    Process = device_info.BASE181DEVICE.DeviceInfo.ProcessStatus.Process
+    def Process(**params):
+      p = device_info.CATA181DEVICE.DeviceInfo.ProcessStatus.Process()
+      for (name, value) in params.iteritems():
+        setattr(p, name, value)
+      return p
     fake_processes = {
         1: Process(PID=1, Command='init', Size=551,
                      Priority=20, CPUTime=81970,
-                     State='Sleeping'),
+                     State='Sleeping', X_CATAWAMPUS_ORG_CPUUsage=0),
         3: Process(PID=3, Command='migration/0', Size=0,
                      Priority=-100, CPUTime=591510,
-                     State='Stopped'),
+                     State='Stopped', X_CATAWAMPUS_ORG_CPUUsage=0),
         5: Process(PID=5, Command='foobar', Size=0,
                      Priority=-100, CPUTime=591510,
-                     State='Zombie'),
+                     State='Zombie', X_CATAWAMPUS_ORG_CPUUsage=0),
         17: Process(PID=17, Command='bar', Size=0,
                       Priority=-100, CPUTime=591510,
-                      State='Uninterruptible'),
+                      State='Uninterruptible',
+                      X_CATAWAMPUS_ORG_CPUUsage=0),
         164: Process(PID=164, Command='udevd', Size=288,
                        Priority=16, CPUTime=300,
-                       State='Running'),
+                       State='Running', X_CATAWAMPUS_ORG_CPUUsage=0),
         770: Process(PID=770, Command='automount', Size=6081,
                        Priority=20, CPUTime=5515790,
-                       State='Uninterruptible')
+                       State='Uninterruptible',
+                       X_CATAWAMPUS_ORG_CPUUsage=0)
         }
     device_info.SLASH_PROC = 'testdata/device_info/processes'
     ps = device_info.ProcessStatusLinux26(self.io_loop)
@@ -218,6 +334,82 @@ class DeviceInfoTest(tornado.testing.AsyncTestCase):
     self.assertEqual(proc.CPUTime, 0);
     self.assertEqual(proc.State, 'X_CATAWAMPUS-ORG_Exited');
 
+  def testProcessCommandWithSpaces(self):
+    self.MakeProc([(12, 'a (weird) name', 5, 100)], 0, 0)
+    ps = device_info.ProcessStatusLinux26(self.io_loop)
+    proc = ps.GetProcess(12)
+    self.assertEqual(proc.Command, 'a (weird) name')
+    self.assertEqual(proc.Priority, 20)
+    self.assertEqual(proc.Size, 123)
+    self.assertEqual(proc.State, 'Sleeping')
+
+  def testProcessSnapshot(self):
+    self.MakeProc([(1, 'init', 10, 1), (2, 'kthreadd', 0, 1)], 0, 0)
+    ps = device_info.ProcessStatusLinux26(self.io_loop)
+    misses = device_info._ReadProcessTable.misses
+    self.assertEqual(ps.ProcessNumberOfEntries, 2)
+    self.assertEqual(sorted(ps.ProcessList.keys()), [1, 2])
+    self.assertEqual(ps.ProcessList[1].Command, 'init')
+    self.assertEqual(device_info._ReadProcessTable.misses, misses + 1)
+
+    # a process which started during the tick is still found.
+    self.MakeProc([(1, 'init', 10, 1), (2, 'kthreadd', 0, 1),
+                   (3, 'new', 0, 2)], 0, 0)
+    self.assertEqual(ps.GetProcess(3).Command, 'new')
+    self.assertEqual(ps.ProcessNumberOfEntries, 3)
+
+  def testProcessCPUUsage(self):
+    self.MakeProc([(1, 'init', 100, 1), (2, 'busy', 500, 1),
+                   (3, 'reused', 500, 1)], 1000, 9000)
+    ps = device_info.ProcessStatusLinux26(self.io_loop)
+    ps.CpuUsageTimer()
+    self.assertEqual(ps.GetProcess(2).X_CATAWAMPUS_ORG_CPUUsage, 0)
+
+    # 400 busy jiffies out of 1000, 250 of them in pid 2.  pid 3 exited
+    # and a new process got its pid.
+    self.MakeProc([(1, 'init', 110, 1), (2, 'busy', 750, 1),
+                   (3, 'reused', 600, 5000)], 1400, 9600)
+    ps.CpuUsageTimer()
+    self.assertEqual(ps.CPUUsage, 40)
+    self.assertEqual(ps.GetProcess(1).X_CATAWAMPUS_ORG_CPUUsage, 1)
+    self.assertEqual(ps.GetProcess(2).X_CATAWAMPUS_ORG_CPUUsage, 25)
+    self.assertEqual(ps.GetProcess(3).X_CATAWAMPUS_ORG_CPUUsage, 0)
+    self.assertEqual(ps.GetProcess(2).CPUTime,
+                     750 * 1000 / os.sysconf(os.sysconf_names['SC_CLK_TCK']))
+
+  def testProcessSnapshotOpens(self):
+    self.MakeProc([(pid, 'proc%d' % pid, pid, 1)
+                   for pid in range(1, 201)], 1000, 9000)
+    ps = device_info.ProcessStatusLinux26(self.io_loop)
+    opened = []
+
+    def CountingOpen(filename, *args):
+      opened.append(filename)
+      return open(filename, *args)
+    device_info.open = CountingOpen
+    try:
+      # a GPV of ProcessNumberOfEntries and every ProcessList.{i}.
+      for unused_r in range(3):
+        tr.cwmp_session.cache.new_tick()
+        ps.ProcessNumberOfEntries
+        for (pid, unused_proc) in ps.ProcessList.iteritems():
+          ps.ProcessList[pid]
+      # one walk of /proc per GPV, opening each process' stat once.
+      self.assertEqual(len(opened), 3 * 200)
+      self.assertEqual(len(set(opened)), 200)
+
+      # sampling CPU usage in the same tick shares that walk.
+      del opened[:]
+      ps.CpuUsageTimer()
+      self.assertEqual(opened, [device_info.PROC_STAT])
+      # on its own, it is one walk plus /proc/stat.
+      del opened[:]
+      tr.cwmp_session.cache.new_tick()
+      ps.CpuUsageTimer()
+      self.assertEqual(len(opened), 201)
+    finally:
+      del device_info.open
+
   def testLedStatus(self):
     led = device_info.LedStatusReadFromFile(
         'LED', 'testdata/device_info/ledstatus')
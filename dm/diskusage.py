@@ -0,0 +1,498 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Disk usage of directory trees, without stalling the ioloop.
+
+Adding up a tree the way du does means an lstat of every file in it,
+which for a DVR disk full of recordings takes far longer than we can
+keep the ioloop waiting.  DiskUsage walks each tree a few directories at
+a time, spending at most BUDGET seconds per ioloop callback, and reports
+the total from the last complete walk.  A directory with too many files
+to lstat within BUDGET is finished in later callbacks.
+
+What we learn about each directory (the space used by the files directly
+in it, and its subdirectories) is kept along with its mtime.  Walks after
+the first only list and lstat the files of a directory whose mtime
+changed, which is what happens when an entry is added, removed or
+renamed.  A file which grows in place doesn't touch the mtime of its
+directory, so every directory is also read again after RESCAN_INTERVAL.
+
+Where inotify(7) is available every directory we've read is watched as
+well.  A directory with a watch needs no lstat to know it is unchanged,
+writes to its files are noticed too, and a change starts a walk of its
+tree INOTIFY_DELAY seconds later instead of waiting for REFRESH_INTERVAL.
+Walks don't cross into other filesystems.  The caller can also say when a
+tree can't be walked right now, like a hung network mount where every
+lstat would block; its walk then waits until STALE_RETRY seconds later.
+"""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import collections
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import os
+import stat
+import struct
+import sys
+
+import google3
+import tornado.ioloop
+import tr.helpers
+
+
+# Unit tests can override these
+BUDGET = 0.01
+SLICE_INTERVAL = 0.05
+REFRESH_INTERVAL = 300
+RESCAN_INTERVAL = 3600
+INOTIFY_DELAY = 10
+INOTIFY_MAX_WATCHES = 4096
+SCAN_BATCH = 100  # lstat calls between looks at the clock
+STALE_RETRY = 60
+TIMENOW = tr.helpers.monotime
+USE_INOTIFY = True
+
+# From linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+_INOTIFY_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                 IN_CREATE | IN_DELETE | IN_ONLYDIR)
+_INOTIFY_EVENT = struct.Struct('=iIII')
+_READ_SIZE = 65536
+
+
+# bytes: space used by the tree, as du counts it.
+# files: the number of entries in the tree which aren't directories.
+# finished: TIMENOW() when the walk these came from ended, or None if no
+#   walk has finished yet.
+Usage = collections.namedtuple('Usage', ('bytes', 'files', 'finished'))
+
+
+class Inotify(object):
+  """Just enough of inotify(7) to hear about changes to directories."""
+
+  def __init__(self, ioloop, callback):
+    """Initialize an Inotify.
+
+    Args:
+      ioloop: the tornado.ioloop.IOLoop to register with.
+      callback: called with the path of a watched directory when something
+        in it changes, or None if the kernel lost track of what changed.
+    Raises:
+      OSError: if this system doesn't have inotify.
+    """
+    self.ioloop = ioloop
+    self.callback = callback
+    try:
+      self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+      init1 = self._libc.inotify_init1
+    except (AttributeError, OSError):
+      raise OSError(errno.ENOSYS, 'inotify is not available')
+    self.fd = init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self.fd < 0:
+      e = ctypes.get_errno()
+      raise OSError(e, os.strerror(e))
+    self._paths = {}
+    self.events = 0
+    self.ioloop.add_handler(self.fd, self._Read, self.ioloop.READ)
+
+  def Watch(self, path):
+    """Watch directory path.  Returns the watch descriptor, or None."""
+    if len(self._paths) >= INOTIFY_MAX_WATCHES:
+      return None
+    wd = self._libc.inotify_add_watch(self.fd, path, _INOTIFY_MASK)
+    if wd < 0:
+      return None  # ENOSPC, over the kernel's limit on watches
+    self._paths[wd] = path
+    return wd
+
+  def Unwatch(self, wd):
+    if self._paths.pop(wd, None) is not None:
+      self._libc.inotify_rm_watch(self.fd, wd)
+
+  def Close(self):
+    if self.fd is not None:
+      self.ioloop.remove_handler(self.fd)
+      os.close(self.fd)
+      self.fd = None
+      self._paths.clear()
+
+  def _Read(self, unused_fd, unused_events):
+    """Called by the ioloop when there are events to read."""
+    while self.fd is not None:
+      try:
+        data = os.read(self.fd, _READ_SIZE)
+      except OSError, e:
+        if e.errno == errno.EINTR:
+          continue
+        return
+      if not data:
+        return
+      offset = 0
+      while offset + _INOTIFY_EVENT.size <= len(data):
+        (wd, mask, unused_cookie, length) = _INOTIFY_EVENT.unpack_from(
+            data, offset)
+        offset += _INOTIFY_EVENT.size + length
+        self.events += 1
+        if mask & IN_Q_OVERFLOW:
+          self.callback(None)
+        elif mask & IN_IGNORED:
+          self._paths.pop(wd, None)  # the directory went away
+        elif wd in self._paths:
+          self.callback(self._paths[wd])
+
+
+class _Dir(object):
+  """What we know about one directory."""
+
+  __slots__ = ('mtime', 'scanned', 'bytes', 'files', 'subdirs', 'wd')
+
+  def __init__(self):
+    self.mtime = None
+    self.scanned = None
+    self.bytes = 0
+    self.files = 0
+    self.subdirs = []
+    self.wd = None
+
+
+class _Scan(object):
+  """A directory being listed and lstat()ed, which can span slices."""
+
+  def __init__(self, path, st, names):
+    self.path = path
+    self.mtime = st.st_mtime
+    self.names = names
+    self.pos = 0
+    self.bytes = st.st_blocks * 512
+    self.files = 0
+    self.subdirs = []
+
+
+class _Root(object):
+  """A tree we've been asked about, and the state of its walk."""
+
+  def __init__(self, path, usable):
+    self.path = path
+    self.usable = usable
+    self.prefix = path.rstrip('/') + '/'
+    self.dev = None
+    self.usage = Usage(bytes=0, files=0, finished=None)
+    self.walking = False
+    self.queue = collections.deque()
+    self.scan = None
+    self.seen = set()
+    self.bytes = 0
+    self.files = 0
+    self.timer = None
+    self.again = False
+
+
+class DiskUsage(object):
+  """Incremental, time-sliced disk usage of trees, see the module docstring."""
+
+  def __init__(self, ioloop=None, use_inotify=None):
+    self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+    self._roots = {}
+    self._dirs = {}
+    self._dirty = set()
+    self._ready = collections.deque()
+    self._timer = None
+    self.inotify = None
+    if use_inotify is None:
+      use_inotify = USE_INOTIFY
+    if use_inotify:
+      try:
+        self.inotify = Inotify(self.ioloop, self._Changed)
+      except OSError:
+        pass
+    self.slices = 0
+    self.walks = 0
+    self.scanned = 0
+    self.reused = 0
+
+  def Get(self, path, usable=None):
+    """Return the Usage of the tree at path.
+
+    The first call for a path starts accounting for it.  Until that
+    first walk has finished the Usage is all zeros.
+
+    Args:
+      path: the top of the tree.
+      usable: a function which returns False while the tree can't be
+        walked without risking a hang.  It is asked before a walk and
+        before each slice of it.  Only the first call for a path sets it.
+    Returns:
+      a Usage.
+    """
+    root = self._roots.get(path)
+    if root is None:
+      root = self._roots[path] = _Root(path, usable)
+      self._StartWalk(root)
+    return root.usage
+
+  def Stats(self):
+    """Return a dict of counters, for monitoring."""
+    return {'roots': len(self._roots),
+            'dirs': len(self._dirs),
+            'watches': len([d for d in self._dirs.itervalues()
+                            if d.wd is not None]),
+            'slices': self.slices,
+            'walks': self.walks,
+            'scanned': self.scanned,
+            'reused': self.reused}
+
+  def Close(self):
+    """Stop all walks, and stop watching for changes."""
+    if self._timer is not None:
+      self.ioloop.remove_timeout(self._timer)
+      self._timer = None
+    for root in self._roots.itervalues():
+      if root.timer is not None:
+        self.ioloop.remove_timeout(root.timer)
+        root.timer = None
+    if self.inotify:
+      self.inotify.Close()
+      self.inotify = None
+
+  def _StartWalk(self, root):
+    if root.timer is not None:
+      self.ioloop.remove_timeout(root.timer)
+      root.timer = None
+    if root.walking:
+      return
+    if not self._IsUsable(root):
+      self._WalkLater(root, STALE_RETRY)
+      return
+    root.walking = True
+    root.again = False
+    root.queue = collections.deque()
+    root.seen = set()
+    root.bytes = root.files = 0
+    try:
+      root.dev = os.lstat(root.path).st_dev
+      root.queue.append(root.path)
+    except OSError:
+      pass  # finish with nothing in it
+    self._ready.append(root)
+    if self._timer is None:
+      self._timer = self.ioloop.add_timeout(datetime.timedelta(0),
+                                            self._Slice)
+
+  def _WalkLater(self, root, delay):
+    if root.timer is None and not root.walking:
+      root.timer = self.ioloop.add_timeout(
+          datetime.timedelta(seconds=delay), lambda: self._StartWalk(root))
+
+  def _IsUsable(self, root):
+    if root.usable is None:
+      return True
+    try:
+      return root.usable()
+    except Exception:  #gpylint: disable-msg=W0703
+      print 'diskusage: usable() for %s failed' % root.path
+      return False
+
+  def _Slice(self):
+    """Walk for up to BUDGET seconds, then let everybody else run."""
+    self._timer = None
+    self.slices += 1
+    deadline = TIMENOW() + BUDGET
+    checked = None
+    while self._ready:
+      root = self._ready[0]
+      if root is not checked:
+        checked = root
+        if not self._IsUsable(root):
+          self._ready.popleft()
+          self._AbandonWalk(root)
+          continue
+      if root.scan is not None:
+        self._ContinueScan(root, deadline)
+      elif root.queue:
+        self._Visit(root, root.queue.popleft(), deadline)
+      if root.scan is None and not root.queue:
+        self._ready.popleft()
+        self._FinishWalk(root)
+      if TIMENOW() >= deadline:
+        break
+    if self._ready:
+      self._timer = self.ioloop.add_timeout(
+          datetime.timedelta(seconds=SLICE_INTERVAL), self._Slice)
+
+  def _Visit(self, root, path, deadline):
+    d = self._dirs.get(path)
+    if d is None or self._NeedsScan(d, path):
+      self._StartScan(root, path)
+      if root.scan is not None:
+        self._ContinueScan(root, deadline)
+      return
+    self.reused += 1
+    self._Count(root, path, d)
+
+  def _Count(self, root, path, d):
+    """Add directory path to the walk of root."""
+    root.seen.add(path)
+    root.bytes += d.bytes
+    root.files += d.files
+    for name in d.subdirs:
+      root.queue.append(os.path.join(path, name))
+
+  def _NeedsScan(self, d, path):
+    if path in self._dirty or TIMENOW() - d.scanned >= RESCAN_INTERVAL:
+      return True
+    if d.wd is not None:
+      return False  # inotify would have told us
+    try:
+      return os.lstat(path).st_mtime != d.mtime
+    except OSError:
+      return True
+
+  def _StartScan(self, root, path):
+    """List path, to lstat everything in it in _ContinueScan."""
+    self._dirty.discard(path)
+    try:
+      st = os.lstat(path)
+    except OSError:
+      st = None
+    if st is None or not stat.S_ISDIR(st.st_mode) or st.st_dev != root.dev:
+      self._Forget(path)
+      return
+    try:
+      names = os.listdir(path)
+    except OSError:
+      names = []
+    root.scan = _Scan(path, st, names)
+
+  def _ContinueScan(self, root, deadline):
+    """lstat the entries of root.scan until it is done or time is up."""
+    scan = root.scan
+    batch = 0
+    while scan.pos < len(scan.names):
+      if batch >= SCAN_BATCH:
+        if TIMENOW() >= deadline:
+          return  # the rest in the next slice
+        batch = 0
+      name = scan.names[scan.pos]
+      scan.pos += 1
+      batch += 1
+      try:
+        est = os.lstat(os.path.join(scan.path, name))
+      except OSError:
+        continue  # removed since we listed it
+      if stat.S_ISDIR(est.st_mode):
+        if est.st_dev == root.dev:
+          scan.subdirs.append(name)
+      else:
+        scan.files += 1
+        scan.bytes += est.st_blocks * 512
+    root.scan = None
+    d = self._dirs.get(scan.path)
+    if d is None:
+      d = self._dirs[scan.path] = _Dir()
+    d.mtime = scan.mtime
+    d.scanned = TIMENOW()
+    d.bytes = scan.bytes
+    d.files = scan.files
+    d.subdirs = scan.subdirs
+    if self.inotify and d.wd is None:
+      d.wd = self.inotify.Watch(scan.path)
+    self.scanned += 1
+    self._Count(root, scan.path, d)
+
+  def _Forget(self, path):
+    d = self._dirs.pop(path, None)
+    if d is not None and d.wd is not None and self.inotify:
+      self.inotify.Unwatch(d.wd)
+
+  def _AbandonWalk(self, root):
+    """Stop walking a tree which isn't usable, and keep its last Usage."""
+    root.walking = False
+    root.queue = collections.deque()
+    root.scan = None
+    root.seen = set()
+    self._WalkLater(root, STALE_RETRY)
+
+  def _FinishWalk(self, root):
+    root.usage = Usage(bytes=root.bytes, files=root.files, finished=TIMENOW())
+    root.walking = False
+    root.queue = collections.deque()
+    for path in self._dirs.keys():
+      if path not in root.seen and (
+          path == root.path or path.startswith(root.prefix)):
+        self._Forget(path)  # deleted, or moved out of the tree
+    root.seen = set()
+    self.walks += 1
+    self._WalkLater(root, INOTIFY_DELAY if root.again else REFRESH_INTERVAL)
+
+  def _Changed(self, path):
+    """From Inotify, something in directory path changed."""
+    if path is None:
+      self._dirty.update(self._dirs.keys())
+      roots = self._roots.values()
+    else:
+      self._dirty.add(path)
+      roots = [r for r in self._roots.itervalues()
+               if path == r.path or path.startswith(r.prefix)]
+    for root in roots:
+      if root.walking:
+        root.again = True  # this walk may already be past path
+      elif root.timer is not None and not root.again:
+        self.ioloop.remove_timeout(root.timer)
+        root.timer = None
+        root.again = True
+        self._WalkLater(root, INOTIFY_DELAY)
+
+
+_diskusage = None
+
+
+def Instance():
+  """Returns the shared DiskUsage."""
+  global _diskusage
+  if _diskusage is None:
+    _diskusage = DiskUsage()
+  return _diskusage
+
+
+def main():
+  ioloop = tornado.ioloop.IOLoop.instance()
+  du = DiskUsage(ioloop=ioloop, use_inotify=False)
+  paths = sys.argv[1:] or ['.']
+
+  def Check():
+    if all(du.Get(p).finished for p in paths):
+      ioloop.stop()
+    else:
+      ioloop.add_timeout(datetime.timedelta(seconds=0.1), Check)
+  Check()
+  ioloop.start()
+  for p in paths:
+    print '%12d %s' % (du.Get(p).bytes / 1024, p)
+  print du.Stats()
+
+if __name__ == '__main__':
+  main()
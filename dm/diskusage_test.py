@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+#pylint: disable-msg=C6409
+
+"""Unit tests for diskusage.py."""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import google3
+import tornado.ioloop
+import diskusage
+
+
+def Du(top):
+  """What du would say, in bytes."""
+  total = 0
+  for (dirpath, unused_dirnames, filenames) in os.walk(top):
+    total += os.lstat(dirpath).st_blocks * 512
+    for name in filenames:
+      total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+  return total
+
+
+class DiskUsageTest(unittest.TestCase):
+  """Tests for diskusage.py, on a tree in a temporary directory."""
+
+  def setUp(self):
+    self.old_BUDGET = diskusage.BUDGET
+    self.old_INOTIFY_DELAY = diskusage.INOTIFY_DELAY
+    self.old_REFRESH_INTERVAL = diskusage.REFRESH_INTERVAL
+    self.old_SCAN_BATCH = diskusage.SCAN_BATCH
+    self.old_SLICE_INTERVAL = diskusage.SLICE_INTERVAL
+    self.old_STALE_RETRY = diskusage.STALE_RETRY
+    diskusage.SLICE_INTERVAL = 0.001
+    self.ioloop = tornado.ioloop.IOLoop()
+    self.du = None
+    self.tmpdir = tempfile.mkdtemp()
+    self.top = os.path.join(self.tmpdir, 'recordings')
+    for show in range(4):
+      for episode in range(3):
+        self.Write('show%d/season1/episode%d.ts' % (show, episode), 10000)
+    self.Write('index.db', 70000)
+
+  def tearDown(self):
+    diskusage.BUDGET = self.old_BUDGET
+    diskusage.INOTIFY_DELAY = self.old_INOTIFY_DELAY
+    diskusage.REFRESH_INTERVAL = self.old_REFRESH_INTERVAL
+    diskusage.SCAN_BATCH = self.old_SCAN_BATCH
+    diskusage.SLICE_INTERVAL = self.old_SLICE_INTERVAL
+    diskusage.STALE_RETRY = self.old_STALE_RETRY
+    if self.du:
+      self.du.Close()
+    self.ioloop.close(all_fds=True)
+    shutil.rmtree(self.tmpdir)
+
+  def Write(self, name, size, mode='w'):
+    filename = os.path.join(self.top, name)
+    if not os.path.isdir(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    f = open(filename, mode)
+    f.write('x' * size)
+    f.close()
+
+  def Walk(self, walks):
+    """Run the ioloop until the DiskUsage has finished walks walks."""
+    def Check():
+      if self.du.walks >= walks:
+        self.ioloop.stop()
+      else:
+        self.ioloop.add_timeout(datetime.timedelta(seconds=0.005), Check)
+    Check()
+    tmo = self.ioloop.add_timeout(datetime.timedelta(seconds=5),
+                                  self.ioloop.stop)
+    self.ioloop.start()
+    self.ioloop.remove_timeout(tmo)
+    self.assertEqual(self.du.walks, walks)
+
+  def testWalk(self):
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=False)
+    usage = self.du.Get(self.top)
+    self.assertEqual(usage, diskusage.Usage(bytes=0, files=0, finished=None))
+    self.Walk(1)
+    usage = self.du.Get(self.top)
+    self.assertEqual(usage.bytes, Du(self.top))
+    self.assertEqual(usage.files, 13)
+    self.assertTrue(usage.finished)
+    self.assertEqual(self.du.scanned, 9)
+
+  def testTimeSliced(self):
+    diskusage.BUDGET = 0  # one directory per slice
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=False)
+    self.du.Get(self.top)
+    self.Walk(1)
+    self.assertEqual(self.du.slices, 9)
+
+  def testBigDirectory(self):
+    for i in range(95):
+      self.Write('show0/season1/extra%d.ts' % i, 100)
+    diskusage.BUDGET = 0
+    diskusage.SCAN_BATCH = 10
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=False)
+    self.du.Get(self.top)
+    self.Walk(1)
+    # the 98 entries of show0/season1 took 10 slices.
+    self.assertEqual(self.du.slices, 9 + 9)
+    usage = self.du.Get(self.top)
+    self.assertEqual(usage.bytes, Du(self.top))
+    self.assertEqual(usage.files, 13 + 95)
+    self.assertEqual(self.du.scanned, 9)
+
+  def testNotUsable(self):
+    diskusage.STALE_RETRY = 0.01
+    usable = [False]
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=False)
+    self.du.Get(self.top, usable=lambda: usable[0])
+    self.ioloop.add_timeout(datetime.timedelta(seconds=0.05), self.ioloop.stop)
+    self.ioloop.start()
+    self.assertEqual(self.du.walks, 0)
+    self.assertEqual(self.du.scanned, 0)
+    usable[0] = True
+    self.Walk(1)
+    self.assertEqual(self.du.Get(self.top).bytes, Du(self.top))
+
+  def testStaleDuringWalk(self):
+    diskusage.BUDGET = 0
+    diskusage.STALE_RETRY = 0.01
+    checks = []
+
+    def Usable():
+      checks.append(1)
+      return len(checks) != 3  # goes stale for a moment
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=False)
+    self.du.Get(self.top, usable=Usable)
+    self.Walk(1)
+    usage = self.du.Get(self.top)
+    self.assertEqual(usage.bytes, Du(self.top))
+    # the directory scanned before it went stale was used again.
+    self.assertEqual(self.du.scanned, 9)
+    self.assertEqual(self.du.reused, 1)
+
+  def testOnlyChangesRescanned(self):
+    diskusage.REFRESH_INTERVAL = 0.01
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=False)
+    self.du.Get(self.top)
+    self.Walk(1)
+    self.Write('show2/season1/episode3.ts', 50000)
+    shutil.rmtree(os.path.join(self.top, 'show3'))
+    self.Walk(2)
+    usage = self.du.Get(self.top)
+    self.assertEqual(usage.bytes, Du(self.top))
+    self.assertEqual(usage.files, 11)
+    # the top, for show3, and season1 of show2 were read again.
+    self.assertEqual(self.du.scanned, 9 + 2)
+    self.assertEqual(self.du.reused, 5)
+    self.assertEqual(self.du.Stats()['dirs'], 7)
+
+  def testMissing(self):
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=False)
+    self.du.Get(os.path.join(self.tmpdir, 'nonexistent'))
+    self.Walk(1)
+    usage = self.du.Get(os.path.join(self.tmpdir, 'nonexistent'))
+    self.assertEqual((usage.bytes, usage.files), (0, 0))
+
+  def testInotify(self):
+    diskusage.INOTIFY_DELAY = 0.01
+    self.du = diskusage.DiskUsage(ioloop=self.ioloop, use_inotify=True)
+    if not self.du.inotify:
+      return  # not on this system
+    self.du.Get(self.top)
+    self.Walk(1)
+    self.assertEqual(self.du.Stats()['watches'], 9)
+
+    # appending to a file doesn't change the mtime of its directory.
+    self.Write('show1/season1/episode0.ts', 100000, mode='a')
+    self.Walk(2)
+    usage = self.du.Get(self.top)
+    self.assertEqual(usage.bytes, Du(self.top))
+    self.assertEqual(self.du.scanned, 9 + 1)
+    self.assertEqual(self.du.reused, 8)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -24,17 +24,45 @@ in http://www.broadband-forum.org/cwmp/tr-181-2-2-0.html
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import collections
 import pynetlinux
 import tr.core
-import tr.cwmpdate
+import tr.cwmp_session
 import tr.tr181_v2_4
 import tr.x_catawampus_tr181_2_0
 import netdev
+import netlink
 
 BASEETHERNET = tr.tr181_v2_4.Device_v2_4.Device.Ethernet
 CATAWAMPUSETHERNET = tr.x_catawampus_tr181_2_0.X_CATAWAMPUS_ORG_Device_v2_0.Device.Ethernet
 PYNETIFCONF = pynetlinux.ifconfig.Interface
 
+# is_up: the administrative state, from SIOCGIFFLAGS.
+# speed, duplex, auto, link_up: from ETHTOOL_GSET and ETHTOOL_GLINK.
+LinkInfo = collections.namedtuple(
+    'LinkInfo', ('is_up', 'speed', 'duplex', 'auto', 'link_up'))
+
+
+def LinkInfoAll(interfaces):
+  """Take the LinkInfo of many interfaces at once, like for enumerating them.
+
+  The results are shared with the interfaces' own getters for the rest of
+  the tick.  An interface whose ioctls fail is left out; its own getter
+  will report the problem.
+
+  Args:
+    interfaces: a list of EthernetInterfaceLinux26 objects.
+  Returns:
+    a dict of interface name to LinkInfo.
+  """
+  infos = dict()
+  for i in interfaces:
+    try:
+      infos[i.Name] = i.GetLinkInfo()
+    except IOError:
+      pass
+  return infos
+
 
 class EthernetInterfaceStatsLinux26(netdev.NetdevStatsLinux26,
                                     BASEETHERNET.Interface.Stats):
@@ -50,15 +78,66 @@ class EthernetInterfaceLinux26(CATAWAMPUSETHERNET.Interface):
 
   Constructor arguments:
     ifname: netdev name, like 'eth0'
+    linkwatcher: a dm.netlink.LinkWatcher.  If given, Status and LastChange
+      come from its link table, and changes to them are notified as
+      their Notification attribute asks.
   """
 
-  def __init__(self, ifname, upstream=False):
+  def __init__(self, ifname, upstream=False, linkwatcher=None):
     super(EthernetInterfaceLinux26, self).__init__()
     self._pynet = PYNETIFCONF(ifname)
     self._ifname = ifname
+    self._linkwatcher = linkwatcher
     self.Unexport('Alias')
     self.Name = ifname
     self.Upstream = upstream
+    if linkwatcher:
+      linkwatcher.Watch(ifname, self, ['Status', 'LastChange'])
+
+  def SetAttribute(self, attr, value):
+    """Sets an attribute of Status and LastChange, see tr.api.
+
+    Args:
+      attr: the name of the attribute, only Notification is supported.
+      value: the value of the attribute.
+    """
+    if attr == 'Notification' and self._linkwatcher:
+      self._linkwatcher.SetNotification(self, int(value))
+
+  def DeclareLinkInfoAll(self, interfaces):
+    """Take LinkInfoAll(interfaces) when a GPV needs our own LinkInfo.
+
+    See tr.core.Exporter.DeclarePrefetch.  A GPV of the whole InterfaceList
+    then asks the kernel about every interface in one pass.
+
+    Args:
+      interfaces: a list of EthernetInterfaceLinux26, usually including self.
+    """
+    params = ['X_CATAWAMPUS-ORG_ActualBitRate',
+              'X_CATAWAMPUS-ORG_ActualDuplexMode']
+    if not self._linkwatcher:
+      params.append('Status')
+    self.DeclarePrefetch(params, LinkInfoAll, tuple(interfaces))
+
+  def _LinkState(self):
+    """Return our dm.netlink.LinkState, or None if we don't have one."""
+    if self._linkwatcher:
+      return self._linkwatcher.Get(self._ifname)
+    return None
+
+  @tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+  def GetLinkInfo(self):
+    """Return a LinkInfo, asking the kernel at most once per tick."""
+    is_up = self._pynet.is_up()
+    try:
+      (speed, duplex, auto, link_up) = self._pynet.get_link_info()
+    except IOError:
+      if is_up:
+        raise
+      # some drivers fail ETHTOOL_GLINK while administratively down.
+      (speed, duplex, auto, link_up) = (0, False, False, False)
+    return LinkInfo(is_up=is_up, speed=speed, duplex=duplex,
+                    auto=auto, link_up=link_up)
 
   @property
   def DuplexMode(self):
@@ -70,7 +149,11 @@ class EthernetInterfaceLinux26(CATAWAMPUSETHERNET.Interface):
 
   @property
   def LastChange(self):
-    return tr.cwmpdate.format(0)
+    """Seconds since Status last changed, or 0 if it hasn't since we started."""
+    state = self._LinkState()
+    if state is not None and state.last_change:
+      return max(0, int(netlink.TIMENOW() - state.last_change))
+    return 0
 
   @property
   def LowerLayers(self):
@@ -86,9 +169,14 @@ class EthernetInterfaceLinux26(CATAWAMPUSETHERNET.Interface):
 
   @property
   def Status(self):
-    if not self._pynet.is_up():
+    state = self._LinkState()
+    if state is not None:
+      (is_up, link_up) = (state.is_up, state.carrier)
+    else:
+      info = self.GetLinkInfo()
+      (is_up, link_up) = (info.is_up, info.link_up)
+    if not is_up:
       return 'Down'
-    (speed, duplex, auto, link_up) = self._pynet.get_link_info()
     if link_up:
       return 'Up'
     else:
@@ -100,13 +188,11 @@ class EthernetInterfaceLinux26(CATAWAMPUSETHERNET.Interface):
 
   @property
   def X_CATAWAMPUS_ORG_ActualBitRate(self):
-    (speed, duplex, auto, link_up) = self._pynet.get_link_info()
-    return speed
+    return self.GetLinkInfo().speed
 
   @property
   def X_CATAWAMPUS_ORG_ActualDuplexMode(self):
-    (speed, duplex, auto, link_up) = self._pynet.get_link_info()
-    return 'Full' if duplex else 'Half'
+    return 'Full' if self.GetLinkInfo().duplex else 'Half'
 
 
 def main():
@@ -22,6 +22,9 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import unittest
 import google3
+import tr.api
+import tr.core
+import tr.cwmp_session
 import tr.tr181_v2_2 as tr181
 import ethernet
 import netdev
@@ -36,6 +39,7 @@ class EthernetTest(unittest.TestCase):
   def setUp(self):
     self.old_PROC_NET_DEV = netdev.PROC_NET_DEV
     self.old_PYNETIFCONF = ethernet.PYNETIFCONF
+    tr.cwmp_session.cache.new_tick()
 
   def tearDown(self):
     netdev.PROC_NET_DEV = self.old_PROC_NET_DEV
@@ -75,7 +79,7 @@ class EthernetTest(unittest.TestCase):
   def _CheckEthernetInterfaceParameters(self, ifname, upstream, eth, pynet):
     self.assertEqual(eth.DuplexMode, 'Auto')
     self.assertEqual(eth.Enable, True)
-    self.assertEqual(eth.LastChange, '0001-01-01T00:00:00Z')
+    self.assertEqual(eth.LastChange, 0)
     self.assertFalse(eth.LowerLayers)
     self.assertEqual(eth.MACAddress, pynet.v_mac)
     self.assertEqual(eth.MaxBitRate, -1)
@@ -118,6 +122,76 @@ class EthernetTest(unittest.TestCase):
     eth = ethernet.EthernetInterfaceLinux26('foo0')
     self._CheckEthernetInterfaceParameters('foo0', upstream, eth, MockPynet)
 
+  def testLinkInfoSnapshot(self):
+    ethernet.PYNETIFCONF = CountingPynet
+    netdev.PROC_NET_DEV = 'testdata/ethernet/net_dev'
+    CountingPynet.calls = []
+    eth = ethernet.EthernetInterfaceLinux26('foo0')
+    cpe = tr.api.CPE(eth)
+    params = ['Status', 'X_CATAWAMPUS-ORG_ActualBitRate',
+              'X_CATAWAMPUS-ORG_ActualDuplexMode', 'MaxBitRate', 'DuplexMode']
+    values = dict(cpe.GetParameterValues(params))
+    self.assertEqual(values['Status'], 'Up')
+    self.assertEqual(values['X_CATAWAMPUS-ORG_ActualBitRate'], 1000)
+    self.assertEqual(values['X_CATAWAMPUS-ORG_ActualDuplexMode'], 'Full')
+    # one SIOCGIFFLAGS and one set of ethtool ioctls for the whole GPV.
+    self.assertEqual(sorted(CountingPynet.calls),
+                     [('foo0', 'get_link_info'), ('foo0', 'is_up')])
+    cpe.GetParameterValues(params)
+    self.assertEqual(len(CountingPynet.calls), 2)
+
+    # the next tick asks the kernel again.
+    tr.cwmp_session.cache.new_tick()
+    cpe.GetParameterValues(params)
+    self.assertEqual(len(CountingPynet.calls), 4)
+
+    # a GPV of all interfaces asks about each of them once, in one pass.
+    tr.cwmp_session.cache.new_tick()
+    CountingPynet.calls = []
+    interfaces = [ethernet.EthernetInterfaceLinux26('eth%d' % i)
+                  for i in range(8)]
+    for eth in interfaces:
+      eth.DeclareLinkInfoAll(interfaces)
+    cpe = tr.api.CPE(InterfaceListExporter(interfaces))
+    cpe.GetParameterValues(['Interface.1.Status'])
+    self.assertEqual(len(CountingPynet.calls), 16)
+    names = ['Interface.%d.%s' % (n, p) for n in range(1, 9) for p in params]
+    values = dict(cpe.GetParameterValues(names))
+    self.assertEqual(values['Interface.8.Status'], 'Up')
+    self.assertEqual(len(CountingPynet.calls), 16)
+    self.assertEqual(sorted(set(CountingPynet.calls)),
+                     sorted(CountingPynet.calls))
+
+  def testLinkInfoAll(self):
+    ethernet.PYNETIFCONF = CountingPynet
+    CountingPynet.calls = []
+    interfaces = [ethernet.EthernetInterfaceLinux26('eth%d' % i)
+                  for i in range(4)]
+    interfaces.append(ethernet.EthernetInterfaceLinux26('broken0'))
+    infos = ethernet.LinkInfoAll(interfaces)
+    self.assertEqual(sorted(infos.keys()), ['eth%d' % i for i in range(4)])
+    self.assertEqual(infos['eth3'], ethernet.LinkInfo(
+        is_up=True, speed=1000, duplex=True, auto=True, link_up=True))
+    for eth in interfaces[:4]:
+      self.assertEqual(eth.Status, 'Up')
+    self.assertEqual(len(CountingPynet.calls), 10)
+
+  def testStatusDownWhenEthtoolFails(self):
+    ethernet.PYNETIFCONF = DownPynet
+    eth = ethernet.EthernetInterfaceLinux26('foo0')
+    self.assertEqual(eth.Status, 'Down')
+    self.assertEqual(eth.X_CATAWAMPUS_ORG_ActualBitRate, 0)
+
+
+class InterfaceListExporter(tr.core.Exporter):
+  """Enumerates some Ethernet interfaces, like Device.Ethernet does."""
+
+  def __init__(self, interfaces):
+    tr.core.Exporter.__init__(self)
+    self.Export(lists=['Interface'])
+    self.InterfaceList = dict((str(n + 1), eth)
+                              for (n, eth) in enumerate(interfaces))
+
 
 class MockPynet(object):
   v_is_up = True
@@ -140,5 +214,30 @@ class MockPynet(object):
     return (self.v_speed, self.v_duplex, self.v_auto, self.v_link_up)
 
 
+class CountingPynet(MockPynet):
+  """A MockPynet which remembers every ioctl it was asked to do."""
+  calls = []
+
+  def is_up(self):
+    self.calls.append((self.ifname, 'is_up'))
+    return True
+
+  def get_link_info(self):
+    self.calls.append((self.ifname, 'get_link_info'))
+    if self.ifname.startswith('broken'):
+      raise IOError(19, 'No such device')
+    return (1000, True, True, True)
+
+
+class DownPynet(MockPynet):
+  """A MockPynet for an interface which is administratively down."""
+
+  def is_up(self):
+    return False
+
+  def get_link_info(self):
+    raise IOError(100, 'Network is down')
+
+
 if __name__ == '__main__':
   unittest.main()
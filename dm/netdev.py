@@ -20,12 +20,39 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import tr.cwmp_session
+
 # Unit tests can override this.
 PROC_NET_DEV = '/proc/net/dev'
 
 
+def ProcNetDev():
+  """Return all of /proc/net/dev, read at most once per tick.
+
+  Returns:
+    a dict of interface name to a tuple of its counters, as strings.
+  """
+  return _ParseProcNetDev(PROC_NET_DEV)
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def _ParseProcNetDev(filename):
+  counters = dict()
+  f = open(filename)
+  for line in f:
+    (ifname, colon, fields) = line.partition(':')
+    if colon:
+      counters[ifname.strip()] = tuple(fields.split())
+  f.close()
+  return counters
+
+
 class NetdevStatsLinux26(object):
-  """Parses /proc/net/dev to populate Stats objects in several TRs."""
+  """Parses /proc/net/dev to populate Stats objects in several TRs.
+
+  All of the Stats objects created during one tick share a single read
+  of /proc/net/dev, see ProcNetDev().
+  """
 
   # Fields in /proc/net/dev
   _RX_BYTES = 0
@@ -84,14 +111,9 @@ class NetdevStatsLinux26(object):
       ifname: string name of the interface, ecx: "eth0"
 
     Returns:
-      The /proc/net/dev entry for ifname as a list.
+      The /proc/net/dev entry for ifname as a tuple, or None.
     """
-    f = open(PROC_NET_DEV)
-    for line in f:
-      fields = line.split(':')
-      if (len(fields) == 2) and (fields[0].strip() == ifname):
-        return fields[1].split()
-    return None
+    return ProcNetDev().get(ifname)
 
 
 def main():
@@ -23,6 +23,7 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 import unittest
 
 import google3
+import tr.cwmp_session
 import netdev
 
 
@@ -31,6 +32,7 @@ class NetdevTest(unittest.TestCase):
 
   def setUp(self):
     self._old_PROC_NET_DEV = netdev.PROC_NET_DEV
+    tr.cwmp_session.cache.new_tick()
 
   def tearDown(self):
     netdev.PROC_NET_DEV = self._old_PROC_NET_DEV
@@ -76,6 +78,37 @@ class NetdevTest(unittest.TestCase):
     self.assertEqual(eth.UnicastPacketsSent, '80960002')
     self.assertEqual(eth.UnknownProtoPacketsReceived, None)
 
+  def testSnapshotPerTick(self):
+    netdev.PROC_NET_DEV = 'testdata/netdev/net_dev_200'
+    misses = netdev._ParseProcNetDev.misses
+    stats = [netdev.NetdevStatsLinux26('eth%d' % i) for i in range(200)]
+    self.assertEqual(netdev._ParseProcNetDev.misses, misses + 1)
+    self.assertEqual(stats[0].BytesReceived, '7')
+    self.assertEqual(stats[199].BytesReceived, str(199 * 1000003 + 7))
+    self.assertEqual(stats[199].PacketsSent, str(199 * 997 + 1))
+    self.assertEqual(len(netdev.ProcNetDev()), 200)
+    tr.cwmp_session.cache.new_tick()
+    netdev.NetdevStatsLinux26('eth0')
+    self.assertEqual(netdev._ParseProcNetDev.misses, misses + 2)
+
+  def testOneOpenPerTick(self):
+    netdev.PROC_NET_DEV = 'testdata/netdev/net_dev_200'
+    opened = []
+
+    def CountingOpen(filename, *args):
+      opened.append(filename)
+      return open(filename, *args)
+    netdev.open = CountingOpen
+    try:
+      for unused_r in range(5):
+        tr.cwmp_session.cache.new_tick()
+        for i in range(200):
+          netdev.NetdevStatsLinux26('eth%d' % i).BytesReceived
+    finally:
+      del netdev.open
+    # 200 interfaces, 5 ticks: /proc/net/dev is read once per tick.
+    self.assertEqual(opened, ['testdata/netdev/net_dev_200'] * 5)
+
 
 if __name__ == '__main__':
   unittest.main()
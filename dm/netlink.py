@@ -0,0 +1,381 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Follow network interface state through rtnetlink.
+
+A LinkWatcher subscribes to the RTMGRP_LINK multicast group on a
+NETLINK_ROUTE socket registered with the tornado ioloop.  The kernel
+tells us whenever an interface is added, removed, brought up or down, or
+gains or loses carrier, so we keep a table of every link's state without
+polling anything.
+
+Exporters which report on an interface can Watch() it: when its state
+changes their cached values are invalidated.  Once SetCpe() and SetRoot()
+have been called, the parameters they named are also reported to the ACS
+if it asked for that with their Notification attribute, at most once
+every NOTIFY_INTERVAL seconds per interface.
+"""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import collections
+import datetime
+import errno
+import socket
+import struct
+import sys
+import time
+import traceback
+import weakref
+
+import google3
+import tornado.ioloop
+import tr.cwmp_session
+
+
+# Unit tests can override these
+TIMENOW = time.time
+NOTIFY_INTERVAL = 5  # seconds between notifications for one interface
+
+# Values of the Notification attribute, see SetParameterAttributes in TR-069.
+NOTIFY_OFF = 0
+NOTIFY_PASSIVE = 1
+NOTIFY_ACTIVE = 2
+
+# From linux/netlink.h and linux/rtnetlink.h
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLMSG_OVERRUN = 4
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+IFLA_IFNAME = 3
+
+# From linux/if.h
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+
+_NLMSGHDR = struct.Struct('=IHHII')  # len, type, flags, seq, pid
+_IFINFOMSG = struct.Struct('=BxHiII')  # family, type, index, flags, change
+_RTATTR = struct.Struct('=HH')  # len, type
+_RECV_SIZE = 65536
+
+
+# ifname: the interface name, like 'eth0'
+# index: the kernel's ifindex.
+# is_up: True if the interface is administratively up (IFF_UP).
+# carrier: True if the interface has a link (IFF_LOWER_UP).
+# last_change: TIMENOW() when is_up or carrier last changed, or None if
+#   that happened before we were watching.
+LinkState = collections.namedtuple(
+    'LinkState', ('ifname', 'index', 'is_up', 'carrier', 'last_change'))
+
+
+def _Align(length):
+  return (length + 3) & ~3
+
+
+def ParseMessages(data):
+  """Parse RTM_NEWLINK and RTM_DELLINK messages.
+
+  Args:
+    data: a buffer of netlink messages, as read from the socket.
+  Returns:
+    a list of (type, ifname, index, flags) tuples for the link messages,
+    and (type, None, None, None) for everything else.
+  """
+  messages = []
+  offset = 0
+  while offset + _NLMSGHDR.size <= len(data):
+    (msglen, msgtype, unused_flags, unused_seq,
+     unused_pid) = _NLMSGHDR.unpack_from(data, offset)
+    if msglen < _NLMSGHDR.size or offset + msglen > len(data):
+      break  # truncated
+    if msgtype not in (RTM_NEWLINK, RTM_DELLINK):
+      messages.append((msgtype, None, None, None))
+      offset += _Align(msglen)
+      continue
+    body = offset + _NLMSGHDR.size
+    (unused_family, unused_type, index, flags,
+     unused_change) = _IFINFOMSG.unpack_from(data, body)
+    ifname = None
+    attr = body + _IFINFOMSG.size
+    while attr + _RTATTR.size <= offset + msglen:
+      (attrlen, attrtype) = _RTATTR.unpack_from(data, attr)
+      if attrlen < _RTATTR.size:
+        break
+      if attrtype == IFLA_IFNAME:
+        ifname = data[attr + _RTATTR.size:attr + attrlen].split('\0')[0]
+      attr += _Align(attrlen)
+    messages.append((msgtype, ifname, index, flags))
+    offset += _Align(msglen)
+  return messages
+
+
+def LinkMessage(msgtype, ifname, index, flags, seq=0):
+  """Build a link message like the kernel sends, for RTM_GETLINK and tests."""
+  attrs = ''
+  if ifname is not None:
+    name = ifname + '\0'
+    attrs = _RTATTR.pack(_RTATTR.size + len(name), IFLA_IFNAME) + name
+    attrs += '\0' * (_Align(len(attrs)) - len(attrs))
+  body = _IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, flags, 0) + attrs
+  msgflags = NLM_F_REQUEST | NLM_F_DUMP if msgtype == RTM_GETLINK else 0
+  return _NLMSGHDR.pack(_NLMSGHDR.size + len(body), msgtype, msgflags,
+                        seq, 0) + body
+
+
+class LinkWatcher(object):
+  """Keeps a table of LinkState for every interface, see the module docstring.
+  """
+
+  def __init__(self, ioloop=None, sock=None):
+    """Initialize a LinkWatcher.
+
+    Args:
+      ioloop: the tornado.ioloop.IOLoop to run on.
+      sock: a socket to read netlink messages from, for unit tests.  By
+        default Start() opens a NETLINK_ROUTE socket.
+    """
+    self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+    self._sock = sock
+    self.links = dict()
+    self.events = 0
+    self.resyncs = 0
+    self._listeners = []
+    self._watched = collections.defaultdict(list)
+    self._notification = weakref.WeakKeyDictionary()
+    self._last_notify = dict()
+    self._notify_timers = dict()
+    self._cpe = None
+    self._root = None
+    self._seq = 0
+
+  def Start(self):
+    """Subscribe to link changes and ask for the state of every link.
+
+    Raises:
+      socket.error: if this system doesn't have rtnetlink.
+    """
+    if self._sock is None:
+      self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 NETLINK_ROUTE)
+      self._sock.bind((0, RTMGRP_LINK))
+    self._sock.setblocking(False)
+    self.ioloop.add_handler(self._sock.fileno(), self._Read,
+                            self.ioloop.READ)
+    self._Dump()
+
+  def Stop(self):
+    for timer in self._notify_timers.values():
+      self.ioloop.remove_timeout(timer)
+    self._notify_timers.clear()
+    if self._sock is not None:
+      self.ioloop.remove_handler(self._sock.fileno())
+      self._sock.close()
+      self._sock = None
+
+  def SetCpe(self, cpe):
+    """The CPE state machine to send value change notifications through."""
+    self._cpe = cpe
+
+  def SetRoot(self, root):
+    """The root of the data model, to find the names of watched objects."""
+    self._root = root
+
+  def Get(self, ifname):
+    """Return the LinkState of ifname, or None if we haven't heard of it."""
+    return self.links.get(ifname)
+
+  def AddListener(self, callback):
+    """Call callback(old, new) whenever a link changes state.
+
+    old is None for a link we hadn't seen before, new is None for a link
+    which was removed.
+
+    Args:
+      callback: the function to call.
+    """
+    self._listeners.append(callback)
+
+  def RemoveListener(self, callback):
+    self._listeners.remove(callback)
+
+  def Watch(self, ifname, exporter, params):
+    """Tell exporter about changes to ifname.
+
+    Values cached by exporter's methods are invalidated, and params are
+    notified as SetNotification() asks.  Only a weak reference to exporter
+    is kept.
+
+    Args:
+      ifname: the interface name, like 'eth0'.
+      exporter: a tr.core.Exporter which reports on ifname.
+      params: the names of exporter's parameters which change with it.
+    """
+    self._watched[ifname].append((weakref.ref(exporter), list(params)))
+
+  def SetNotification(self, exporter, level):
+    """Set the Notification attribute of a Watch()ed exporter's params.
+
+    Args:
+      exporter: the tr.core.Exporter passed to Watch().
+      level: NOTIFY_OFF, NOTIFY_PASSIVE to only send the changed values
+        with the next session, or NOTIFY_ACTIVE to start one for them.
+    """
+    self._notification[exporter] = level
+
+  def _Dump(self):
+    """Ask the kernel for the state of every link."""
+    self._seq += 1
+    try:
+      self._sock.send(LinkMessage(RTM_GETLINK, None, 0, 0, seq=self._seq))
+    except socket.error, e:
+      print 'netlink: RTM_GETLINK failed: %s' % e
+
+  def _Read(self, unused_fd, unused_events):
+    """Called by the ioloop when there are netlink messages to read."""
+    while self._sock is not None:
+      try:
+        data = self._sock.recv(_RECV_SIZE)
+      except socket.error, e:
+        if e.args[0] in (errno.EAGAIN, errno.EINTR):
+          return
+        if e.args[0] == errno.ENOBUFS:
+          # we fell behind and the kernel dropped messages.  Start over.
+          self.resyncs += 1
+          self._Dump()
+          continue
+        print 'netlink: recv failed: %s' % e
+        return
+      if not data:
+        return
+      for (msgtype, ifname, index, flags) in ParseMessages(data):
+        if msgtype == RTM_NEWLINK and ifname:
+          self._Update(ifname, LinkState(
+              ifname=ifname, index=index, is_up=bool(flags & IFF_UP),
+              carrier=bool(flags & IFF_LOWER_UP), last_change=None))
+        elif msgtype == RTM_DELLINK and ifname:
+          self._Update(ifname, None)
+
+  def _Update(self, ifname, new):
+    """Record the new state of ifname, and tell everyone if it changed."""
+    old = self.links.get(ifname)
+    if new is not None and old is not None:
+      if (new.is_up, new.carrier) == (old.is_up, old.carrier):
+        self.links[ifname] = old._replace(index=new.index)
+        return  # probably just statistics.
+      new = new._replace(last_change=TIMENOW())
+    if new is None:
+      if old is None:
+        return
+      del self.links[ifname]
+    else:
+      self.links[ifname] = new
+    self.events += 1
+    for callback in list(self._listeners):
+      try:
+        callback(old, new)
+      except Exception:  #gpylint: disable-msg=W0703
+        print 'netlink: listener for %s failed' % ifname
+        traceback.print_exc(file=sys.stdout)
+    if old is not None:
+      self._Notify(ifname)
+
+  def _Notify(self, ifname):
+    """Invalidate watchers' caches, and schedule their notifications."""
+    live = []
+    notify = False
+    for (ref, params) in self._watched.get(ifname, []):
+      exporter = ref()
+      if exporter is None:
+        continue
+      live.append((ref, params))
+      tr.cwmp_session.cache.invalidate(exporter)
+      if self._notification.get(exporter, NOTIFY_OFF) != NOTIFY_OFF:
+        notify = True
+    if ifname in self._watched:
+      self._watched[ifname] = live
+    if not notify or self._cpe is None or self._root is None:
+      return
+    if ifname in self._notify_timers:
+      return  # a burst of changes, already scheduled.
+    wait = self._last_notify.get(ifname, 0) + NOTIFY_INTERVAL - TIMENOW()
+    if wait > 0:
+      self._notify_timers[ifname] = self.ioloop.add_timeout(
+          datetime.timedelta(seconds=wait),
+          lambda: self._SendNotification(ifname))
+    else:
+      self._SendNotification(ifname)
+
+  def _SendNotification(self, ifname):
+    """Send the current values of ifname's watched params to the ACS."""
+    self._notify_timers.pop(ifname, None)
+    self._last_notify[ifname] = TIMENOW()
+    changed = []
+    active = False
+    for (ref, params) in self._watched.get(ifname, []):
+      exporter = ref()
+      if exporter is None:
+        continue
+      level = self._notification.get(exporter, NOTIFY_OFF)
+      if level == NOTIFY_OFF:
+        continue
+      name = self._root.GetCanonicalName(exporter)
+      if not name:
+        continue
+      for param in params:
+        try:
+          value = exporter.GetExport(param)
+        except Exception:  #gpylint: disable-msg=W0703
+          continue
+        changed.append(('%s.%s' % (name, param), value))
+      if level == NOTIFY_ACTIVE:
+        active = True
+    if changed:
+      self._cpe.SetNotificationParameters(changed)
+      if active:
+        self._cpe.NewValueChangeSession()
+
+
+_watcher = None
+
+
+def Instance():
+  """Returns the shared, started LinkWatcher, or None without rtnetlink."""
+  global _watcher
+  if _watcher is None:
+    watcher = LinkWatcher()
+    try:
+      watcher.Start()
+    except (AttributeError, socket.error), e:
+      print 'netlink: link state events unavailable: %s' % e
+      return None
+    _watcher = watcher
+  return _watcher
+
+
+def main():
+  loop = tornado.ioloop.IOLoop.instance()
+  watcher = Instance()
+  watcher.AddListener(lambda old, new: sys.stdout.write('%r\n' % (new,)))
+  loop.start()
+
+if __name__ == '__main__':
+  main()
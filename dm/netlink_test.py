@@ -0,0 +1,306 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+#pylint: disable-msg=C6409
+
+"""Unit tests for netlink.py."""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import datetime
+import os
+import socket
+import subprocess
+import sys
+import unittest
+
+import google3
+import tornado.ioloop
+import tr.core
+import tr.cwmp_session
+import ethernet
+import netlink
+
+
+UP = netlink.IFF_UP
+CARRIER = netlink.IFF_UP | netlink.IFF_LOWER_UP
+
+
+class FakeCpe(object):
+  def __init__(self):
+    self.parameters = []
+    self.sessions = 0
+
+  def SetNotificationParameters(self, parameters):
+    self.parameters.extend(parameters)
+
+  def NewValueChangeSession(self):
+    self.sessions += 1
+
+
+class FakeRoot(tr.core.Exporter):
+  def __init__(self, interfaces):
+    tr.core.Exporter.__init__(self)
+    self.InterfaceList = interfaces
+    self.Export(lists=['Interface'])
+
+
+class MockPynet(object):
+  calls = 0
+
+  def __init__(self, ifname):
+    self.ifname = ifname
+
+  def is_up(self):
+    MockPynet.calls += 1
+    return True
+
+  def get_link_info(self):
+    MockPynet.calls += 1
+    return (1000, True, True, True)
+
+
+class NetlinkTest(unittest.TestCase):
+  """Tests for netlink.py, with messages written to a socketpair."""
+
+  def setUp(self):
+    self.old_PYNETIFCONF = ethernet.PYNETIFCONF
+    self.old_TIMENOW = netlink.TIMENOW
+    self.old_NOTIFY_INTERVAL = netlink.NOTIFY_INTERVAL
+    ethernet.PYNETIFCONF = MockPynet
+    netlink.TIMENOW = lambda: 1330000000.0
+    tr.cwmp_session.cache.new_tick()
+    self.ioloop = tornado.ioloop.IOLoop()
+    (self.kernel, sock) = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    self.watcher = netlink.LinkWatcher(ioloop=self.ioloop, sock=sock)
+    self.changes = []
+    self.watcher.AddListener(lambda old, new: self.changes.append((old, new)))
+
+  def tearDown(self):
+    ethernet.PYNETIFCONF = self.old_PYNETIFCONF
+    netlink.TIMENOW = self.old_TIMENOW
+    netlink.NOTIFY_INTERVAL = self.old_NOTIFY_INTERVAL
+    self.watcher.Stop()
+    self.kernel.close()
+    self.ioloop.close(all_fds=True)
+
+  def _Send(self, *messages):
+    """Send messages from the fake kernel and wait for the watcher."""
+    self.kernel.send(''.join(messages))
+    self._Run(0.05)
+
+  def _Run(self, seconds):
+    self.ioloop.add_timeout(datetime.timedelta(seconds=seconds),
+                            self.ioloop.stop)
+    self.ioloop.start()
+
+  def testParseMessages(self):
+    data = (netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER) +
+            netlink.LinkMessage(netlink.RTM_DELLINK, 'wlan12', 7, 0) +
+            netlink.LinkMessage(netlink.NLMSG_DONE, None, 0, 0))
+    self.assertEqual(netlink.ParseMessages(data),
+                     [(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER),
+                      (netlink.RTM_DELLINK, 'wlan12', 7, 0),
+                      (netlink.NLMSG_DONE, None, None, None)])
+    self.assertEqual(netlink.ParseMessages(data[:-4]),
+                     [(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER),
+                      (netlink.RTM_DELLINK, 'wlan12', 7, 0)])
+
+  def testLinkTable(self):
+    self.watcher.Start()
+    request = netlink.ParseMessages(self.kernel.recv(4096))
+    self.assertEqual(request, [(netlink.RTM_GETLINK, None, None, None)])
+
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER),
+               netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth1', 3, 0))
+    self.assertEqual(self.watcher.Get('eth0'), netlink.LinkState(
+        ifname='eth0', index=2, is_up=True, carrier=True, last_change=None))
+    self.assertFalse(self.watcher.Get('eth1').is_up)
+    self.assertEqual(len(self.changes), 2)
+
+    # nothing we care about changed.
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER))
+    self.assertEqual(len(self.changes), 2)
+
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, UP))
+    (old, new) = self.changes[-1]
+    self.assertTrue(old.carrier)
+    self.assertFalse(new.carrier)
+    self.assertEqual(new.last_change, 1330000000.0)
+
+    self._Send(netlink.LinkMessage(netlink.RTM_DELLINK, 'eth1', 3, 0))
+    self.assertEqual(self.changes[-1][1], None)
+    self.assertEqual(self.watcher.Get('eth1'), None)
+    self.assertEqual(self.watcher.events, 4)
+
+  def testEthernetNotification(self):
+    self.watcher.Start()
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER))
+    eth = ethernet.EthernetInterfaceLinux26('eth0', linkwatcher=self.watcher)
+    other = ethernet.EthernetInterfaceLinux26('eth1', linkwatcher=self.watcher)
+    root = FakeRoot({'1': eth, '2': other})
+    cpe = FakeCpe()
+    self.watcher.SetCpe(cpe)
+    self.watcher.SetRoot(root)
+    root.SetExportAttr('Interface.1', 'Notification', '2')
+    netlink.NOTIFY_INTERVAL = 0
+
+    MockPynet.calls = 0
+    self.assertEqual(eth.Status, 'Up')
+    self.assertEqual(eth.LastChange, 0)
+    self.assertEqual(MockPynet.calls, 0)  # no polling
+    eth.GetLinkInfo()
+    self.assertEqual(MockPynet.calls, 2)
+
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, UP))
+    self.assertEqual(cpe.parameters,
+                     [('Interface.1.Status', 'Dormant'),
+                      ('Interface.1.LastChange', 0)])
+    self.assertEqual(cpe.sessions, 1)
+    # LastChange counts the seconds since then.
+    netlink.TIMENOW = lambda: 1330000042.5
+    self.assertEqual(eth.LastChange, 42)
+    # the cached link info was dropped, even within the same tick.
+    eth.GetLinkInfo()
+    self.assertEqual(MockPynet.calls, 4)
+
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, 0))
+    self.assertEqual(eth.Status, 'Down')
+    self.assertEqual(cpe.parameters[-2], ('Interface.1.Status', 'Down'))
+
+    # an interface we weren't told about falls back to asking the kernel.
+    self.assertEqual(other.Status, 'Up')
+    self.assertEqual(MockPynet.calls, 6)
+
+  def testNotificationAttribute(self):
+    self.watcher.Start()
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER),
+               netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth1', 3, CARRIER))
+    eth0 = ethernet.EthernetInterfaceLinux26('eth0', linkwatcher=self.watcher)
+    eth1 = ethernet.EthernetInterfaceLinux26('eth1', linkwatcher=self.watcher)
+    root = FakeRoot({'1': eth0, '2': eth1})
+    cpe = FakeCpe()
+    self.watcher.SetCpe(cpe)
+    self.watcher.SetRoot(root)
+    netlink.NOTIFY_INTERVAL = 0
+
+    # Notification is off until the ACS asks for it.
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, UP))
+    self.assertEqual(cpe.parameters, [])
+    self.assertEqual(eth0.Status, 'Dormant')
+
+    # passive: queued for the next session, but doesn't start one.
+    root.SetExportAttr('Interface.2', 'Notification', '1')
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth1', 3, UP))
+    self.assertEqual(cpe.parameters[0], ('Interface.2.Status', 'Dormant'))
+    self.assertEqual(cpe.sessions, 0)
+
+    root.SetExportAttr('Interface.2', 'Notification', '0')
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth1', 3, CARRIER))
+    self.assertEqual(len(cpe.parameters), 2)
+
+  def testNotificationBurst(self):
+    self.watcher.Start()
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, CARRIER))
+    eth = ethernet.EthernetInterfaceLinux26('eth0', linkwatcher=self.watcher)
+    root = FakeRoot({'1': eth})
+    cpe = FakeCpe()
+    self.watcher.SetCpe(cpe)
+    self.watcher.SetRoot(root)
+    root.SetExportAttr('Interface.1', 'Notification', '2')
+    netlink.NOTIFY_INTERVAL = 0.3
+
+    self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, UP))
+    self.assertEqual(cpe.sessions, 1)
+    # a flapping link is reported once more, with its latest state.
+    for flags in (CARRIER, UP, CARRIER, 0):
+      self._Send(netlink.LinkMessage(netlink.RTM_NEWLINK, 'eth0', 2, flags))
+    self.assertEqual(cpe.sessions, 1)
+    self.assertEqual(len(cpe.parameters), 2)
+    self._Run(0.3)
+    self.assertEqual(cpe.sessions, 2)
+    self.assertEqual(cpe.parameters[2:],
+                     [('Interface.1.Status', 'Down'),
+                      ('Interface.1.LastChange', 0)])
+
+
+class VethTest(unittest.TestCase):
+  """Tests for netlink.py against the kernel, in a new network namespace."""
+
+  def setUp(self):
+    self.ioloop = tornado.ioloop.IOLoop()
+    self.watcher = None
+
+  def tearDown(self):
+    if self.watcher:
+      self.watcher.Stop()
+    self.ioloop.close(all_fds=True)
+
+  def _WaitFor(self, ifname, predicate):
+    def Check(old, new):
+      if (new or old).ifname == ifname and predicate(new):
+        self.ioloop.stop()
+    self.watcher.AddListener(Check)
+    tmo = self.ioloop.add_timeout(datetime.timedelta(seconds=5),
+                                  self.ioloop.stop)
+    self.ioloop.start()
+    self.ioloop.remove_timeout(tmo)
+    self.watcher.RemoveListener(Check)
+    return self.watcher.Get(ifname)
+
+  def testVeth(self):
+    if not os.environ.get('NETLINK_TEST_NETNS'):
+      # run just this test again, in a network namespace of its own.
+      if os.geteuid() != 0 or not hasattr(socket, 'AF_NETLINK'):
+        return
+      env = dict(os.environ, NETLINK_TEST_NETNS='1')
+      try:
+        rc = subprocess.call(['unshare', '--net', sys.executable,
+                              os.path.abspath(__file__), 'VethTest.testVeth'],
+                             env=env)
+      except OSError:
+        return  # no unshare here
+      self.assertEqual(rc, 0)
+      return
+
+    self.watcher = netlink.LinkWatcher(ioloop=self.ioloop)
+    self.watcher.Start()
+    subprocess.check_call(['ip', 'link', 'add', 'cwveth0', 'type', 'veth',
+                           'peer', 'name', 'cwveth1'])
+    state = self._WaitFor('cwveth0', lambda s: s is not None)
+    self.assertFalse(state.is_up)
+    subprocess.check_call(['ip', 'link', 'set', 'cwveth0', 'up'])
+    state = self._WaitFor('cwveth0', lambda s: s and s.is_up)
+    self.assertTrue(state.is_up)
+    self.assertFalse(state.carrier)
+    self.assertTrue(state.last_change)
+
+    # carrier comes with the peer.
+    subprocess.check_call(['ip', 'link', 'set', 'cwveth1', 'up'])
+    state = self._WaitFor('cwveth0', lambda s: s and s.carrier)
+    self.assertTrue(state.carrier)
+    subprocess.check_call(['ip', 'link', 'set', 'cwveth1', 'down'])
+    state = self._WaitFor('cwveth0', lambda s: s and not s.carrier)
+    self.assertFalse(state.carrier)
+
+    subprocess.check_call(['ip', 'link', 'del', 'cwveth0'])
+    self._WaitFor('cwveth0', lambda s: s is None)
+    self.assertEqual(self.watcher.Get('cwveth0'), None)
+    self.assertEqual(self.watcher.Get('cwveth1'), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -23,6 +23,7 @@ __author__ = 'jnewlin@google.com (John Newlin)'
 
 import datetime
 import time
+import tr.core
 import tr.cwmpbool
 import tr.tr157_v1_3
 
@@ -41,6 +42,24 @@ def _MakeSampleSeconds(sample_times):
   return ','.join(deltas)
 
 
+def _SampleString(value):
+  """A sample is a string, or a tr.core.Deferred which is still pending.
+
+  A Deferred which hasn't arrived by the time Values is read, or which
+  failed, reports an empty sample rather than its repr.
+
+  Args:
+    value: a string or a tr.core.Deferred.
+  Returns:
+    the string to report for this sample.
+  """
+  if not isinstance(value, tr.core.Deferred):
+    return value
+  if not value.done or value.exc_info:
+    return ''
+  return str(value.value)
+
+
 class PeriodicStatistics(BASE157PS):
   """An implementation of tr157 PeriodicStatistics sampling."""
 
@@ -432,7 +451,7 @@ class PeriodicStatistics(BASE157PS):
 
       @property
       def Values(self):
-        return ','.join(self._values)
+        return ','.join(_SampleString(v) for v in self._values)
 
       def SetParent(self, parent):
         """Set the parent object (should be a SampleSet)."""
@@ -451,7 +470,9 @@ class PeriodicStatistics(BASE157PS):
         try:
           # TODO(jnewlin): Update _suspect_data.
           current_value = self._root.GetExport(self.Reference)
-          self._values.append(str(current_value))
+          if not isinstance(current_value, tr.core.Deferred):
+            current_value = str(current_value)
+          self._values.append(current_value)
           self._sample_times.append((start_time, current_time))
         except (KeyError, AttributeError, IndexError):
           pass
@@ -80,6 +80,35 @@ class PeriodicStatisticsTest(unittest.TestCase):
     # Check that the sampled_param updated it's values.
     self.assertEqual('1000', sampled_param.Values)
 
+  def testCollectDeferredSample(self):
+    sampled_param = periodic_statistics.PeriodicStatistics.SampleSet.Parameter()
+    sampled_param.Enable = True
+    sampled_param.Reference = 'Device.MoCA.Interface.1.DebugOutput'
+    sample_set = periodic_statistics.PeriodicStatistics.SampleSet()
+    deferreds = [tr.core.Deferred(), tr.core.Deferred(), tr.core.Deferred()]
+    m = mox.Mox()
+    mock_root = m.CreateMock(tr.core.Exporter)
+    for d in deferreds:
+      mock_root.GetExport(mox.IsA(str)).AndReturn(d)
+    m.ReplayAll()
+
+    sample_set.SetCpeAndRoot(cpe=object(), root=mock_root)
+    sample_set.SetParameter('1', sampled_param)
+    sample_set.ReportSamples = 3
+    for unused_d in deferreds:
+      sample_set.CollectSample()
+    m.VerifyAll()
+    # still being fetched, so not reported yet.
+    self.assertEqual(',,', sampled_param.Values)
+    deferreds[0].Resolve(1000)
+    try:
+      raise IOError('mocactl failed')
+    except IOError:
+      deferreds[2].Fail()
+    self.assertEqual('1000,,', sampled_param.Values)
+    deferreds[1].Resolve(2000)
+    self.assertEqual('1000,2000,', sampled_param.Values)
+
   def testCollectSampleWrap(self):
     obj_name = 'InternetGatewayDevice.LANDevice.1.WLANConfiguration.1.'
     obj_param = 'TotalBytesSent'
@@ -21,13 +21,22 @@
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
 
+import collections
 import ctypes
+import datetime
 import fcntl
 import os
 import os.path
 import re
-import subprocess
+import stat
+import threading
+import tornado.ioloop
+import diskusage
 import tr.core
+import tr.cwmp_session
+import tr.executor
+import tr.filecache
+import tr.helpers
 import tr.tr140_v1_1
 import tr.x_catawampus_storage_1_0
 
@@ -69,9 +78,14 @@ PROC_FILESYSTEMS = '/proc/filesystems'
 PROC_MOUNTS = '/proc/mounts'
 SLASHDEV = '/dev/'
 SMARTCTL = '/usr/sbin/smartctl'
+SMARTCTL_INTERVAL = 600
+SMARTCTL_STANDBY_RETRY = 60
 STATVFS = os.statvfs
+STATVFS_TIMEOUT = 2.0
+STATVFS_TTL = 2.0  # seconds a statvfs result is kept
 SYS_BLOCK = '/sys/block/'
 SYS_UBI = '/sys/class/ubi/'
+TIMENOW = tr.helpers.monotime
 
 
 def _FsType(fstype):
@@ -101,6 +115,46 @@ def _GetFieldFromOutput(prefix, output, default=''):
   return default
 
 
+# Everything we use from one run of smartctl.
+SmartRecord = collections.namedtuple(
+    'SmartRecord', ('serial firmware capable health power_on_hours'))
+EMPTY_SMART_RECORD = SmartRecord(serial='', firmware='', capable=False,
+                                 health='', power_on_hours=0)
+_SMART_STANDBY_RE = re.compile(r'^Device is in \S+ mode', re.MULTILINE)
+_SMART_POWER_ON_RE = re.compile(
+    r'^\s*9\s+Power_On_Hours\s+(?:\S+\s+){7}(\d+)', re.MULTILINE)
+
+
+def _ParseSmartctl(output):
+  """Parse the output of smartctl -a into a SmartRecord."""
+  health = _GetFieldFromOutput(
+      prefix='SMART overall-health self-assessment test result:',
+      output=output, default='')
+  if not health:
+    # SCSI and SAS drives say it differently.
+    health = _GetFieldFromOutput(prefix='SMART Health Status:',
+                                 output=output, default='')
+  capable = _GetFieldFromOutput(prefix='SMART support is: Enab',
+                                output=output, default=None)
+  power_on = _SMART_POWER_ON_RE.search(output)
+  return SmartRecord(
+      serial=_GetFieldFromOutput(prefix='Serial Number:', output=output),
+      firmware=_GetFieldFromOutput(prefix='Firmware Version:', output=output),
+      capable=True if capable else False,
+      health=health,
+      power_on_hours=int(power_on.group(1)) if power_on else 0)
+
+
+def _Health(health):
+  """Convert the smartctl health test result to PhysicalMedium.Health."""
+  if health == 'PASSED' or health == 'OK':
+    return 'OK'
+  elif health.find('FAIL') >= 0:
+    return 'Failing'
+  else:
+    return 'Error'
+
+
 def _ReadOneLine(filename, default):
   """Read one line from a file. Return default if anything fails."""
   try:
@@ -119,6 +173,263 @@ def IntFromFile(filename):
     return 0
 
 
+class _StatVfsJob(object):
+  """One call to STATVFS, running in a worker thread."""
+
+  def __init__(self, rootpath):
+    self.rootpath = rootpath
+    self.started = TIMENOW()
+    self.done = threading.Event()
+    self.vfs = None
+    self.error = None
+    self.waiters = []
+
+
+class StatVfsCache(object):
+  """One statvfs per mount point per STATVFS_TTL, which can't hang the ioloop.
+
+  A statvfs of a dead NFS server or a wedged USB disk can block for
+  minutes.  Every call runs in a worker thread, and we give up waiting
+  for it after STATVFS_TIMEOUT seconds.  The mount point is then marked
+  stale and keeps its last known values, and no other thread is started
+  for it until the stuck one returns.
+
+  Prefetch() is the snapshot for tr.core.Exporter.DeclarePrefetch, it
+  waits on the ioloop.  Get() is for getters called without a snapshot,
+  it blocks for at most STATVFS_TIMEOUT.
+
+  Results are kept for STATVFS_TTL seconds rather than for the tick: the
+  tick usually ends before the worker thread's result gets back to the
+  ioloop, and the getters would then run statvfs all over again.
+  """
+
+  def __init__(self, ioloop=None):
+    self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+    self._collected = {}
+    self._jobs = {}
+    self._vfs = {}
+    self._errors = {}
+    self._stale = set()
+    self.calls = 0
+    self.hits = 0
+    self.timeouts = 0
+
+  def Get(self, rootpath):
+    """Return the statvfs of rootpath, at most STATVFS_TTL seconds old.
+
+    Args:
+      rootpath: the mount point.
+    Returns:
+      the result of STATVFS, the last known one if the mount point is
+      stale, or None if it has never returned.
+    Raises:
+      OSError: if statvfs failed.
+    """
+    if self._IsFresh(rootpath):
+      self.hits += 1
+    else:
+      job = self._Start(rootpath)
+      job.done.wait(self._Remaining(job))
+      self._Collect(job)
+    if rootpath in self._errors and rootpath not in self._stale:
+      raise self._errors[rootpath]
+    return self._vfs.get(rootpath)
+
+  def Prefetch(self, rootpath):
+    """Start the statvfs of rootpath, unless a recent one is known.
+
+    Args:
+      rootpath: the mount point.
+    Returns:
+      a tr.core.Deferred which is done when Get(rootpath) won't block,
+      or None if it already won't.
+    """
+    if self._IsFresh(rootpath):
+      return None
+    job = self._Start(rootpath)
+    remaining = self._Remaining(job)
+    if job.done.is_set() or not remaining:
+      self._Collect(job)
+      return None
+    d = tr.core.Deferred()
+
+    def Done():
+      if not d.done:
+        self.ioloop.remove_timeout(timer)
+        self._Collect(job)
+        d.Resolve(None)
+    timer = self.ioloop.add_timeout(datetime.timedelta(seconds=remaining),
+                                    Done)
+    job.waiters.append(Done)
+    return d
+
+  def IsStale(self, rootpath):
+    """True if the last statvfs of rootpath didn't return in time."""
+    return rootpath in self._stale
+
+  def IsUsable(self, rootpath):
+    """True if statvfs of rootpath has returned, and the last one in time."""
+    return rootpath in self._collected and rootpath not in self._stale
+
+  def Stats(self):
+    """Return a dict of counters, for monitoring."""
+    return {'calls': self.calls,
+            'hits': self.hits,
+            'timeouts': self.timeouts,
+            'stale': sorted(self._stale)}
+
+  def _IsFresh(self, rootpath):
+    collected = self._collected.get(rootpath)
+    return collected is not None and TIMENOW() - collected < STATVFS_TTL
+
+  def _Remaining(self, job):
+    return max(0.0, STATVFS_TIMEOUT - (TIMENOW() - job.started))
+
+  def _Start(self, rootpath):
+    """Return the job for rootpath, starting one if there isn't one."""
+    job = self._jobs.get(rootpath)
+    if job is None:
+      job = self._jobs[rootpath] = _StatVfsJob(rootpath)
+      self.calls += 1
+      thread = threading.Thread(target=self._Worker, args=(job,))
+      thread.daemon = True
+      thread.start()
+    return job
+
+  def _Worker(self, job):
+    """Runs in the worker thread."""
+    try:
+      job.vfs = STATVFS(job.rootpath)
+    except Exception, e:  #gpylint: disable-msg=W0703
+      job.error = e
+    job.done.set()
+    self.ioloop.add_callback(lambda: self._Finished(job))
+
+  def _Finished(self, job):
+    """Back on the ioloop, wake up whoever is waiting in Prefetch()."""
+    waiters = job.waiters
+    job.waiters = []
+    for waiter in waiters:
+      waiter()
+
+  def _Collect(self, job):
+    """Record the outcome of job, good for the next STATVFS_TTL seconds."""
+    rootpath = job.rootpath
+    self._collected[rootpath] = TIMENOW()
+    if not job.done.is_set():
+      self.timeouts += 1
+      self._stale.add(rootpath)
+      return
+    if self._jobs.get(rootpath) is job:
+      del self._jobs[rootpath]
+    self._stale.discard(rootpath)
+    if job.error is not None:
+      self._errors[rootpath] = job.error
+    else:
+      self._errors.pop(rootpath, None)
+      self._vfs[rootpath] = job.vfs
+
+
+_statvfs_cache = None
+
+
+def StatVfsCacheInstance():
+  """Returns the shared StatVfsCache."""
+  global _statvfs_cache
+  if _statvfs_cache is None:
+    _statvfs_cache = StatVfsCache()
+  return _statvfs_cache
+
+
+# what we report for a mount point which has never answered.
+_EMPTY_STATVFS = os.statvfs_result((0,) * 10)
+
+
+def _MountIsUsable(rootpath):
+  """True if the filesystem at rootpath can be read without hanging.
+
+  Until StatVfsCache has heard back from rootpath we don't know that it
+  can, so this starts a statvfs if there is no recent one.
+
+  Args:
+    rootpath: the mount point.
+  """
+  cache = StatVfsCacheInstance()
+  cache.Prefetch(rootpath)
+  return cache.IsUsable(rootpath)
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def _ListFolders(rootpath):
+  """Return the top-level directories of the filesystem at rootpath."""
+  if not _MountIsUsable(rootpath):
+    return []  # a hung mount would hang listdir too
+  try:
+    dev = os.lstat(rootpath).st_dev
+    names = os.listdir(rootpath)
+  except OSError:
+    return []
+  folders = []
+  for name in sorted(names):
+    try:
+      st = os.lstat(os.path.join(rootpath, name))
+    except OSError:
+      continue
+    # directories which are mount points belong to another LogicalVolume.
+    if stat.S_ISDIR(st.st_mode) and st.st_dev == dev:
+      folders.append(name)
+  return folders
+
+
+class FolderLinux26(BASESTORAGE.LogicalVolume.Folder):
+  """tr-140 LogicalVolume.Folder for a top-level directory of a volume.
+
+  Its space used is counted by dm.diskusage, in the background, while
+  the volume is usable.
+  """
+
+  def __init__(self, rootpath, name):
+    BASESTORAGE.LogicalVolume.Folder.__init__(self)
+    self.path = os.path.join(rootpath, name)
+    self._usable = lambda: _MountIsUsable(rootpath)
+    self.Unexport('Alias')
+    self.Unexport(objects='Quota')
+    self.GroupAccessList = {}
+    self.UserAccessList = {}
+
+  @property
+  def Name(self):
+    return self.path
+
+  @property
+  def Enable(self):
+    return True
+
+  @property
+  def UserAccountAccess(self):
+    return 0
+
+  @property
+  def GroupAccessNumberOfEntries(self):
+    return len(self.GroupAccessList)
+
+  @property
+  def UserAccessNumberOfEntries(self):
+    return len(self.UserAccessList)
+
+  @property
+  def X_CATAWAMPUS_ORG_UsedSpace(self):
+    usage = diskusage.Instance().Get(self.path, usable=self._usable)
+    return int(usage.bytes / 1024 / 1024)
+
+  @property
+  def X_CATAWAMPUS_ORG_UsedSpaceAge(self):
+    usage = diskusage.Instance().Get(self.path, usable=self._usable)
+    if usage.finished is None:
+      return -1
+    return int(diskusage.TIMENOW() - usage.finished)
+
+
 class LogicalVolumeLinux26(BASESTORAGE.LogicalVolume):
   """Implementation of tr-140 StorageService.LogicalVolume for Linux FS."""
 
@@ -130,8 +441,13 @@ class LogicalVolumeLinux26(BASESTORAGE.LogicalVolume):
     self.Unexport('Encrypted')
     self.Unexport('ThresholdReached')
     self.Unexport('PhysicalReference')
-    self.FolderList = {}
+    self.FolderList = tr.core.AutoDict(
+        'FolderList', iteritems=self.IterFolders,
+        getitem=self.GetFolderByIndex)
     self.ThresholdLimit = 0
+    self.DeclarePrefetch(['Capacity', 'ThresholdReached', 'UsedSpace',
+                          'X_CATAWAMPUS-ORG_ReadOnly', 'X_CATAWAMPUS-ORG_Stale'],
+                         StatVfsCacheInstance().Prefetch, rootpath)
 
   @property
   def Name(self):
@@ -149,9 +465,8 @@ class LogicalVolumeLinux26(BASESTORAGE.LogicalVolume):
   def FileSystem(self):
     return self.fstype
 
-  # TODO(dgentry) need @sessioncache decorator
   def _GetStatVfs(self):
-    return STATVFS(self.rootpath)
+    return StatVfsCacheInstance().Get(self.rootpath) or _EMPTY_STATVFS
 
   @property
   def Capacity(self):
@@ -177,10 +492,25 @@ class LogicalVolumeLinux26(BASESTORAGE.LogicalVolume):
     vfs = self._GetStatVfs()
     return True if vfs.f_flag & ST_RDONLY else False
 
+  @property
+  def X_CATAWAMPUS_ORG_Stale(self):
+    self._GetStatVfs()
+    return StatVfsCacheInstance().IsStale(self.rootpath)
+
   @property
   def FolderNumberOfEntries(self):
     return len(self.FolderList)
 
+  def IterFolders(self):
+    for (idx, name) in enumerate(_ListFolders(self.rootpath)):
+      yield idx, FolderLinux26(self.rootpath, name)
+
+  def GetFolderByIndex(self, index):
+    folders = _ListFolders(self.rootpath)
+    if index >= len(folders):
+      raise IndexError('No such object Folder.{0}'.format(index))
+    return FolderLinux26(self.rootpath, folders[index])
+
 
 class PhysicalMediumDiskLinux26(BASESTORAGE.PhysicalMedium):
   """tr-140 PhysicalMedium implementation for non-removable disks."""
@@ -197,8 +527,6 @@ class PhysicalMediumDiskLinux26(BASESTORAGE.PhysicalMedium):
     self.dev = dev
     self.name = dev
     self.Unexport('Alias')
-    # TODO(dgentry) read SMART attribute for PowerOnHours
-    self.Unexport('Uptime')
     # TODO(dgentry) What does 'Standby' or 'Offline' mean?
     self.Unexport('Status')
     if conn_type is None:
@@ -210,15 +538,55 @@ class PhysicalMediumDiskLinux26(BASESTORAGE.PhysicalMedium):
       # or define a vendor extension. Don't just make something up.
       assert conn_type[0:1] == 'X_' or conn_type in self.CONNECTION_TYPES
     self.conn_type = conn_type
-
-  # TODO(dgentry) need @sessioncache decorator
-  def _GetSmartctlOutput(self):
-    """Return smartctl info and health output."""
-    dev = SLASHDEV + self.dev
-    smart = subprocess.Popen([SMARTCTL, '--info', '--health', dev],
-                             stdout=subprocess.PIPE)
-    out, _ = smart.communicate(None)
-    return out
+    self._smart = EMPTY_SMART_RECORD
+    self._smart_time = None
+    self._smart_tried = None
+    self._smart_fetch = None
+
+  def _GetSmart(self):
+    """Return the SmartRecord, or a tr.core.Deferred if smartctl must run.
+
+    A record is kept for SMARTCTL_INTERVAL seconds.  While the disk is spun
+    down, or smartctl can't be run, we keep returning the last record we
+    got, and only check again every SMARTCTL_STANDBY_RETRY seconds.
+    smartctl runs through tr.executor, so a slow disk can't stall the
+    ioloop.
+    """
+    now = TIMENOW()
+    if self._smart_time is not None and (
+        now - self._smart_time < SMARTCTL_INTERVAL):
+      return self._smart
+    if self._smart_fetch is not None:
+      return self._smart_fetch
+    if self._smart_tried is not None and (
+        now - self._smart_tried < SMARTCTL_STANDBY_RETRY):
+      return self._smart
+    self._smart_tried = now
+    # '-n standby' has smartctl check the power mode first, and give up
+    # rather than spin the disk up.
+    argv = [SMARTCTL, '-a', '-n', 'standby', SLASHDEV + self.dev]
+    d = tr.executor.Instance().RunDeferred(argv).Then(self._SmartctlDone)
+    if not d.done:
+      self._smart_fetch = d
+    return d
+
+  def _SmartctlDone(self, result):
+    self._smart_fetch = None
+    if result.timedout or (result.returncode == tr.executor.EXEC_FAILED and
+                           not result.out):
+      return self._smart
+    if _SMART_STANDBY_RE.search(result.out):
+      return self._smart
+    self._smart = _ParseSmartctl(result.out)
+    self._smart_time = TIMENOW()
+    return self._smart
+
+  def _SmartField(self, func):
+    """Return func(SmartRecord), or a tr.core.Deferred for it."""
+    smart = self._GetSmart()
+    if isinstance(smart, tr.core.Deferred):
+      return smart.Then(func)
+    return func(smart)
 
   def GetName(self):
     return self.name
@@ -242,15 +610,11 @@ class PhysicalMediumDiskLinux26(BASESTORAGE.PhysicalMedium):
 
   @property
   def SerialNumber(self):
-    return _GetFieldFromOutput(prefix='Serial Number:',
-                               output=self._GetSmartctlOutput(),
-                               default='')
+    return self._SmartField(lambda smart: smart.serial)
 
   @property
   def FirmwareVersion(self):
-    return _GetFieldFromOutput(prefix='Firmware Version:',
-                               output=self._GetSmartctlOutput(),
-                               default='')
+    return self._SmartField(lambda smart: smart.firmware)
 
   @property
   def ConnectionType(self):
@@ -273,23 +637,21 @@ class PhysicalMediumDiskLinux26(BASESTORAGE.PhysicalMedium):
 
   @property
   def SMARTCapable(self):
-    capable = _GetFieldFromOutput(prefix='SMART support is: Enab',
-                                  output=self._GetSmartctlOutput(),
-                                  default=None)
-    return True if capable else False
+    return self._SmartField(lambda smart: smart.capable)
+
+  @property
+  def Uptime(self):
+    return self._SmartField(lambda smart: smart.power_on_hours)
+
+  @property
+  def X_CATAWAMPUS_ORG_SmartDataAge(self):
+    if self._smart_time is None:
+      return -1
+    return int(TIMENOW() - self._smart_time)
 
   @property
   def Health(self):
-    health = _GetFieldFromOutput(
-        prefix='SMART overall-health self-assessment test result:',
-        output=self._GetSmartctlOutput(),
-        default='')
-    if health == 'PASSED':
-      return 'OK'
-    elif health.find('FAIL') >= 0:
-      return 'Failing'
-    else:
-      return 'Error'
+    return self._SmartField(lambda smart: _Health(smart.health))
 
   @property
   def HotSwappable(self):
@@ -298,6 +660,74 @@ class PhysicalMediumDiskLinux26(BASESTORAGE.PhysicalMedium):
     return False if removable == '0' else True
 
 
+_UBI_DEVICE_RE = re.compile(r'^ubi(\d+)$')
+_UBI_VOLUME_RE = re.compile(r'^ubi(\d+)_(\d+)$')
+_UBI_DEVICE_ATTRS = ('bad_peb_count', 'eraseblock_size', 'max_ec',
+                     'min_io_size', 'mtd_num', 'reserved_for_bad',
+                     'total_eraseblocks')
+_UBI_VOLUME_ATTRS = ('corrupted', 'data_bytes', 'name')
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def _ScanUbi(sys_ubi):
+  """Return {device number: [volume numbers]} from one listing of sys_ubi."""
+  try:
+    names = os.listdir(sys_ubi)
+  except OSError:
+    return {}
+  devices = {}
+  for name in names:
+    dev = _UBI_DEVICE_RE.match(name)
+    if dev:
+      devices.setdefault(int(dev.group(1)), [])
+  for name in names:
+    vol = _UBI_VOLUME_RE.match(name)
+    if vol and int(vol.group(1)) in devices:
+      devices[int(vol.group(1))].append(int(vol.group(2)))
+  for volumes in devices.itervalues():
+    volumes.sort()
+  return devices
+
+
+def UbiDevices():
+  """Return the names of the UBI devices, like ['ubi0', 'ubi2']."""
+  return ['ubi%d' % num for num in sorted(_ScanUbi(SYS_UBI))]
+
+
+def UbiVolumes(ubiname):
+  """Return the names of the volumes of a UBI device, like ['ubi2_0']."""
+  dev = _UBI_DEVICE_RE.match(ubiname)
+  if not dev:
+    return []
+  num = int(dev.group(1))
+  return ['ubi%d_%d' % (num, vol) for vol in _ScanUbi(SYS_UBI).get(num, [])]
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def _ReadSysfsAttrs(dirname, attrs):
+  """Return {attr: first line of dirname/attr}, '' for any we can't read."""
+  values = {}
+  for attr in attrs:
+    try:
+      data = tr.filecache.Read(os.path.join(dirname, attr))
+    except IOError:
+      data = ''
+    values[attr] = data.split('\n', 1)[0].strip()
+  return values
+
+
+def _IntAttr(values, attr):
+  try:
+    return int(values[attr])
+  except ValueError:
+    return 0
+
+
+@tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+def _GetMtdStatsOncePerTick(mtddev):
+  return GETMTDSTATS(mtddev)
+
+
 class FlashSubVolUbiLinux26(BASESTORAGE.X_CATAWAMPUS_ORG_FlashMedia.SubVolume):
   """Catawampus Storage Flash SubVolume implementation for UBI volumes."""
 
@@ -305,59 +735,66 @@ class FlashSubVolUbiLinux26(BASESTORAGE.X_CATAWAMPUS_ORG_FlashMedia.SubVolume):
     BASESTORAGE.X_CATAWAMPUS_ORG_FlashMedia.SubVolume.__init__(self)
     self.ubivol = ubivol
 
+  def _Attrs(self):
+    return _ReadSysfsAttrs(os.path.join(SYS_UBI, self.ubivol),
+                           _UBI_VOLUME_ATTRS)
+
   @property
   def DataMBytes(self):
-    bytesiz = IntFromFile(os.path.join(SYS_UBI, self.ubivol, 'data_bytes'))
+    bytesiz = _IntAttr(self._Attrs(), 'data_bytes')
     return int(bytesiz / 1024 / 1024)
 
   @property
   def Name(self):
-    return _ReadOneLine(os.path.join(SYS_UBI, self.ubivol, 'name'), self.ubivol)
+    return self._Attrs()['name'] or self.ubivol
 
   @property
   def Status(self):
-    corr = IntFromFile(os.path.join(SYS_UBI, self.ubivol, 'corrupted'))
+    corr = _IntAttr(self._Attrs(), 'corrupted')
     return 'OK' if corr == 0 else 'Corrupted'
 
 
 class FlashMediumUbiLinux26(BASESTORAGE.X_CATAWAMPUS_ORG_FlashMedia):
-  """Catawampus Storage FlashMedium implementation for UBI volumes."""
+  """Catawampus Storage FlashMedium implementation for UBI volumes.
+
+  The sysfs attributes of the device are all read together, and the ECC
+  statistics of its MTD fetched just once, each tick.
+  """
 
   def __init__(self, ubiname):
     BASESTORAGE.X_CATAWAMPUS_ORG_FlashMedia.__init__(self)
     self.ubiname = ubiname
     self.SubVolumeList = {}
-    num = 0
-    for i in range(128):
-      subvolname = ubiname + '_' + str(i)
-      try:
-        if os.stat(os.path.join(SYS_UBI, self.ubiname, subvolname)):
-          self.SubVolumeList[str(num)] = FlashSubVolUbiLinux26(subvolname)
-          num += 1
-      except OSError:
-        pass
+    for (num, subvolname) in enumerate(UbiVolumes(ubiname)):
+      self.SubVolumeList[str(num)] = FlashSubVolUbiLinux26(subvolname)
+
+  def _Attrs(self):
+    return _ReadSysfsAttrs(os.path.join(SYS_UBI, self.ubiname),
+                           _UBI_DEVICE_ATTRS)
+
+  def _EccStats(self):
+    mtdnum = _IntAttr(self._Attrs(), 'mtd_num')
+    return _GetMtdStatsOncePerTick(os.path.join(SLASHDEV, 'mtd' + str(mtdnum)))
 
   @property
   def BadEraseBlocks(self):
-    return IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'bad_peb_count'))
+    return _IntAttr(self._Attrs(), 'bad_peb_count')
 
   @property
   def CorrectedErrors(self):
-    mtdnum = IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'mtd_num'))
-    ecc = GETMTDSTATS(os.path.join(SLASHDEV, 'mtd' + str(mtdnum)))
-    return ecc.corrected
+    return self._EccStats().corrected
 
   @property
   def EraseBlockSize(self):
-    return IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'eraseblock_size'))
+    return _IntAttr(self._Attrs(), 'eraseblock_size')
 
   @property
   def IOSize(self):
-    return IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'min_io_size'))
+    return _IntAttr(self._Attrs(), 'min_io_size')
 
   @property
   def MaxEraseCount(self):
-    return IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'max_ec'))
+    return _IntAttr(self._Attrs(), 'max_ec')
 
   @property
   def SubVolumeNumberOfEntries(self):
@@ -369,17 +806,15 @@ class FlashMediumUbiLinux26(BASESTORAGE.X_CATAWAMPUS_ORG_FlashMedia):
 
   @property
   def ReservedEraseBlocks(self):
-    return IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'reserved_for_bad'))
+    return _IntAttr(self._Attrs(), 'reserved_for_bad')
 
   @property
   def TotalEraseBlocks(self):
-    return IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'total_eraseblocks'))
+    return _IntAttr(self._Attrs(), 'total_eraseblocks')
 
   @property
   def UncorrectedErrors(self):
-    mtdnum = IntFromFile(os.path.join(SYS_UBI, self.ubiname, 'mtd_num'))
-    ecc = GETMTDSTATS(os.path.join(SLASHDEV, 'mtd' + str(mtdnum)))
-    return ecc.failed
+    return self._EccStats().failed
 
 
 class CapabilitiesNoneLinux26(BASESTORAGE.Capabilities):
@@ -21,9 +21,21 @@
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import collections
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 import google3
+import tornado.ioloop
+import tr.api
+import tr.core
+import tr.cwmp_session
+import tr.filecache
+import diskusage
 import storage
 
 
@@ -31,6 +43,7 @@ statvfsstruct = collections.namedtuple(
     'statvfs', ('f_bsize f_frsize f_blocks f_bfree f_bavail f_files f_ffree '
                 'f_favail f_flag f_namemax'))
 test_mtdpath = ''
+mtdstats_calls = 0
 
 
 def OsStatVfs(rootpath):
@@ -51,22 +64,148 @@ def OsStatVfs(rootpath):
 
 
 def GetMtdStats(mtdpath):
+  global mtdstats_calls
   global test_mtdpath
+  mtdstats_calls += 1
   test_mtdpath = mtdpath
   return storage.MtdEccStats(corrected=10, failed=20, badblocks=30, bbtblocks=40)
 
 
+class StatVfsCacheTest(unittest.TestCase):
+  """Tests for StatVfsCache, with a statvfs which can be made to hang."""
+
+  def setUp(self):
+    self.old_STATVFS = storage.STATVFS
+    self.old_STATVFS_TIMEOUT = storage.STATVFS_TIMEOUT
+    self.old_TIMENOW = storage.TIMENOW
+    self.now = 1000.0
+    storage.STATVFS = self.StatVfs
+    storage.STATVFS_TIMEOUT = 0.05
+    storage.TIMENOW = lambda: self.now
+    tr.cwmp_session.cache.new_tick()
+    self.ioloop = tornado.ioloop.IOLoop()
+    self.cache = storage.StatVfsCache(ioloop=self.ioloop)
+    self.unhang = threading.Event()
+    self.unhang.set()
+    self.calls = 0
+
+  def tearDown(self):
+    self.unhang.set()
+    # let the workers finish before their ioloop goes away.
+    for thread in threading.enumerate():
+      if thread is not threading.current_thread():
+        thread.join(5)
+    storage.STATVFS = self.old_STATVFS
+    storage.STATVFS_TIMEOUT = self.old_STATVFS_TIMEOUT
+    storage.TIMENOW = self.old_TIMENOW
+    self.ioloop.close(all_fds=True)
+
+  def StatVfs(self, rootpath):
+    self.calls += 1
+    self.unhang.wait(5)
+    return OsStatVfs(rootpath)
+
+  def _Wait(self, d):
+    """Run the ioloop until the Deferred d is done."""
+    if d is None or d.done:
+      return
+    d.AddCallback(lambda unused: self.ioloop.stop())
+    tmo = self.ioloop.add_timeout(datetime.timedelta(seconds=5),
+                                  self.ioloop.stop)
+    self.ioloop.start()
+    self.ioloop.remove_timeout(tmo)
+    self.assertTrue(d.done)
+
+  def testHungMount(self):
+    self.assertEqual(self.cache.Get('/foo').f_blocks, 8192)
+    self.assertFalse(self.cache.IsStale('/foo'))
+
+    self.unhang.clear()
+    self.now += storage.STATVFS_TTL
+    self.assertEqual(self.cache.Get('/foo').f_blocks, 8192)
+    self.assertTrue(self.cache.IsStale('/foo'))
+    self.assertEqual(self.calls, 2)
+
+    # the stuck call has used up its time, nobody waits for it again
+    # and no more threads pile up behind it.
+    self.now += storage.STATVFS_TTL
+    self.assertEqual(self.cache.Get('/foo').f_blocks, 8192)
+    self.assertEqual(self.cache.Prefetch('/foo'), None)
+    self.assertTrue(self.cache.IsStale('/foo'))
+    self.assertEqual(self.calls, 2)
+    self.assertEqual(self.cache.Stats()['stale'], ['/foo'])
+
+    self.unhang.set()
+    self.cache._jobs['/foo'].done.wait(5)
+    self.now += storage.STATVFS_TTL
+    self._Wait(self.cache.Prefetch('/foo'))
+    self.assertFalse(self.cache.IsStale('/foo'))
+    self.assertEqual(self.cache.Stats()['timeouts'], 2)
+
+  def testNeverAnswered(self):
+    self.unhang.clear()
+    self.assertEqual(self.cache.Get('/tmp'), None)
+    self.assertTrue(self.cache.IsStale('/tmp'))
+
+  def testPrefetch(self):
+    d = self.cache.Prefetch('/tmp')
+    self._Wait(d)
+    self.assertEqual(self.cache.Get('/tmp').f_bsize, 8192)
+    self.assertEqual(self.cache.hits, 1)
+    self.assertEqual(self.cache.Prefetch('/tmp'), None)
+
+    # a hung mount lets the snapshot finish after STATVFS_TIMEOUT.
+    self.unhang.clear()
+    self.now += storage.STATVFS_TTL
+    self._Wait(self.cache.Prefetch('/tmp'))
+    self.assertTrue(self.cache.IsStale('/tmp'))
+    self.assertEqual(self.cache.Get('/tmp').f_bsize, 8192)
+    self.assertEqual(self.calls, 2)
+
+  def testListFoldersWaitsForMount(self):
+    storage._statvfs_cache = self.cache
+    tmpdir = tempfile.mkdtemp()
+    try:
+      os.mkdir(os.path.join(tmpdir, 'tv'))
+      self.unhang.clear()
+      # not known to be safe to read yet.
+      self.assertEqual(storage._ListFolders(tmpdir), [])
+      self.now += 1
+      tr.cwmp_session.cache.new_tick()
+      self.assertEqual(storage._ListFolders(tmpdir), [])
+      self.assertTrue(self.cache.IsStale(tmpdir))
+
+      self.unhang.set()
+      self.cache._jobs[tmpdir].done.wait(5)
+      self.now += storage.STATVFS_TTL
+      tr.cwmp_session.cache.new_tick()
+      self.assertEqual(storage._ListFolders(tmpdir), ['tv'])
+    finally:
+      storage._statvfs_cache = None
+      shutil.rmtree(tmpdir)
+
+  def testError(self):
+    self.assertRaises(KeyError, self.cache.Get, '/nonexistent')
+    self.assertRaises(KeyError, self.cache.Get, '/nonexistent')
+    self.assertEqual(self.calls, 1)
+
+
 class StorageTest(unittest.TestCase):
   def setUp(self):
     storage.STATVFS = OsStatVfs
     storage.GETMTDSTATS = GetMtdStats
+    storage._statvfs_cache = None
+    tr.cwmp_session.cache.new_tick()
     self.old_PROC_FILESYSTEMS = storage.PROC_FILESYSTEMS
     self.old_PROC_MOUNTS = storage.PROC_MOUNTS
     self.old_SMARTCTL = storage.SMARTCTL
     self.old_SYS_BLOCK = storage.SYS_BLOCK
     self.old_SYS_UBI = storage.SYS_UBI
+    self.old_TIMENOW = storage.TIMENOW
+    self.now = 1000.0
+    storage.TIMENOW = lambda: self.now
     storage.SMARTCTL = 'testdata/storage/smartctl'
-    storage.SYS_UBI = 'testdata/storage/sys/class'
+    storage.SYS_UBI = 'testdata/storage/sys/class/ubi'
 
   def tearDown(self):
     storage.PROC_FILESYSTEMS = self.old_PROC_FILESYSTEMS
@@ -74,6 +213,20 @@ class StorageTest(unittest.TestCase):
     storage.SMARTCTL = self.old_SMARTCTL
     storage.SYS_BLOCK = self.old_SYS_BLOCK
     storage.SYS_UBI = self.old_SYS_UBI
+    storage.TIMENOW = self.old_TIMENOW
+    storage._statvfs_cache = None
+
+  def Resolve(self, value):
+    """Run the ioloop until a tr.core.Deferred value is done."""
+    if not isinstance(value, tr.core.Deferred):
+      return value
+    if not value.done:
+      loop = tornado.ioloop.IOLoop.instance()
+      value.AddCallback(lambda unused_d: loop.stop())
+      tmo = loop.add_timeout(datetime.timedelta(seconds=5), loop.stop)
+      loop.start()
+      loop.remove_timeout(tmo)
+    return value.Get()
 
   def testValidateExports(self):
     storage.PROC_FILESYSTEMS = 'testdata/storage/proc.filesystems'
@@ -105,6 +258,50 @@ class StorageTest(unittest.TestCase):
     stor.ThresholdLimit = 4
     self.assertTrue(stor.ThresholdReached)
 
+  def testLogicalVolumeStatVfsOncePerTtl(self):
+    calls = []
+
+    def CountingStatVfs(rootpath):
+      calls.append(rootpath)
+      return OsStatVfs(rootpath)
+    storage.STATVFS = CountingStatVfs
+    stor = storage.LogicalVolumeLinux26('/fakepath', 'fstype')
+    self.assertEqual(stor.Capacity, 4)
+    self.assertEqual(stor.UsedSpace, 2)
+    self.assertFalse(stor.ThresholdReached)
+    self.assertFalse(stor.X_CATAWAMPUS_ORG_ReadOnly)
+    self.assertFalse(stor.X_CATAWAMPUS_ORG_Stale)
+    # LogicalVolumeList makes a new object every time, it shares the snapshot.
+    stor = storage.LogicalVolumeLinux26('/fakepath', 'fstype')
+    self.assertEqual(stor.Capacity, 4)
+    self.assertEqual(calls, ['/fakepath'])
+    # a new tick shares it too, as long as it is recent.
+    tr.cwmp_session.cache.new_tick()
+    self.assertEqual(stor.Capacity, 4)
+    self.assertEqual(calls, ['/fakepath'])
+    self.now += storage.STATVFS_TTL
+    self.assertEqual(stor.Capacity, 4)
+    self.assertEqual(calls, ['/fakepath', '/fakepath'])
+
+  def testLogicalVolumePrefetchOnIoloop(self):
+    # the tick ends on the global ioloop while the worker thread runs,
+    # the getters must not run statvfs again after it.
+    calls = []
+
+    def SlowStatVfs(rootpath):
+      calls.append(rootpath)
+      time.sleep(0.05)
+      return OsStatVfs(rootpath)
+    storage.STATVFS = SlowStatVfs
+    stor = storage.LogicalVolumeLinux26('/fakepath', 'fstype')
+    cpe = tr.api.CPE(stor)
+    result = cpe.GetParameterValues(['Capacity', 'UsedSpace'])
+    self.assertTrue(isinstance(result, tr.core.Deferred))
+    self.assertEqual(self.Resolve(result),
+                     [('Capacity', 4), ('UsedSpace', 2)])
+    self.assertEqual(calls, ['/fakepath'])
+    self.assertEqual(storage.StatVfsCacheInstance().hits, 2)
+
   def testLogicalVolumeList(self):
     storage.PROC_MOUNTS = 'testdata/storage/proc.mounts'
     service = storage.StorageServiceLinux26()
@@ -124,6 +321,45 @@ class StorageTest(unittest.TestCase):
       self.assertEqual(vol.UsedSpace, expected)
       self.assertEqual(vol.X_CATAWAMPUS_ORG_ReadOnly, expectedRo[vol.Name])
 
+  def testFolderList(self):
+    storage.STATVFS = os.statvfs
+    tmpdir = tempfile.mkdtemp()
+    ioloop = tornado.ioloop.IOLoop()
+    old_diskusage = diskusage._diskusage
+    diskusage._diskusage = diskusage.DiskUsage(ioloop=ioloop,
+                                               use_inotify=False)
+    try:
+      for name in ['tv', 'music', 'photos']:
+        os.mkdir(os.path.join(tmpdir, name))
+      f = open(os.path.join(tmpdir, 'tv', 'recording.ts'), 'w')
+      f.write('x' * 3 * 1024 * 1024)
+      f.close()
+      open(os.path.join(tmpdir, 'not_a_folder'), 'w').close()
+      stor = storage.LogicalVolumeLinux26(tmpdir, 'fstype')
+      # folders are only listed once the mount has answered a statvfs.
+      self.assertTrue(storage.StatVfsCacheInstance().Get(tmpdir))
+      stor.ValidateExports()
+      folders = stor.FolderList
+      self.assertEqual(len(folders), 3)
+      self.assertEqual(stor.FolderNumberOfEntries, 3)
+      folder = folders[2]
+      folder.ValidateExports()
+      self.assertEqual(folder.Name, os.path.join(tmpdir, 'tv'))
+      self.assertTrue(folder.Enable)
+      # not counted yet, the walk happens on the ioloop.
+      self.assertEqual(folder.X_CATAWAMPUS_ORG_UsedSpace, 0)
+      self.assertEqual(folder.X_CATAWAMPUS_ORG_UsedSpaceAge, -1)
+      ioloop.add_timeout(datetime.timedelta(seconds=0.2), ioloop.stop)
+      ioloop.start()
+      self.assertEqual(folder.X_CATAWAMPUS_ORG_UsedSpace, 3)
+      self.assertTrue(folder.X_CATAWAMPUS_ORG_UsedSpaceAge >= 0)
+      self.assertRaises(IndexError, lambda: stor.FolderList[3])
+    finally:
+      diskusage._diskusage.Close()
+      diskusage._diskusage = old_diskusage
+      ioloop.close(all_fds=True)
+      shutil.rmtree(tmpdir)
+
   def testCapabilitiesNone(self):
     storage.PROC_FILESYSTEMS = 'testdata/storage/proc.filesystems'
     cap = storage.CapabilitiesNoneLinux26()
@@ -155,29 +391,92 @@ class StorageTest(unittest.TestCase):
     pm = storage.PhysicalMediumDiskLinux26('sda')
     self.assertEqual(pm.Vendor, 'vendor_name')
     self.assertEqual(pm.Model, 'model_name')
-    self.assertEqual(pm.SerialNumber, 'serial_number')
-    self.assertEqual(pm.FirmwareVersion, 'firmware_version')
-    self.assertTrue(pm.SMARTCapable)
-    self.assertEqual(pm.Health, 'OK')
+    self.assertEqual(self.Resolve(pm.SerialNumber), 'serial_number')
+    self.assertEqual(self.Resolve(pm.FirmwareVersion), 'firmware_version')
+    self.assertTrue(self.Resolve(pm.SMARTCapable))
+    self.assertEqual(self.Resolve(pm.Health), 'OK')
+    self.assertEqual(self.Resolve(pm.Uptime), 2623)
     self.assertFalse(pm.Removable)
+    pm.ValidateExports()
+
+  def testSmartctlOncePerInterval(self):
+    storage.SYS_BLOCK = 'testdata/storage/sys/block'
+    pm = storage.PhysicalMediumDiskLinux26('sda')
+    self.assertEqual(pm.X_CATAWAMPUS_ORG_SmartDataAge, -1)
+    self.assertEqual(self.Resolve(pm.Health), 'OK')
+    storage.SMARTCTL = 'testdata/storage/smartctl_healthfail'
+    self.now += storage.SMARTCTL_INTERVAL - 1
+    self.assertEqual(self.Resolve(pm.Health), 'OK')
+    self.assertEqual(self.Resolve(pm.SerialNumber), 'serial_number')
+    self.assertEqual(pm.X_CATAWAMPUS_ORG_SmartDataAge,
+                     storage.SMARTCTL_INTERVAL - 1)
+    self.now += 1
+    self.assertEqual(self.Resolve(pm.Health), 'Failing')
+    self.assertEqual(pm.X_CATAWAMPUS_ORG_SmartDataAge, 0)
+
+  def testSmartctlStandby(self):
+    storage.SMARTCTL = 'testdata/storage/smartctl_standby'
+    storage.SYS_BLOCK = 'testdata/storage/sys/block'
+    pm = storage.PhysicalMediumDiskLinux26('sda')
+    self.assertEqual(self.Resolve(pm.SerialNumber), '')
+    self.assertEqual(self.Resolve(pm.Health), 'Error')
+    self.assertEqual(pm.X_CATAWAMPUS_ORG_SmartDataAge, -1)
+
+    # the disk spun up, but we don't look again right away.
+    storage.SMARTCTL = 'testdata/storage/smartctl'
+    self.now += storage.SMARTCTL_STANDBY_RETRY - 1
+    self.assertEqual(self.Resolve(pm.SerialNumber), '')
+    self.now += 1
+    self.assertEqual(self.Resolve(pm.SerialNumber), 'serial_number')
+
+    # spun down again: the last data we got is kept, and ages.
+    storage.SMARTCTL = 'testdata/storage/smartctl_standby'
+    self.now += storage.SMARTCTL_INTERVAL + 5
+    self.assertEqual(self.Resolve(pm.Health), 'OK')
+    self.assertEqual(pm.X_CATAWAMPUS_ORG_SmartDataAge,
+                     storage.SMARTCTL_INTERVAL + 5)
+
+  def testSmartctlFails(self):
+    storage.SYS_BLOCK = 'testdata/storage/sys/block'
+    pm = storage.PhysicalMediumDiskLinux26('sda')
+    self.assertEqual(self.Resolve(pm.SerialNumber), 'serial_number')
+
+    # an exec failure keeps the last record, and doesn't make it fresh.
+    storage.SMARTCTL = '/nonexistent/smartctl'
+    self.now += storage.SMARTCTL_INTERVAL
+    self.assertEqual(self.Resolve(pm.SerialNumber), 'serial_number')
+    self.assertEqual(pm.X_CATAWAMPUS_ORG_SmartDataAge,
+                     storage.SMARTCTL_INTERVAL)
+
+  def testSmartctlOnce(self):
+    storage.SYS_BLOCK = 'testdata/storage/sys/block'
+    pm = storage.PhysicalMediumDiskLinux26('sda')
+    serial = pm.SerialNumber
+    health = pm.Health
+    self.assertTrue(isinstance(serial, tr.core.Deferred))
+    # both getters wait for the same smartctl.
+    self.assertEqual(self.Resolve(serial), 'serial_number')
+    self.assertTrue(health.done)
+    self.assertEqual(health.Get(), 'OK')
+    self.assertEqual(pm.Health, 'OK')
 
   def testNotSmartCapable(self):
     storage.SMARTCTL = 'testdata/storage/smartctl_disabled'
     storage.SYS_BLOCK = 'testdata/storage/sys/block'
     pm = storage.PhysicalMediumDiskLinux26('sda')
-    self.assertFalse(pm.SMARTCapable)
+    self.assertFalse(self.Resolve(pm.SMARTCapable))
 
   def testHealthFailing(self):
     storage.SMARTCTL = 'testdata/storage/smartctl_healthfail'
     storage.SYS_BLOCK = 'testdata/storage/sys/block'
     pm = storage.PhysicalMediumDiskLinux26('sda')
-    self.assertEqual(pm.Health, 'Failing')
+    self.assertEqual(self.Resolve(pm.Health), 'Failing')
 
   def testHealthError(self):
     storage.SMARTCTL = 'testdata/storage/smartctl_healtherr'
     storage.SYS_BLOCK = 'testdata/storage/sys/block'
     pm = storage.PhysicalMediumDiskLinux26('sda')
-    self.assertEqual(pm.Health, 'Error')
+    self.assertEqual(self.Resolve(pm.Health), 'Error')
 
   def testPhysicalMediumVendorATA(self):
     storage.SYS_BLOCK = 'testdata/storage/sys/block_ATA'
@@ -217,6 +516,37 @@ class StorageTest(unittest.TestCase):
     self.assertEqual(fm.TotalEraseBlocks, 508)
     self.assertEqual(fm.UncorrectedErrors, 20)
 
+  def testUbiInventory(self):
+    self.assertEqual(storage.UbiDevices(), ['ubi0', 'ubi2'])
+    self.assertEqual(storage.UbiVolumes('ubi2'),
+                     ['ubi2_0', 'ubi2_1', 'ubi2_2', 'ubi2_10'])
+    self.assertEqual(storage.UbiVolumes('ubi1'), [])
+    fm = storage.FlashMediumUbiLinux26('ubi2')
+    self.assertEqual(fm.SubVolumeNumberOfEntries, 4)
+    self.assertEqual(fm.SubVolumeList['3'].Name, 'subvol10')
+    fm = storage.FlashMediumUbiLinux26('ubi0')
+    self.assertEqual(fm.SubVolumeList['0'].Name, 'rootfs')
+    self.assertEqual(fm.CorrectedErrors, 10)
+    self.assertEqual(test_mtdpath, '/dev/mtd6')
+
+  def testFlashMediumOncePerTick(self):
+    global mtdstats_calls
+    mtdstats_calls = 0
+    reads = tr.filecache.Instance().reads
+    for unused_i in range(2):
+      for ubiname in storage.UbiDevices():
+        fm = storage.FlashMediumUbiLinux26(ubiname)
+        for param in ['BadEraseBlocks', 'CorrectedErrors', 'EraseBlockSize',
+                      'IOSize', 'MaxEraseCount', 'ReservedEraseBlocks',
+                      'TotalEraseBlocks', 'UncorrectedErrors']:
+          getattr(fm, param)
+    self.assertEqual(mtdstats_calls, 2)
+    self.assertEqual(tr.filecache.Instance().reads - reads,
+                     2 * len(storage._UBI_DEVICE_ATTRS))
+    tr.cwmp_session.cache.new_tick()
+    storage.FlashMediumUbiLinux26('ubi2').UncorrectedErrors
+    self.assertEqual(mtdstats_calls, 3)
+
   def testFlashSubVolume(self):
     sv = storage.FlashSubVolUbiLinux26('ubi2_0')
     sv.ValidateExports()
@@ -230,5 +560,57 @@ class StorageTest(unittest.TestCase):
     self.assertEqual(sv.Status, 'Corrupted')
 
 
+class UbiScaleTest(unittest.TestCase):
+  """Inventory of a synthetic /sys/class/ubi with lots of volumes."""
+
+  DEVICES = 8
+  VOLUMES = 64
+
+  def setUp(self):
+    self.old_GETMTDSTATS = storage.GETMTDSTATS
+    self.old_SYS_UBI = storage.SYS_UBI
+    self.tmpdir = tempfile.mkdtemp()
+    storage.GETMTDSTATS = GetMtdStats
+    storage.SYS_UBI = self.tmpdir
+    tr.cwmp_session.cache.new_tick()
+    for dev in range(self.DEVICES):
+      self.Write('ubi%d' % dev, dict((attr, dev) for attr in
+                                     storage._UBI_DEVICE_ATTRS))
+      for vol in range(self.VOLUMES):
+        self.Write('ubi%d_%d' % (dev, vol),
+                   {'corrupted': 0, 'data_bytes': 1048576 * vol,
+                    'name': 'vol%d' % vol})
+
+  def tearDown(self):
+    storage.GETMTDSTATS = self.old_GETMTDSTATS
+    storage.SYS_UBI = self.old_SYS_UBI
+    shutil.rmtree(self.tmpdir)
+
+  def Write(self, name, attrs):
+    dirname = os.path.join(self.tmpdir, name)
+    os.mkdir(dirname)
+    for (attr, value) in attrs.iteritems():
+      f = open(os.path.join(dirname, attr), 'w')
+      f.write('%s\n' % value)
+      f.close()
+
+  def testInventory(self):
+    reads = tr.filecache.Instance().reads
+    media = [storage.FlashMediumUbiLinux26(u) for u in storage.UbiDevices()]
+    self.assertEqual(len(media), self.DEVICES)
+    for fm in media:
+      self.assertEqual(fm.SubVolumeNumberOfEntries, self.VOLUMES)
+      for (idx, sv) in fm.SubVolumeList.iteritems():
+        self.assertEqual(sv.DataMBytes, int(idx))
+        self.assertEqual(sv.Name, 'vol' + idx)
+        self.assertEqual(sv.Status, 'OK')
+      self.assertEqual(fm.TotalEraseBlocks, int(fm.ubiname[3:]))
+    # every attribute file was read exactly once.
+    self.assertEqual(tr.filecache.Instance().reads - reads,
+                     self.DEVICES * (len(storage._UBI_DEVICE_ATTRS) +
+                                     self.VOLUMES *
+                                     len(storage._UBI_VOLUME_ATTRS)))
+
+
 if __name__ == '__main__':
   unittest.main()
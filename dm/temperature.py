@@ -26,12 +26,17 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import copy
 import datetime
+import glob
+import os
 import re
-import subprocess
 import tornado.ioloop
 import tr.core
+import tr.cwmp_session
 import tr.cwmpbool
 import tr.cwmpdate
+import tr.executor
+import tr.filecache
+import tr.scheduler
 import tr.tr181_v2_2
 import tr.x_catawampus_tr181_2_0
 
@@ -44,7 +49,9 @@ BADCELSIUS = -274
 
 # Unit tests can override these with fake data
 HDPARM = 'hdparm'
-PERIODICCALL = tornado.ioloop.PeriodicCallback
+SYS_CLASS_HWMON = '/sys/class/hwmon'
+SYS_CLASS_THERMAL = '/sys/class/thermal'
+PERIODICCALL = tr.scheduler.PeriodicCallback
 TIMENOW = datetime.datetime.now
 
 
@@ -52,14 +59,14 @@ def GetNumberFromFile(filename):
   """Extract a number from a file.
 
   The number can be an integer or float. If float, it will be rounded.
+  The file is read at most once per tick, see tr/filecache.py.
 
   Returns:
     an integer.
   """
-  with open(filename, 'r') as f:
-    result = NUMBER.search(f.readline())
-    if result is not None:
-      return int(round(float(result.group(0))))
+  result = NUMBER.search(tr.filecache.Open(filename).readline())
+  if result is not None:
+    return int(round(float(result.group(0))))
   raise ValueError('No number found in %s' % filename)
 
 
@@ -229,7 +236,14 @@ class TemperatureSensor(BASE181TEMPERATURE.TemperatureSensor):
     return self._value
 
   def SampleTemperature(self):
+    """Read the sensor.  It may answer later, with a tr.core.Deferred."""
     t = self._sensor.GetTemperature()
+    if isinstance(t, tr.core.Deferred):
+      t.AddCallback(lambda d: self._Record(d.Get()))
+    else:
+      self._Record(t)
+
+  def _Record(self, t):
     self._value = t
     now = tr.cwmpdate.format(TIMENOW())
     self._last_update = now
@@ -258,7 +272,8 @@ class TemperatureSensor(BASE181TEMPERATURE.TemperatureSensor):
       self.scheduler = None
     if self.config.p_enable:
       self.scheduler = PERIODICCALL(self.SampleTemperature,
-              self.config.p_polling_interval * 1000, io_loop=self.ioloop)
+              self.config.p_polling_interval * 1000, io_loop=self.ioloop,
+              name='TemperatureSensor')
       self.scheduler.start()
     # Let new alarm thresholds take effect
     self.SampleTemperature()
@@ -269,16 +284,23 @@ class SensorHdparm(object):
 
      This object can be passed as the sensor argument to a
      TemperatureSensor object, to monitor hard drive temperature.
+     hdparm runs in the background through tr.executor, so
+     GetTemperature() returns a tr.core.Deferred.  Prefer the drivetemp
+     hwmon driver, see SysfsSensors, where the kernel has it.
   """
 
   DRIVETEMP = re.compile(r'drive temperature \(celsius\) is:\s*(\d+(?:\.\d+)?)')
 
-  def __init__(self, dev):
+  def __init__(self, dev, runner=None):
     self._dev = dev if dev[0] == '/' else '/dev/' + dev
+    self._runner = runner
 
   def GetTemperature(self):
-    hd = subprocess.Popen([HDPARM, '-H', self._dev], stdout=subprocess.PIPE)
-    out, _ = hd.communicate(None)
+    runner = self._runner or tr.executor.Instance()
+    d = runner.RunDeferred([HDPARM, '-H', self._dev])
+    return d.Then(lambda result: self._Parse(result.out))
+
+  def _Parse(self, out):
     for line in out.splitlines():
       result = self.DRIVETEMP.search(line)
       if result is not None:
@@ -286,6 +308,99 @@ class SensorHdparm(object):
     return BADCELSIUS
 
 
+class SysfsSensors(object):
+  """Every temperature sensor the kernel exports, read together.
+
+     Discover() looks through SYS_CLASS_HWMON and SYS_CLASS_THERMAL
+     once.  The SensorSysfs objects it returns can be passed as the
+     sensor argument to TemperatureSensor objects.  Whichever of them is
+     sampled first in a tick reads every sensor file, and the rest use
+     those readings.  Sensor files stay open, see tr/filecache.py.
+  """
+
+  def __init__(self):
+    self._files = []
+    self.drives = set()  # block devices with a drivetemp sensor
+    self.polls = 0
+
+  def Discover(self):
+    """Find the sensors.
+
+    Returns:
+      a list of (name, SensorSysfs) tuples.
+    """
+    sensors = []
+    thermal_hwmons = set()
+    for zone in sorted(glob.glob(os.path.join(SYS_CLASS_THERMAL,
+                                              'thermal_zone*'))):
+      zonetype = self._ReadName(os.path.join(zone, 'type'))
+      if not zonetype:
+        continue
+      # the kernel also registers zones as hwmon devices, with this name.
+      thermal_hwmons.add(zonetype.replace('-', '_'))
+      sensors.append((zonetype, self._Add(os.path.join(zone, 'temp'))))
+
+    for hwmon in sorted(glob.glob(os.path.join(SYS_CLASS_HWMON, 'hwmon*'))):
+      name = (self._ReadName(os.path.join(hwmon, 'name')) or
+              self._ReadName(os.path.join(hwmon, 'device', 'name')))
+      if not name or name in thermal_hwmons:
+        continue
+      inputs = (glob.glob(os.path.join(hwmon, 'temp*_input')) or
+                glob.glob(os.path.join(hwmon, 'device', 'temp*_input')))
+      if name == 'drivetemp':
+        blocks = glob.glob(os.path.join(hwmon, 'device', 'block', '*'))
+        if blocks and inputs:
+          dev = os.path.basename(blocks[0])
+          self.drives.add(dev)
+          sensors.append(('Hard drive temperature ' + dev,
+                          self._Add(inputs[0])))
+        continue
+      for filename in sorted(inputs):
+        label = (self._ReadName(filename.replace('_input', '_label')) or
+                 os.path.basename(filename).replace('_input', ''))
+        sensors.append(('%s %s' % (name, label), self._Add(filename)))
+    return sensors
+
+  @tr.cwmp_session.cache(scope=tr.cwmp_session.cache.TICK)
+  def Poll(self):
+    """Read every sensor file.
+
+    Returns:
+      a dict of filename to degrees Celsius, or BADCELSIUS.
+    """
+    self.polls += 1
+    temperatures = dict()
+    for filename in self._files:
+      try:
+        # millidegrees Celsius.
+        celsius = float(tr.filecache.Read(filename)) / 1000.0
+        temperatures[filename] = int(round(celsius))
+      except (IOError, ValueError):
+        temperatures[filename] = BADCELSIUS
+    return temperatures
+
+  def _Add(self, filename):
+    self._files.append(filename)
+    return SensorSysfs(self, filename)
+
+  def _ReadName(self, filename):
+    try:
+      return tr.filecache.Read(filename).strip()
+    except IOError:
+      return None
+
+
+class SensorSysfs(object):
+  """One sensor found by SysfsSensors.Discover()."""
+
+  def __init__(self, sensors, filename):
+    self._sensors = sensors
+    self.filename = filename
+
+  def GetTemperature(self):
+    return self._sensors.Poll().get(self.filename, BADCELSIUS)
+
+
 class SensorReadFromFile(object):
   """Read a temperature from an arbitrary file.
 
@@ -25,7 +25,10 @@ import os
 import unittest
 
 import google3
+import tornado.ioloop
 import tr.core
+import tr.cwmp_session
+import tr.executor
 import temperature
 
 
@@ -50,7 +53,7 @@ class MockTime(object):
 
 fake_periodics = []
 class FakePeriodicCallback(object):
-  def __init__(self, callback, callback_time, io_loop=None):
+  def __init__(self, callback, callback_time, io_loop=None, name=None):
     self.callback = callback
     self.callback_time = callback_time / 1000
     self.io_loop = io_loop
@@ -71,19 +74,82 @@ class TemperatureTest(unittest.TestCase):
   def setUp(self):
     self.old_HDPARM = temperature.HDPARM
     self.old_PERIODICCALL = temperature.PERIODICCALL
+    self.old_SYS_CLASS_HWMON = temperature.SYS_CLASS_HWMON
+    self.old_SYS_CLASS_THERMAL = temperature.SYS_CLASS_THERMAL
     self.old_TIMENOW = temperature.TIMENOW
     temperature.HDPARM = 'testdata/temperature/hdparm-H'
+    temperature.SYS_CLASS_HWMON = 'testdata/temperature/sys/class/hwmon'
+    temperature.SYS_CLASS_THERMAL = 'testdata/temperature/sys/class/thermal'
+    tr.cwmp_session.cache.new_tick()
+    self.ioloop = tornado.ioloop.IOLoop()
+    self.runner = tr.executor.Executor(ioloop=self.ioloop)
 
   def tearDown(self):
     temperature.HDPARM = self.old_HDPARM
     temperature.PERIODICCALL = self.old_PERIODICCALL
+    temperature.SYS_CLASS_HWMON = self.old_SYS_CLASS_HWMON
+    temperature.SYS_CLASS_THERMAL = self.old_SYS_CLASS_THERMAL
     temperature.TIMENOW = self.old_TIMENOW
+    self.ioloop.close(all_fds=True)
+
+  def _Wait(self, d):
+    d.AddCallback(lambda unused_d: self.ioloop.stop())
+    tmo = self.ioloop.add_timeout(datetime.timedelta(seconds=10),
+                                  self.ioloop.stop)
+    self.ioloop.start()
+    self.ioloop.remove_timeout(tmo)
+    return d.Get()
 
   def testHardDriveTemperature(self):
-    hd = temperature.SensorHdparm('sda')
-    self.assertEqual(hd.GetTemperature(), 50)
-    hd = temperature.SensorHdparm('/dev/sda')
-    self.assertEqual(hd.GetTemperature(), 50)
+    hd = temperature.SensorHdparm('sda', runner=self.runner)
+    self.assertEqual(self._Wait(hd.GetTemperature()), 50)
+    hd = temperature.SensorHdparm('/dev/sda', runner=self.runner)
+    self.assertEqual(self._Wait(hd.GetTemperature()), 50)
+    temperature.HDPARM = '/bin/false'
+    self.assertEqual(self._Wait(hd.GetTemperature()), TR181_BAD_TEMPERATURE)
+
+  def testHardDriveSampleOffLoop(self):
+    t = temperature.TemperatureSensor(
+        name='sda', sensor=temperature.SensorHdparm('sda', runner=self.runner))
+    # hdparm hasn't answered yet.
+    self.assertEqual(t.Value, TR181_BAD_TEMPERATURE)
+    self.assertEqual(t.LastUpdate, '0001-01-01T00:00:00Z')
+    for unused_i in range(200):
+      if not self.runner.Pending():
+        break
+      self.ioloop.add_timeout(datetime.timedelta(seconds=0.05),
+                              self.ioloop.stop)
+      self.ioloop.start()
+    self.assertEqual(t.Value, 50)
+    self.assertEqual(t.MinValue, 50)
+
+  def testSysfsSensors(self):
+    sysfs = temperature.SysfsSensors()
+    sensors = sysfs.Discover()
+    self.assertEqual([name for (name, unused_sensor) in sensors],
+                     ['cpu-thermal', 'gpu-thermal',
+                      'Hard drive temperature sda',
+                      'lm75 temp1', 'lm75 board'])
+    self.assertEqual(sysfs.drives, set(['sda']))
+    self.assertEqual([sensor.GetTemperature() for (unused_name, sensor)
+                      in sensors], [52, TR181_BAD_TEMPERATURE, 38, 42, 29])
+    self.assertEqual(sysfs.polls, 1)  # one read of everything per tick
+    tr.cwmp_session.cache.new_tick()
+    sensors[0][1].GetTemperature()
+    self.assertEqual(sysfs.polls, 2)
+
+    ts = temperature.TemperatureStatus()
+    for (name, sensor) in sensors:
+      ts.AddSensor(name=name, sensor=sensor)
+    ts.ValidateExports()
+    self.assertEqual(ts.TemperatureSensorList[3].Value, 38)
+
+  def testNoSysfsSensors(self):
+    temperature.SYS_CLASS_HWMON = 'no/such/dir'
+    temperature.SYS_CLASS_THERMAL = 'no/such/dir'
+    sysfs = temperature.SysfsSensors()
+    self.assertEqual(sysfs.Discover(), [])
+    self.assertEqual(sysfs.drives, set())
 
   def testTemperatureFromFile(self):
     t = temperature.SensorReadFromFile('testdata/temperature/file1')
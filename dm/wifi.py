@@ -20,10 +20,138 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import binascii
+import collections
+import hashlib
+import sys
+import threading
 import pbkdf2
+import tornado.ioloop
+import tr.core
 import tr.tr098_v1_4
 
 
+# Unit tests can override these
+PBKDF2_CACHE_SIZE = 16
+
+WPA2_ITERATIONS = 4096
+WPA2_KEYLEN = 32
+
+
+def _HashlibPbkdf2Works():
+  """Check hashlib.pbkdf2_hmac (Python 2.7.8+) against the vendored pbkdf2."""
+  if not hasattr(hashlib, 'pbkdf2_hmac'):
+    return False
+  # RFC 6070 test vector, with few enough iterations to check at startup.
+  ours = hashlib.pbkdf2_hmac('sha1', 'password', 'salt', 2, 20)
+  return binascii.hexlify(ours) == pbkdf2.pbkdf2_hex('password', 'salt', 2, 20)
+
+USE_HASHLIB = _HashlibPbkdf2Works()
+
+
+def Pbkdf2Hex(passphrase, ssid):
+  """Compute a WPA2 key from a passphrase.  This is slow, see KeyDeriver.
+
+  Args:
+    passphrase: the KeyPassphrase.
+    ssid: the SSID, which WPA2 uses as the salt.
+  Returns:
+    the 256 bit key as a hex string.
+  """
+  if USE_HASHLIB:
+    return binascii.hexlify(hashlib.pbkdf2_hmac(
+        'sha1', passphrase, ssid, WPA2_ITERATIONS, WPA2_KEYLEN))
+  return pbkdf2.pbkdf2_hex(passphrase, salt=ssid,
+                           iterations=WPA2_ITERATIONS, keylen=WPA2_KEYLEN)
+
+
+class KeyDeriver(object):
+  """Derives WPA2 keys in a worker thread, and remembers them.
+
+  4096 iterations of HMAC-SHA1 take hundreds of milliseconds on our
+  slower platforms, far too long to spend on the ioloop.  Get() runs the
+  computation in a thread and delivers the key back on the ioloop.  The
+  last PBKDF2_CACHE_SIZE keys are kept, by (passphrase, ssid).
+  """
+
+  def __init__(self, ioloop=None, derive=None):
+    self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+    self._derive = derive or Pbkdf2Hex
+    self._cache = collections.OrderedDict()
+    self._pending = dict()
+    self.hits = 0
+    self.misses = 0
+
+  def _Lookup(self, key):
+    value = self._cache.pop(key, None)
+    if value is not None:
+      self.hits += 1
+      self._cache[key] = value  # now the most recently used
+    return value
+
+  def _Store(self, key, value):
+    self._cache[key] = value
+    while len(self._cache) > PBKDF2_CACHE_SIZE:
+      self._cache.popitem(last=False)
+
+  def Get(self, passphrase, ssid):
+    """Returns a tr.core.Deferred for the key."""
+    key = (passphrase, ssid)
+    value = self._Lookup(key)
+    if value is not None:
+      d = tr.core.Deferred()
+      d.Resolve(value)
+      return d
+    if key in self._pending:
+      return self._pending[key]
+    self.misses += 1
+    d = self._pending[key] = tr.core.Deferred()
+    thread = threading.Thread(target=self._Worker, args=(key,))
+    thread.daemon = True
+    thread.start()
+    return d
+
+  def GetSync(self, passphrase, ssid):
+    """Returns the key, computing it right here if it isn't cached."""
+    key = (passphrase, ssid)
+    value = self._Lookup(key)
+    if value is None:
+      self.misses += 1
+      value = self._derive(passphrase, ssid)
+      self._Store(key, value)
+    return value
+
+  def _Worker(self, key):
+    """Runs in the worker thread."""
+    try:
+      value = self._derive(*key)
+    except Exception:  #gpylint: disable-msg=W0703
+      exc_info = sys.exc_info()
+      self.ioloop.add_callback(lambda: self._Done(key, None, exc_info))
+    else:
+      self.ioloop.add_callback(lambda: self._Done(key, value, None))
+
+  def _Done(self, key, value, exc_info):
+    """Back on the ioloop, with the result from _Worker."""
+    d = self._pending.pop(key)
+    if exc_info:
+      d.Fail(exc_info)
+    else:
+      self._Store(key, value)
+      d.Resolve(value)
+
+
+_deriver = None
+
+
+def KeyDeriverInstance():
+  """Returns the shared KeyDeriver."""
+  global _deriver
+  if _deriver is None:
+    _deriver = KeyDeriver()
+  return _deriver
+
+
 def ContiguousRanges(seq):
   """Given an integer sequence, return contiguous ranges.
 
@@ -64,13 +192,14 @@ class PreSharedKey98(tr.tr098_v1_4.InternetGatewayDevice_v1_10.InternetGatewayDe
     self.Unexport('Alias')
     self.key = None
     self.passphrase = None
-    self.key_pbkdf2 = None
-    self.salt = None
     self.AssociatedDeviceMACAddress = None
 
   def GetKey(self, salt):
     """Return the key to program into the Wifi chipset.
 
+    If the key has to be computed from the passphrase, this blocks until
+    it is; GetKeyDeferred() doesn't.
+
     Args:
       salt: Per WPA2 spec, the SSID is used as the salt.
     Returns:
@@ -78,23 +207,20 @@ class PreSharedKey98(tr.tr098_v1_4.InternetGatewayDevice_v1_10.InternetGatewayDe
     """
     if self.key is not None:
       return self.key
-    if self.key_pbkdf2 is None or salt != self.salt:
-      self.salt = salt
-      self.key_pbkdf2 = self._GeneratePBKDF2(salt)
-    if self.key_pbkdf2 is not None:
-      return self.key_pbkdf2
-    return None
-
-  def _GeneratePBKDF2(self, salt):
-    """Compute WPA2 key from a passphrase."""
     if self.passphrase is None:
       return None
-    return pbkdf2.pbkdf2_hex(self.passphrase, salt=salt,
-                             iterations=4096, keylen=32)
+    return KeyDeriverInstance().GetSync(self.passphrase, salt)
+
+  def GetKeyDeferred(self, salt):
+    """Like GetKey(), but returns a tr.core.Deferred for the key."""
+    if self.key is not None or self.passphrase is None:
+      d = tr.core.Deferred()
+      d.Resolve(self.key)
+      return d
+    return KeyDeriverInstance().Get(self.passphrase, salt)
 
   def SetPreSharedKey(self, value):
     self.key = value
-    self.key_pbkdf2 = None
 
   def GetPreSharedKey(self):
     return self.key
@@ -106,7 +232,6 @@ class PreSharedKey98(tr.tr098_v1_4.InternetGatewayDevice_v1_10.InternetGatewayDe
   def SetKeyPassphrase(self, value):
     self.passphrase = value
     self.key = None
-    self.key_pbkdf2 = None
 
   def GetKeyPassphrase(self):
     return self.passphrase
@@ -20,12 +20,17 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import datetime
 import unittest
 
 import google3
+import tornado.ioloop
 import wifi
 
 
+KEY = '0dc0d6eb90555ed6419756b9a15ec3e3209b63df707dd508d14581f8982721af'
+
+
 class WifiTest(unittest.TestCase):
   def testContiguousRanges(self):
     self.assertEqual(wifi.ContiguousRanges([1, 2, 3, 4, 5]), '1-5')
@@ -43,8 +48,80 @@ class WifiTest(unittest.TestCase):
     # http://connect.microsoft.com/VisualStudio/feedback/details/95506/
     psk.KeyPassphrase = 'ThisIsAPassword'
     key = psk.GetKey('ThisIsASSID')
-    self.assertEqual(
-        key, '0dc0d6eb90555ed6419756b9a15ec3e3209b63df707dd508d14581f8982721af')
+    self.assertEqual(key, KEY)
+
+  def testPBKDF2Implementations(self):
+    old_USE_HASHLIB = wifi.USE_HASHLIB
+    try:
+      wifi.USE_HASHLIB = False
+      self.assertEqual(wifi.Pbkdf2Hex('ThisIsAPassword', 'ThisIsASSID'), KEY)
+      if wifi._HashlibPbkdf2Works():
+        wifi.USE_HASHLIB = True
+        self.assertEqual(wifi.Pbkdf2Hex('ThisIsAPassword', 'ThisIsASSID'),
+                         KEY)
+    finally:
+      wifi.USE_HASHLIB = old_USE_HASHLIB
+
+  def _RunUntilDone(self, loop, d):
+    d.AddCallback(lambda unused_d: loop.stop())
+    tmo = loop.add_timeout(datetime.timedelta(seconds=10), loop.stop)
+    loop.start()
+    loop.remove_timeout(tmo)
+
+  def testKeyDeriver(self):
+    loop = tornado.ioloop.IOLoop.instance()
+    old_PBKDF2_CACHE_SIZE = wifi.PBKDF2_CACHE_SIZE
+    wifi.PBKDF2_CACHE_SIZE = 2
+    try:
+      deriver = wifi.KeyDeriver(ioloop=loop)
+      d1 = deriver.Get('ThisIsAPassword', 'ThisIsASSID')
+      d2 = deriver.Get('ThisIsAPassword', 'ThisIsASSID')
+      self.assertFalse(d1.done)
+      self.assertTrue(d1 is d2)
+      self._RunUntilDone(loop, d1)
+      self.assertEqual(d1.Get(), KEY)
+      self.assertEqual(deriver.Get('ThisIsAPassword', 'ThisIsASSID').Get(), KEY)
+      self.assertEqual(deriver.GetSync('ThisIsAPassword', 'ThisIsASSID'), KEY)
+      self.assertEqual((deriver.hits, deriver.misses), (2, 1))
+
+      # only the most recent PBKDF2_CACHE_SIZE keys are kept.
+      deriver.GetSync('a password', 'ssid1')
+      deriver.GetSync('a password', 'ssid2')
+      self.assertFalse(deriver.Get('ThisIsAPassword', 'ThisIsASSID').done)
+
+      broken = wifi.KeyDeriver(ioloop=loop, derive=lambda p, s: 1 / 0)
+      d = broken.Get('password', 'ssid')
+      self._RunUntilDone(loop, d)
+      self.assertRaises(ZeroDivisionError, d.Get)
+    finally:
+      wifi.PBKDF2_CACHE_SIZE = old_PBKDF2_CACHE_SIZE
+
+  def testGetKeyDeferredCached(self):
+    loop = tornado.ioloop.IOLoop.instance()
+    calls = []
+
+    def CountingPbkdf2Hex(passphrase, ssid):
+      calls.append((passphrase, ssid))
+      return wifi.Pbkdf2Hex(passphrase, ssid)
+    old_deriver = wifi._deriver
+    wifi._deriver = wifi.KeyDeriver(ioloop=loop, derive=CountingPbkdf2Hex)
+    try:
+      psk = wifi.PreSharedKey98()
+      psk.KeyPassphrase = 'ThisIsAPassword'
+      d = psk.GetKeyDeferred('ThisIsASSID')
+      self._RunUntilDone(loop, d)
+      self.assertEqual(d.Get(), KEY)
+      for unused_i in range(100):
+        d = psk.GetKeyDeferred('ThisIsASSID')
+        self.assertTrue(d.done)
+        self.assertEqual(d.Get(), KEY)
+      self.assertEqual(calls, [('ThisIsAPassword', 'ThisIsASSID')])
+      self.assertEqual(wifi._deriver.hits, 100)
+      # a different SSID is a different key.
+      self._RunUntilDone(loop, psk.GetKeyDeferred('AnotherSSID'))
+      self.assertEqual(len(calls), 2)
+    finally:
+      wifi._deriver = old_deriver
 
   def testWEPKeyValidate(self):
     wk = wifi.WEPKey98()
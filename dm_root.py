@@ -24,6 +24,7 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 import google3
 import dm.catawampus
 import dm.management_server
+import dm.netlink
 import tr.core
 
 
@@ -84,3 +85,10 @@ class DeviceModelRoot(tr.core.Exporter):
       tr157_object.SetRoot(self)
     except (AttributeError, KeyError):
       pass  # no tr-157 object found on the Device object.
+
+  def configure_link_notifications(self, cpe):
+    """Send value change notifications for netlink link state changes."""
+    watcher = dm.netlink.Instance()
+    if watcher:
+      watcher.SetCpe(cpe)
+      watcher.SetRoot(self)
@@ -34,6 +34,7 @@ import dm.brcmwifi
 import dm.device_info
 import dm.ethernet
 import dm.igd_time
+import dm.netlink
 import dm.periodic_statistics
 import dm.storage
 import dm.temperature
@@ -42,6 +43,7 @@ import pynetlinux
 import tornado.ioloop
 import tr.core
 import tr.download
+import tr.filecache
 import tr.tr098_v1_2
 import tr.tr181_v2_2 as tr181
 import tr.x_catawampus_tr181_2_0
@@ -219,13 +221,13 @@ class DeviceId(dm.device_info.DeviceIdMeta):
       return hw_rev
 
     # initial builds with no HW_REV; infer a rev.
-    cpu = open(PROC_CPUINFO, 'r').read()
+    cpu = tr.filecache.Read(PROC_CPUINFO)
     if cpu.find('BCM7425B0') > 0:
       return '0'
     if cpu.find('BCM7425B2') > 0:
       # B2 chip with 4 Gig MLC flash == rev1. 1 Gig SLC flash == rev2.
       try:
-        siz = int(open(NAND_MB, 'r').read())
+        siz = int(tr.filecache.Read(NAND_MB))
       except OSError:
         return '?'
       if siz == 4096:
@@ -345,16 +347,9 @@ class Services(tr181.Device_v2_2.Device.Services):
       except OSError:
         pass
 
-    num = 0
-    for i in range(32):
-      ubiname = 'ubi' + str(i)
-      try:
-        if os.stat('/sys/class/ubi/' + ubiname):
-          ubi = dm.storage.FlashMediumUbiLinux26(ubiname)
-          self.StorageServices.X_CATAWAMPUS_ORG_FlashMediaList[str(num)] = ubi
-          num += 1
-      except OSError:
-        pass
+    for (num, ubiname) in enumerate(dm.storage.UbiDevices()):
+      ubi = dm.storage.FlashMediumUbiLinux26(ubiname)
+      self.StorageServices.X_CATAWAMPUS_ORG_FlashMediaList[str(num)] = ubi
 
 
 class Ethernet(tr181.Device_v2_2.Device.Ethernet):
@@ -362,7 +357,10 @@ class Ethernet(tr181.Device_v2_2.Device.Ethernet):
 
   def __init__(self):
     tr181.Device_v2_2.Device.Ethernet.__init__(self)
-    self.InterfaceList = {'1': dm.ethernet.EthernetInterfaceLinux26('eth0')}
+    self.InterfaceList = {'1': dm.ethernet.EthernetInterfaceLinux26(
+        'eth0', linkwatcher=dm.netlink.Instance())}
+    for eth in self.InterfaceList.values():
+      eth.DeclareLinkInfoAll(self.InterfaceList.values())
     self.VLANTerminationList = {}
     self.LinkList = {}
 
@@ -409,7 +407,7 @@ class FanReadGpio(CATA181DI.TemperatureStatus.X_CATAWAMPUS_ORG_Fan):
   @property
   def RPM(self):
     try:
-      f = open(self._speed_filename, 'r')
+      f = tr.filecache.Open(self._speed_filename)
     except IOError as e:
       print 'Fan speed file %r: %s' % (self._speed_filename, e)
       return -1
@@ -423,7 +421,7 @@ class FanReadGpio(CATA181DI.TemperatureStatus.X_CATAWAMPUS_ORG_Fan):
   @property
   def DesiredPercentage(self):
     try:
-      f = open(self._percent_filename, 'r')
+      f = tr.filecache.Open(self._percent_filename)
     except IOError as e:
       print 'Fan percent file %r: %s' % (self._percent_filename, e)
       return -1
@@ -489,7 +487,12 @@ class Device(tr181.Device_v2_2.Device):
     ts.AddSensor(name='CPU temperature',
                  sensor=dm.temperature.SensorReadFromFile(
                      '/tmp/gpio/cpu_temperature'))
+    sysfs = dm.temperature.SysfsSensors()
+    for (name, sensor) in sysfs.Discover():
+      ts.AddSensor(name=name, sensor=sensor)
     for drive in ['sda', 'sdb', 'sdc', 'sdd', 'sde', 'sdf']:
+      if drive in sysfs.drives:
+        continue  # the drivetemp driver already reports this one.
       try:
         if os.stat('/sys/block/' + drive):
           ts.AddSensor(name='Hard drive temperature ' + drive,
@@ -24,17 +24,27 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 import base64
 import bz2
 import cStringIO
-import subprocess
 import google3
+import tr.core
+import tr.executor
+import tr.helpers
 import tr.x_gmoca_1_0
 
 
 # Unit tests can override these.
 MOCACTL = '/bin/mocactl'
+TIMENOW = tr.helpers.monotime
+DEBUG_MIN_INTERVAL = 10  # seconds between DebugOutput refreshes
 
 
 class GMoCA(tr.x_gmoca_1_0.X_GOOGLE_COM_GMOCA_v1_0):
-  """Implementation of x-gmoca.xml."""
+  """Implementation of x-gmoca.xml.
+
+  DebugOutput is collected in the background: reading it returns the
+  last complete collection and starts a new one, unless the last one is
+  less than DEBUG_MIN_INTERVAL seconds old.  Only the very first read
+  has to wait.
+  """
 
   MOCACMDS = [['show', '--status'],
               ['show', '--config'],
@@ -46,24 +56,60 @@ class GMoCA(tr.x_gmoca_1_0.X_GOOGLE_COM_GMOCA_v1_0):
               ['showtbl', '--mcfwd'],
               ['showtbl', '--srcaddr']]
 
-  def __init__(self):
+  def __init__(self, runner=None):
     super(GMoCA, self).__init__()
+    self._runner = runner
+    self.debug_output = None  # base64 of the last complete collection
+    self.debug_time = None  # when it was collected, per TIMENOW
+    self._collecting = None  # a tr.core.Deferred while collecting
 
   @property
   def DebugOutput(self):
+    now = TIMENOW()
+    if (self.debug_time is None or
+        now - self.debug_time >= DEBUG_MIN_INTERVAL):
+      collecting = self.Collect()
+      if self.debug_output is None:
+        return collecting
+    return self.debug_output
+
+  def Collect(self):
+    """Start collecting the output of MOCACMDS, unless we already are.
+
+    All of the commands are started at once through tr.executor.  Their
+    output is compressed as it arrives, in MOCACMDS order.
+
+    Returns:
+      a tr.core.Deferred for the new DebugOutput.
+    """
+    if self._collecting is not None:
+      return self._collecting
+    runner = self._runner or tr.executor.Instance()
+    collecting = self._collecting = tr.core.Deferred()
     compr = bz2.BZ2Compressor()
     cdata = cStringIO.StringIO()
-    for cmd in self.MOCACMDS:
-      cdata.write(compr.compress('X_GOOGLE-COM_GMOCA --------------------\n'))
-      cdata.write(compr.compress(' '.join(cmd) + '\n'))
-      try:
-        mc = subprocess.Popen([MOCACTL] + cmd, stdout=subprocess.PIPE)
-        out, _ = mc.communicate(None)
-        cdata.write(compr.compress(out))
-      except IOError:
-        continue
-    cdata.write(compr.flush())
-    return base64.b64encode(cdata.getvalue())
+    results = [None] * len(self.MOCACMDS)
+    state = {'next': 0}
+
+    def Done(idx, result):
+      results[idx] = result
+      while state['next'] < len(results) and results[state['next']]:
+        cmd = self.MOCACMDS[state['next']]
+        cdata.write(compr.compress('X_GOOGLE-COM_GMOCA --------------------\n'))
+        cdata.write(compr.compress(' '.join(cmd) + '\n'))
+        cdata.write(compr.compress(results[state['next']].out))
+        results[state['next']] = True  # let the output be freed
+        state['next'] += 1
+      if state['next'] == len(results):
+        cdata.write(compr.flush())
+        self.debug_output = base64.b64encode(cdata.getvalue())
+        self.debug_time = TIMENOW()
+        self._collecting = None
+        collecting.Resolve(self.debug_output)
+
+    for idx, cmd in enumerate(self.MOCACMDS):
+      runner.Run([MOCACTL] + cmd, lambda r, idx=idx: Done(idx, r))
+    return collecting
 
 
 def main():
@@ -22,16 +22,43 @@ __author__ = 'dgentry@google.com (Denton Gentry)'
 
 import base64
 import bz2
-import tempfile
+import datetime
 import unittest
 
 import google3
+import tornado.ioloop
+import tr.executor
 import gmoca
 
 
 class GMoCATest(unittest.TestCase):
   """Tests for gmoca.py."""
 
+  def setUp(self):
+    self.old_MOCACTL = gmoca.MOCACTL
+    self.old_TIMENOW = gmoca.TIMENOW
+    self.now = 1000.0
+    gmoca.TIMENOW = lambda: self.now
+    self.ioloop = tornado.ioloop.IOLoop()
+    self.runner = tr.executor.Executor(ioloop=self.ioloop, max_concurrent=16)
+
+  def tearDown(self):
+    gmoca.MOCACTL = self.old_MOCACTL
+    gmoca.TIMENOW = self.old_TIMENOW
+    self.ioloop.close(all_fds=True)
+
+  def _Wait(self, d):
+    d.AddCallback(lambda unused_d: self.ioloop.stop())
+    tmo = self.ioloop.add_timeout(datetime.timedelta(seconds=10),
+                                  self.ioloop.stop)
+    self.ioloop.start()
+    self.ioloop.remove_timeout(tmo)
+    return d.Get()
+
+  def _Decode(self, out):
+    decode = base64.b64decode(out)  # will raise TypeError if invalid
+    return bz2.decompress(decode)
+
   def testValidateExports(self):
     gmoca.MOCACTL = 'testdata/device/mocactl'
     gm = gmoca.GMoCA()
@@ -39,13 +66,41 @@ class GMoCATest(unittest.TestCase):
 
   def testDebugOutput(self):
     gmoca.MOCACTL = 'testdata/device/mocactl'
-    gm = gmoca.GMoCA()
-    out = gm.DebugOutput
+    gm = gmoca.GMoCA(runner=self.runner)
+    out = self._Wait(gm.DebugOutput)
     self.assertTrue(len(out) > 1024)
-    decode = base64.b64decode(out)  # will raise TypeError if invalid
-    decomp = bz2.decompress(decode)
+    decomp = self._Decode(out)
     self.assertTrue(len(decomp) > 1024)
     self.assertTrue(decomp.find('X_GOOGLE-COM_GMOCA') >= 0)
+    # in MOCACMDS order, whichever command finished first.
+    cmds = [' '.join(cmd) for cmd in gm.MOCACMDS]
+    positions = [decomp.find('\n%s\n' % cmd) for cmd in cmds]
+    self.assertTrue(min(positions) >= 0)
+    self.assertEqual(positions, sorted(positions))
+
+  def testDebugOutputInBackground(self):
+    gmoca.MOCACTL = 'testdata/device/mocactl'
+    gm = gmoca.GMoCA(runner=self.runner)
+    first = self._Wait(gm.Collect())
+    self.assertEqual(gm.debug_time, 1000.0)
+
+    # still fresh: no new collection.
+    self.now += gmoca.DEBUG_MIN_INTERVAL - 1
+    self.assertEqual(gm.DebugOutput, first)
+    self.assertEqual(self.runner.Pending(), 0)
+
+    # stale: the old output right away, with all commands started at once.
+    gmoca.MOCACTL = '/bin/true'
+    self.now += 1
+    self.assertEqual(gm.DebugOutput, first)
+    self.assertEqual(self.runner.running, len(gm.MOCACMDS))
+    self.assertEqual(gm.debug_time, 1000.0)
+    self.assertEqual(gm.DebugOutput, first)
+    self.assertEqual(self.runner.started, 2 * len(gm.MOCACMDS))
+    self._Wait(gm.Collect())
+    self.assertEqual(gm.debug_time, self.now)
+    self.assertNotEqual(gm.DebugOutput, first)
+    self.assertEqual(self._Decode(gm.DebugOutput).find('Node'), -1)
 
 
 if __name__ == '__main__':
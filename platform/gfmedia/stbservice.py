@@ -29,6 +29,7 @@ import struct
 
 import tr.cwmp_session as cwmp_session
 import tr.cwmpdate
+import tr.filecache
 import tr.tr135_v1_2
 import tr.x_catawampus_videomonitoring_1_0 as vmonitor
 
@@ -175,14 +176,14 @@ class IGMP(BASE135STB.Components.FrontEnd.IP.IGMP):
     big endian.
     """
     igmps = set()
-    with open(PROCNETIGMP, 'r') as f:
+    with tr.filecache.Open(PROCNETIGMP) as f:
       for line in f:
         result = IGMPREGEX.match(line)
         if result is not None:
           igmp = result.group(1).strip()
           igmps.add(socket.inet_ntop(
               socket.AF_INET, struct.pack('<L', int(igmp, 16))))
-    with open(PROCNETIGMP6, 'r') as f:
+    with tr.filecache.Open(PROCNETIGMP6) as f:
       for line in f:
         result = IGMP6REGEX.match(line)
         if result is not None:
@@ -412,6 +413,8 @@ class ServiceMonitoring(BASE135STB.ServiceMonitoring):
     self.Unexport('EventsPerSampleInterval')
     self.Unexport(objects='GlobalOperation')
     self._MainStreamStats = dict()
+    self._stats_files = []
+    self.parses = 0
     self.MainStreamList = tr.core.AutoDict(
         'MainStreamList', iteritems=self.IterMainStreams,
         getitem=self.GetMainStreamByIndex)
@@ -422,10 +425,47 @@ class ServiceMonitoring(BASE135STB.ServiceMonitoring):
 
   def UpdateSvcMonitorStats(self):
     """Retrieve and aggregate stats from all related JSON stats files."""
-    streams = dict()
-    for wildcard in CONT_MONITOR_FILES:
+    self._UpdateOncePerTick(tuple(CONT_MONITOR_FILES))
+
+  @cwmp_session.cache(scope=cwmp_session.cache.TICK)
+  def _UpdateOncePerTick(self, wildcards):
+    """Reparse the stats files which changed since the last update.
+
+    Every parameter of every MainStream ends up here, so a GPV of the
+    whole list would otherwise read all of the files once per parameter.
+    A file is parsed again only when its inode, size or mtime changes,
+    and the MainStream objects are rebuilt only when some file did.
+
+    Args:
+      wildcards: a tuple of the globs in CONT_MONITOR_FILES.
+    """
+    old_files = dict((f[0], f) for f in self._stats_files)
+    stats_files = []
+    for wildcard in wildcards:
       for filename in glob.glob(wildcard):
-        self.DeserializeStats(filename, streams)
+        try:
+          st = os.stat(filename)
+          signature = (st.st_ino, st.st_size, st.st_mtime)
+        except OSError:
+          continue
+        old = old_files.get(filename)
+        if old and old[1] == signature:
+          stats_files.append(old)
+        else:
+          stats_files.append((filename, signature,
+                              self.DeserializeStats(filename)))
+
+    if stats_files == self._stats_files:
+      return
+    self._stats_files = stats_files
+
+    streams = dict()
+    for (unused_filename, unused_signature, data) in stats_files:
+      for stream in data:
+        stream_id = stream['StreamId']
+        strm = streams.get(stream_id, None) or MainStream(stream_id)
+        strm.UpdateMainstreamStats(stream)
+        streams[stream_id] = strm
 
     num_streams = len(streams)
     new_main_stream_stats = dict()
@@ -454,22 +494,23 @@ class ServiceMonitoring(BASE135STB.ServiceMonitoring):
       d = json.load(f)
     return d
 
-  def DeserializeStats(self, fname, new_streams):
-    """Generate stats object from the JSON stats."""
+  def DeserializeStats(self, fname):
+    """Returns the list of MainStream dicts in a JSON stats file."""
+    self.parses += 1
     try:
       d = self.ReadJSONStats(fname)
       streams = d['STBService'][0]['MainStream']
-      for i in range(len(streams)):
-        stream_id = streams[i]['StreamId']
-        strm = new_streams.get(stream_id, MainStream(stream_id))
-        strm.UpdateMainstreamStats(streams[i])
-        new_streams[stream_id] = strm
+      if not all('StreamId' in stream for stream in streams):
+        raise KeyError('StreamId')
+      return streams
     # IOError - Failed to open file or failed to read from file
     # ValueError - JSON file is malformed and cannot be decoded
     # KeyError - Decoded JSON file doesn't contain the required fields.
-    except (IOError, ValueError, KeyError) as e:
+    # TypeError - Decoded JSON file has the wrong structure.
+    except (IOError, ValueError, KeyError, TypeError) as e:
       print('ServiceMonitoring: Failed to read stats from file {0}, '
             'error = {1}'.format(fname, e))
+      return []
 
   def IterMainStreams(self):
     """Retrieves an iterable list of stats."""
@@ -20,10 +20,18 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
 
 import google3
 import stbservice
+import tr.core
+import tr.cwmp_session
+import tr.filecache
 
 
 class STBServiceTest(unittest.TestCase):
@@ -77,6 +85,14 @@ class STBServiceTest(unittest.TestCase):
       actual.add(igmp.ClientGroupList[i].GroupAddress)
     self.assertEqual(expected, actual)
 
+  def testClientGroupsReadOncePerTick(self):
+    stb = stbservice.STBService()
+    tr.cwmp_session.cache.new_tick()
+    reads = tr.filecache.Instance().reads
+    tr.core.Dump(stb)
+    # /proc/net/igmp and /proc/net/igmp6, once each.
+    self.assertEqual(tr.filecache.Instance().reads, reads + 2)
+
   def testNonexistentStatsFile(self):
     """Test whether the absence of stats file is handled gracefully."""
     stbservice.CONT_MONITOR_FILES = self.STATS_FILES_NOEXST
@@ -222,6 +238,63 @@ class STBServiceTest(unittest.TestCase):
     self.assertEqual(m.MainStreamList[2].X_GOOGLE_COM_StreamID, 2)
     stb.ValidateExports()
 
+  def WriteStreams(self, filename, first, count, packets):
+    streams = []
+    for stream_id in range(first, first + count):
+      streams.append({'StreamId': stream_id,
+                      'MPEG2TSStats': {'TSPacketsReceived': packets}})
+    f = open(filename, 'w')
+    json.dump({'STBService': [{'MainStream': streams}]}, f)
+    f.close()
+
+  def testMainStreamsParsedOncePerChange(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      for i in range(32):
+        self.WriteStreams(os.path.join(tmpdir, 'tr_135_total_tsstats%d.json'
+                                       % i), i * 2, 2, 100)
+      stbservice.CONT_MONITOR_FILES = [
+          os.path.join(tmpdir, 'tr_135_total_tsstats*.json')]
+      tr.cwmp_session.cache.new_tick()
+      stb = stbservice.STBService()
+      m = stb.ServiceMonitoring
+      names = []
+      for name in m.ListExports(recursive=True):
+        if not name.endswith('.'):
+          names.append(name)
+      self.assertTrue(len(names) > 500)
+      start = time.time()
+      for i in range(1000):
+        m.GetExport(names[i % len(names)])
+      elapsed = time.time() - start
+      self.assertEqual(m.parses, 32)
+      self.assertTrue(elapsed < 5.0)
+      self.assertEqual(m.MainStreamNumberOfEntries, 64)
+      by_id = dict((v.X_GOOGLE_COM_StreamID, (k, v))
+                   for (k, v) in m.MainStreamList.iteritems())
+
+      # nothing changed, so nothing is read or rebuilt.
+      tr.cwmp_session.cache.new_tick()
+      self.assertEqual(m.MainStreamNumberOfEntries, 64)
+      self.assertEqual(m.parses, 32)
+      (instance, strm) = by_id[7]
+      self.assertTrue(m.MainStreamList[instance] is strm)
+
+      # one file grows, and only it is read again.
+      self.WriteStreams(os.path.join(tmpdir, 'tr_135_total_tsstats3.json'),
+                        6, 3, 12345)
+      os.remove(os.path.join(tmpdir, 'tr_135_total_tsstats31.json'))
+      tr.cwmp_session.cache.new_tick()
+      self.assertEqual(m.MainStreamNumberOfEntries, 62)
+      self.assertEqual(m.parses, 33)
+      (instance, strm) = by_id[7]
+      strm = m.MainStreamList[instance]
+      self.assertEqual(strm.X_GOOGLE_COM_StreamID, 7)
+      self.assertEqual(strm.Total.MPEG2TSStats.TSPacketsReceived, 12345)
+      self.assertEqual(m.MainStreamList[by_id[0][0]].X_GOOGLE_COM_StreamID, 0)
+    finally:
+      shutil.rmtree(tmpdir)
+
   def testNonexistentHDMIStatsFile(self):
     """Test whether the absence of HDMI stats file is handled gracefully."""
     stbservice.HDMI_STATS_FILE = self.STATS_FILES_NOEXST[0]
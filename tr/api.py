@@ -26,6 +26,9 @@ API calls; it's just a python version of the API.
 
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
+import sys
+import traceback
+import core
 import download
 
 
@@ -137,6 +140,7 @@ class CPE(TR069Service):
     self.download_manager = download.DownloadManager()
     self.transfer_complete_received_cb = None
     self.inform_response_received_cb = None
+    self.prefetches = 0
 
   def setCallbacks(self, send_transfer_complete,
                    transfer_complete_received,
@@ -188,18 +192,32 @@ class CPE(TR069Service):
     none of them are. We set obj.dirty and call obj.StartTransaction on
     every object written to. Now we walk back through the dirtied objects
     to finish the transaction.
+
+    CommitTransaction can return a core.Deferred if applying the changes
+    continues from the ioloop.  We don't hold up the response for that,
+    but return 1: the changes are committed, but not all applied yet.
     """
     # TODO(dgentry) At some point there will be interdependencies between
     #   objects. We'll need to develop a means to express those dependencies
     #   and walk the dirty objects in a specific order.
+    status = 0  # all values changed successfully
     for obj in objects:
       assert obj.dirty
       obj.dirty = False
       if do_commit:
-        obj.CommitTransaction()
+        result = obj.CommitTransaction()
+        if isinstance(result, core.Deferred) and not result.done:
+          result.AddCallback(self._CommitDone)
+          status = 1
       else:
         obj.AbandonTransaction()
-    return 0  # all values changed successfully
+    return status
+
+  def _CommitDone(self, result):
+    """A CommitTransaction which had to wait is finished."""
+    if result.exc_info:
+      print 'CommitTransaction failed'
+      traceback.print_exception(*result.exc_info, file=sys.stdout)
 
   def SetParameterValues(self, parameter_list, parameter_key):
     """Sets parameters on some objects."""
@@ -235,15 +253,74 @@ class CPE(TR069Service):
     else:
       return self.root.GetExport(name)
 
+  def _Prefetch(self, names):
+    """Take the snapshots declared for names, each one just once.
+
+    See core.Exporter.DeclarePrefetch.  A snapshot which fails is only
+    logged; the getters which needed it will report the problem.
+
+    Args:
+      names: a list of parameter names.
+    Returns:
+      a core.Deferred which is done when all snapshots have been taken,
+      or None if there is nothing to wait for.
+    """
+    snapshots = []
+    for name in names:
+      try:
+        prefetch = self.root.GetPrefetch(name)
+      except Exception:  #gpylint: disable-msg=W0703
+        continue  # the getter will raise a proper fault
+      for snap in prefetch:
+        if snap not in snapshots:
+          snapshots.append(snap)
+    pending = []
+    for (snapshot, args) in snapshots:
+      try:
+        d = snapshot(*args)
+      except Exception:  #gpylint: disable-msg=W0703
+        print 'Prefetch %r failed' % snapshot
+        traceback.print_exc(file=sys.stdout)
+        continue
+      if isinstance(d, core.Deferred) and not d.done:
+        pending.append(d)
+    self.prefetches += len(snapshots)
+    if not pending:
+      return None
+    ready = core.Deferred()
+    remaining = [len(pending)]
+
+    def Done(unused_d):
+      remaining[0] -= 1
+      if not remaining[0]:
+        ready.Resolve(None)
+    for d in pending:
+      d.AddCallback(Done)
+    return ready
+
+  def _GetParameterValues(self, names):
+    result = [(name, self._GetParameterValue(name)) for name in names]
+    if not [v for (unused_p, v) in result if isinstance(v, core.Deferred)]:
+      return result
+    values = core.Gather([v for (unused_p, v) in result])
+    return values.Then(lambda vals: zip(names, vals))
+
   def GetParameterValues(self, parameter_names):
     """Gets parameters from some objects.
 
+    First every backend snapshot the parameters were declared to need
+    (see core.Exporter.DeclarePrefetch) is taken, once per request.
+    Getters may return a core.Deferred when their value isn't ready yet.
+    All getters are started before waiting for any of them, so the slow
+    ones run concurrently.
+
     Args:
       parameter_names: a list of parameter name strings.
     Returns:
-      A list of (name, value) tuples.
+      A list of (name, value) tuples, or a core.Deferred for that list if
+      any of the values are still pending.
     """
-    result = []
+    names = []
     for param in parameter_names:
       if not param:
         # tr69 A.3.2.2: empty string indicates top of the name hierarchy.
@@ -254,8 +331,11 @@ class CPE(TR069Service):
         for p in paramlist:
           parameter_names.append(param + p)
       else:
-        result.append((param, self._GetParameterValue(param)))
-    return result
+        names.append(param)
+    ready = self._Prefetch(names)
+    if ready is None:
+      return self._GetParameterValues(names)
+    return ready.Then(lambda unused: self._GetParameterValues(names))
 
   def GetParameterNames(self, parameter_path, next_level_only):
     """Get the names of parameters or objects (possibly recursively)."""
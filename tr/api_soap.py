@@ -177,15 +177,32 @@ class SoapHandler(object):
     return faults
 
   def Handle(self, body):
+    """Handle one incoming SOAP request.
+
+    Args:
+      body: the text of the request.
+    Returns:
+      The response envelope, None if there is nothing to respond, or a
+      core.Deferred for one of those if the response is not ready yet.
+    """
     body = str(body)
     obj = soap.Parse(body)
     request_id = obj.Header.get('ID', None)
     req = obj.Body[0]
     method = req.name
+    return self._Respond(request_id, method,
+                         lambda xml: self._GetResponder(method)(xml, req))
+
+  def _Respond(self, request_id, method, encoder):
+    """Build a response envelope by calling encoder(xml).
+
+    If encoder returns a core.Deferred, it must eventually produce another
+    encoder function, which is used to build the real response once the
+    data it needs is available.
+    """
     with soap.Envelope(request_id, None) as xml:
       try:
-        responder = self._GetResponder(method)
-        result = responder(xml, req)
+        result = encoder(xml)
       except api.SetParameterErrors as e:
         faults = self._ExceptionListToFaultList(e.error_list)
         result = soap.SetParameterValuesFault(xml, faults)
@@ -206,7 +223,17 @@ class SoapHandler(object):
             xml, cpefault=soap.CpeFault.INTERNAL_ERROR,
             faultstring=traceback.format_exc())
 
-    if result is not None:
+    if isinstance(result, core.Deferred):
+      response = core.Deferred()
+
+      def Finish(d):
+        # d.Get() raises if fetching the data failed, which _Respond turns
+        # into a fault just like for a synchronous responder.
+        response.Resolve(self._Respond(request_id, method,
+                                       lambda xml: d.Get()(xml)))
+      result.AddCallback(Finish)
+      return response
+    elif result is not None:
       return xml
     else:
       return None
@@ -264,6 +291,12 @@ class CPE(SoapHandler):
   def GetParameterValues(self, xml, req):
     names = [str(i) for i in req.ParameterNames]
     values = self.impl.GetParameterValues(names)
+    if isinstance(values, core.Deferred):
+      return values.Then(
+          lambda vals: lambda xml: self._EncodeParameterValues(xml, vals))
+    return self._EncodeParameterValues(xml, values)
+
+  def _EncodeParameterValues(self, xml, values):
     soaptype = 'cwmp:ParameterValueStruct[{0}]'.format(len(values))
     parameter_list_attrs = {'soap-enc:arrayType': soaptype}
     with xml['cwmp:GetParameterValuesResponse']:
@@ -25,7 +25,9 @@ import unittest
 import xml.etree.ElementTree as ET
 
 import google3
+import api
 import api_soap
+import core
 
 
 expectedTransferComplete = """<?xml version="1.0" encoding="utf-8"?>
@@ -89,6 +91,45 @@ class ApiSoapTest(unittest.TestCase):
     dt2 = datetime.datetime(1999, 12, 31, 23, 59, 58)
     self.assertEqual(api_soap.Soapify(dt2), ('xsd:dateTime', '1999-12-31T23:59:58Z'))
 
+  def testDeferredGetParameterValues(self):
+    root = DeferredRoot()
+    cpe = api_soap.CPE(api.CPE(root))
+    encode = api_soap.Encode()
+    result = cpe.Handle(encode.GetParameterValues(['Fast', 'Slow']))
+    self.assertTrue(isinstance(result, core.Deferred))
+    self.assertFalse(result.done)
+    root.slow.Resolve(1234)
+    xml = ET.fromstring(str(result.Get()))
+    values = xml.findall(SOAPNS + 'Body/' + CWMPNS +
+                         'GetParameterValuesResponse/ParameterList/'
+                         'ParameterValueStruct')
+    self.assertEqual([(v.find('Name').text, v.find('Value').text)
+                      for v in values], [('Fast', 'fast'), ('Slow', '1234')])
+
+    # a failed value turns into a fault, like a synchronous getter
+    result = cpe.Handle(encode.GetParameterValues(['Slow']))
+    try:
+      raise KeyError('Slow')
+    except KeyError:
+      root.slow.Fail()
+    xml = ET.fromstring(str(result.Get()))
+    fault = xml.find(SOAPNS + 'Body/' + SOAPNS + 'Fault')
+    self.assertTrue(fault is not None)
+    self.assertTrue('No such parameter' in ET.tostring(fault))
+
+
+class DeferredRoot(core.Exporter):
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(params=['Fast', 'Slow'])
+    self.Fast = 'fast'
+    self.slow = None
+
+  @property
+  def Slow(self):
+    self.slow = core.Deferred()
+    return self.slow
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -49,6 +49,75 @@ class TestSimpleRoot(core.Exporter):
     self.SomeParam = 'SomeParamValue'
 
 
+class TestDeferredRoot(core.Exporter):
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(params=['Now', 'Later', 'Broken'])
+    self.Now = 'now'
+    self.pending = []
+
+  @property
+  def Later(self):
+    d = core.Deferred()
+    self.pending.append(d)
+    return d
+
+  @property
+  def Broken(self):
+    d = core.Deferred()
+    try:
+      raise KeyError('Broken')
+    except KeyError:
+      d.Fail()
+    return d
+
+
+class TestPrefetchRoot(core.Exporter):
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(params=['A', 'B', 'C', 'D'])
+    self.snapshots = []
+    self.pending = []
+    self.data = {}
+    self.DeclarePrefetch(['A', 'B'], self.Snapshot, 'ab')
+    self.DeclarePrefetch(['B', 'C'], self.Snapshot, 'bc')
+    self.DeclarePrefetch(['D'], self.BrokenSnapshot)
+
+  def Snapshot(self, which):
+    self.snapshots.append(which)
+    d = core.Deferred()
+    self.pending.append((which, d))
+    return d
+
+  def BrokenSnapshot(self):
+    raise IOError('no backend')
+
+  def Fill(self):
+    for (which, d) in self.pending:
+      self.data[which] = which.upper()
+      d.Resolve(None)
+
+  A = property(lambda self: self.data.get('ab'))
+  B = property(lambda self: self.data.get('ab', '') + self.data.get('bc', ''))
+  C = property(lambda self: self.data.get('bc'))
+  D = property(lambda self: 'd')
+
+
+class TestSlowCommit(core.Exporter):
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(params=['Value'])
+    self.Value = None
+    self.applied = None
+    self.commit = None
+
+  def CommitTransaction(self):
+    self.commit = core.Deferred()
+    self.commit.AddCallback(lambda unused_d: setattr(self, 'applied',
+                                                     self.Value))
+    return self.commit
+
+
 class ApiTest(unittest.TestCase):
   def testObject(self):
     root = core.Exporter()
@@ -67,12 +136,64 @@ class ApiTest(unittest.TestCase):
     result = cpe.GetParameterValues(['%s.word' % name])
     self.assertEqual(result, [('%s.word' % name, 'word1')])
 
+  def testSetParameterValuesPendingCommit(self):
+    root = TestSlowCommit()
+    cpe = api.CPE(root)
+    # committed, but not applied yet.
+    self.assertEqual(cpe.SetParameterValues([('Value', 'one')], 0), 1)
+    self.assertEqual(root.applied, None)
+    root.commit.Resolve(None)
+    self.assertEqual(root.applied, 'one')
+
+    # a commit which fails later is only logged.
+    self.assertEqual(cpe.SetParameterValues([('Value', 'two')], 0), 1)
+    try:
+      raise IOError('wl failed')
+    except IOError:
+      root.commit.Fail()
+
   def testGetParameterValuesEmpty(self):
     cpe = api.CPE(TestSimpleRoot())
     result = cpe.GetParameterValues([''])
     self.assertTrue(result)
     self.assertEqual(result[0], ('SomeParam', 'SomeParamValue'))
 
+  def testGetParameterValuesDeferred(self):
+    root = TestDeferredRoot()
+    cpe = api.CPE(root)
+    result = cpe.GetParameterValues(['Now', 'Later', 'Later'])
+    self.assertTrue(isinstance(result, core.Deferred))
+    # both getters were started before waiting for either of them
+    self.assertEqual(len(root.pending), 2)
+    root.pending[1].Resolve(2)
+    self.assertFalse(result.done)
+    root.pending[0].Resolve(1)
+    self.assertEqual(result.Get(),
+                     [('Now', 'now'), ('Later', 1), ('Later', 2)])
+
+    result = cpe.GetParameterValues(['Now', 'Broken'])
+    self.assertRaises(KeyError, result.Get)
+
+  def testGetParameterValuesPrefetch(self):
+    root = TestPrefetchRoot()
+    cpe = api.CPE(root)
+    result = cpe.GetParameterValues(['A', 'B', 'A', 'C', 'D'])
+    # each snapshot was taken once, before any getter ran.
+    self.assertEqual(sorted(root.snapshots), ['ab', 'bc'])
+    self.assertFalse(result.done)
+    root.Fill()
+    self.assertEqual(result.Get(), [('A', 'AB'), ('B', 'ABBC'), ('A', 'AB'),
+                                    ('C', 'BC'), ('D', 'd')])
+    self.assertEqual(cpe.prefetches, 3)
+
+    # a broken snapshot or a bad name doesn't stop the prefetch.
+    root.snapshots = []
+    root.pending = []
+    result = cpe.GetParameterValues(['D', 'NoSuchParam', 'A'])
+    self.assertEqual(root.snapshots, ['ab'])
+    root.Fill()
+    self.assertRaises(KeyError, result.Get)
+
 
 if __name__ == '__main__':
   unittest.main()
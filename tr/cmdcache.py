@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A cache for the output of helper commands like wl and mocactl.
+
+Output is served from the cache for ttl seconds after it was fetched.  For
+a further STALE seconds we keep serving the old output, but also start a
+refresh in the background through tr.executor so the next caller gets
+something newer.  After that, the command is run again while the caller
+waits, with a timeout.  If a helper times out like that, nobody waits
+for it again for RESET seconds: Get() of any command of that helper runs
+it in the background instead, and returns what GetDeferred() would have
+to wait for, the last output or CommandUnavailableError.  The same goes
+for a command which is already being run in the background.
+
+Each command also has a circuit breaker.  If it times out, crashes or
+can't be run FAILURES times in a row, we stop trying for RESET seconds: callers
+get the last output that worked, or CommandUnavailableError if there
+never was one.  Once RESET has passed the command is tried again in the
+background, once no matter how many callers ask, and a success closes the
+breaker.  Until then callers are answered as while it was open.  A nonzero exit code is not a failure; many
+helpers use it to report state, and callers have always parsed whatever
+the command printed.
+
+Invalidate() drops the cached output of commands whose subject has just
+been changed.  A background run which was already going when Invalidate()
+was called may have read the old state, so its output is thrown away and
+the command is run again for anybody waiting on it.
+
+At most MAXSIZE commands are remembered, the least recently used are
+forgotten first; commands like 'wl sta_info <MAC>' come and go.
+"""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import collections
+
+import google3
+import core
+import executor
+import helpers
+
+
+# Unit tests can override these
+TIMENOW = helpers.monotime
+TTL = 2.0
+STALE = 30.0
+FAILURES = 3
+RESET = 60.0
+TIMEOUT = 10.0
+MAXSIZE = 256
+
+
+class CommandUnavailableError(IOError):
+  """A helper command keeps failing and we have no old output to return."""
+  pass
+
+
+class _Entry(object):
+  """Everything we know about one command."""
+
+  def __init__(self):
+    self.out = None
+    self.fresh_until = 0
+    self.stale_until = 0
+    self.failures = 0
+    self.open_until = None
+    self.generation = 0
+    self.running = None  # the generation of the run in progress
+    self.waiters = []
+
+
+class CommandCache(object):
+  """Caches helper command output, see the module docstring."""
+
+  def __init__(self, runner=None, timeout=None):
+    """Initialize a CommandCache.
+
+    Args:
+      runner: the tr.executor.Executor to use for background refreshes.
+      timeout: seconds to let a command run before giving up on it.
+    """
+    self._runner = runner
+    self.timeout = timeout or TIMEOUT
+    self._entries = collections.OrderedDict()
+    self._hung = {}
+    self.hits = 0
+    self.stale_hits = 0
+    self.misses = 0
+    self.failures = 0
+    self.trips = 0
+    self.short_circuits = 0
+    self.evictions = 0
+
+  def _Executor(self):
+    if self._runner is None:
+      self._runner = executor.Instance()
+    return self._runner
+
+  def Get(self, argv, ttl=None):
+    """Return the output of argv, from the cache if possible.
+
+    Args:
+      argv: the command and its arguments, as for subprocess.Popen.
+      ttl: seconds the output stays fresh, or None for TTL.
+    Returns:
+      the output of the command.
+    Raises:
+      CommandUnavailableError: if the circuit breaker is open and there is
+        no previous output to return.
+    """
+    entry = self._Lookup(argv)
+    now = TIMENOW()
+    if entry.out is not None and now < entry.fresh_until:
+      self.hits += 1
+      return entry.out
+    if self._IsOpen(entry, now):
+      return self._ShortCircuit(argv, entry)
+    if entry.out is not None and now < entry.stale_until:
+      self.stale_hits += 1
+      self._Refresh(argv, entry, ttl)
+      return entry.out
+    self.misses += 1
+    if (entry.running is not None or entry.open_until is not None or
+        now < self._hung.get(argv[0], 0)):
+      # don't wait for a run in progress, a half-open breaker's retry,
+      # or a helper which just hung on us.
+      self._Refresh(argv, entry, ttl)
+      return self._ShortCircuit(argv, entry)
+    result = executor.RunSync(argv, timeout=self.timeout)
+    if result.timedout:
+      self._hung[argv[0]] = TIMENOW() + RESET
+    return self._Result(argv, entry, result, ttl)
+
+  def GetDeferred(self, argv, ttl=None):
+    """Like Get(), but returns a core.Deferred instead of blocking."""
+    entry = self._Lookup(argv)
+    now = TIMENOW()
+    d = core.Deferred()
+    if entry.out is not None and now < entry.fresh_until:
+      self.hits += 1
+      d.Resolve(entry.out)
+    elif self._IsOpen(entry, now):
+      try:
+        d.Resolve(self._ShortCircuit(argv, entry))
+      except CommandUnavailableError:
+        d.Fail()
+    elif entry.out is not None and now < entry.stale_until:
+      self.stale_hits += 1
+      self._Refresh(argv, entry, ttl)
+      d.Resolve(entry.out)
+    else:
+      self.misses += 1
+
+      def Done(result, worked):
+        try:
+          out = self._Fallback(argv, entry, result, worked)
+        except CommandUnavailableError:
+          d.Fail()
+        else:
+          d.Resolve(out)
+      self._Run(argv, entry, ttl, Done)
+    return d
+
+  def Invalidate(self, prefix=()):
+    """Forget cached output for all commands starting with prefix.
+
+    Call this after changing whatever the commands report on.  The old
+    output is still kept to fall back on if the circuit breaker opens.
+    Runs already in progress are repeated before anyone sees their output.
+
+    Args:
+      prefix: a list of leading argv elements, or () for everything.
+    """
+    prefix = tuple(prefix)
+    for key, entry in self._entries.iteritems():
+      if key[:len(prefix)] == prefix:
+        entry.fresh_until = entry.stale_until = 0
+        entry.generation += 1
+
+  def Flush(self):
+    """Forget everything, including circuit breaker state."""
+    self._entries.clear()
+    self._hung.clear()
+
+  def Stats(self):
+    """Return a dict of counters, for monitoring."""
+    now = TIMENOW()
+    return {'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'failures': self.failures,
+            'trips': self.trips,
+            'short_circuits': self.short_circuits,
+            'size': len(self._entries),
+            'evictions': self.evictions,
+            'open': len([e for e in self._entries.itervalues()
+                         if self._IsOpen(e, now)])}
+
+  def _Lookup(self, argv):
+    """Return the _Entry for argv, as the most recently used one."""
+    key = tuple(argv)
+    entry = self._entries.pop(key, None)
+    if entry is None:
+      entry = _Entry()
+    self._entries[key] = entry
+    if len(self._entries) > MAXSIZE:
+      for (oldkey, old) in self._entries.items():
+        if len(self._entries) <= MAXSIZE:
+          break
+        if old.running is None:  # a run in progress still needs it
+          del self._entries[oldkey]
+          self.evictions += 1
+    return entry
+
+  def _IsOpen(self, entry, now):
+    return entry.open_until is not None and now < entry.open_until
+
+  def _ShortCircuit(self, argv, entry):
+    self.short_circuits += 1
+    if entry.out is None:
+      raise CommandUnavailableError('%r is failing, no output available'
+                                    % (argv,))
+    return entry.out
+
+  def _Result(self, argv, entry, result, ttl):
+    """Decide what to return after running argv while the caller waited."""
+    return self._Fallback(argv, entry, result,
+                          self._Update(argv, entry, result, ttl))
+
+  def _Fallback(self, argv, entry, result, worked):
+    """The output to return for result, which _Update() has recorded."""
+    if worked:
+      return entry.out
+    if entry.out is not None:
+      return entry.out  # the last output that worked
+    if self._IsOpen(entry, TIMENOW()):
+      return self._ShortCircuit(argv, entry)
+    return result.out  # whatever we got before it died
+
+  def _Refresh(self, argv, entry, ttl):
+    """Start a background run of argv to update entry."""
+    if entry.running is None:
+      self._Run(argv, entry, ttl, lambda result, worked: None)
+
+  def _Run(self, argv, entry, ttl, callback):
+    """Run argv in the background, then callback(result, worked).
+
+    There is at most one run per entry at a time; later callers wait for
+    the one in progress.  worked is the return value of _Update().
+
+    Args:
+      argv: the command and its arguments.
+      entry: the _Entry for argv.
+      ttl: seconds the output stays fresh, or None for TTL.
+      callback: called with the executor.Result, once the output is known
+        to be newer than the last Invalidate().
+    """
+    entry.waiters.append(callback)
+    if entry.running is not None:
+      return
+    generation = entry.running = entry.generation
+
+    def Done(result):
+      entry.running = None
+      if generation != entry.generation:
+        # Invalidated while running, the output may predate the change.
+        self._Run(argv, entry, ttl, lambda result, worked: None)
+        return
+      worked = self._Update(argv, entry, result, ttl)
+      waiters = entry.waiters
+      entry.waiters = []
+      for waiter in waiters:
+        waiter(result, worked)
+    self._Executor().Run(argv, Done, timeout=self.timeout)
+
+  def _Update(self, argv, entry, result, ttl):
+    """Record the result of running a command.  Returns True if it worked."""
+    now = TIMENOW()
+    if (result.timedout or result.returncode < 0 or
+        result.returncode == executor.EXEC_FAILED):
+      self.failures += 1
+      entry.failures += 1
+      if entry.failures >= FAILURES:
+        self.trips += 1
+        entry.open_until = now + RESET
+      return False
+    ttl = TTL if ttl is None else ttl
+    entry.out = result.out
+    entry.fresh_until = now + ttl
+    entry.stale_until = now + ttl + STALE
+    entry.failures = 0
+    entry.open_until = None
+    self._hung.pop(argv[0], None)
+    return True
+
+
+_cache = None
+
+
+def Instance():
+  """Returns the shared CommandCache."""
+  global _cache
+  if _cache is None:
+    _cache = CommandCache()
+  return _cache
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+#pylint: disable-msg=C6409
+
+"""Unit tests for cmdcache.py."""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import google3
+import cmdcache
+import executor
+
+
+class FakeExecutor(object):
+  """Remembers background runs instead of starting them."""
+
+  def __init__(self):
+    self.runs = []
+
+  def Run(self, argv, callback, timeout=None):
+    self.runs.append((argv, callback))
+
+  def Complete(self):
+    runs = self.runs
+    self.runs = []
+    for argv, callback in runs:
+      callback(executor.RunSync(argv))
+
+  def TimeOut(self):
+    runs = self.runs
+    self.runs = []
+    for unused_argv, callback in runs:
+      callback(executor.Result(-9, '', True))
+
+
+class CmdCacheTest(unittest.TestCase):
+  """Tests for cmdcache.py."""
+
+  def setUp(self):
+    self.old_TIMENOW = cmdcache.TIMENOW
+    self.now = 1000.0
+    cmdcache.TIMENOW = lambda: self.now
+    self.tmpdir = tempfile.mkdtemp()
+    self.counter = os.path.join(self.tmpdir, 'counter')
+    self.script = os.path.join(self.tmpdir, 'helper')
+    self.SetScript('echo run >>%s; echo output $(wc -l <%s)'
+                   % (self.counter, self.counter))
+    self.runner = FakeExecutor()
+    self.cache = cmdcache.CommandCache(runner=self.runner, timeout=0.5)
+
+  def tearDown(self):
+    cmdcache.TIMENOW = self.old_TIMENOW
+    shutil.rmtree(self.tmpdir)
+
+  def SetScript(self, text):
+    f = open(self.script, 'w')
+    f.write('#!/bin/sh\n' + text + '\n')
+    f.close()
+    os.chmod(self.script, 0755)
+
+  def Runs(self):
+    try:
+      return len(open(self.counter).readlines())
+    except IOError:
+      return 0
+
+  def testFreshAndStale(self):
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 1\n')
+    self.now += 4
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 1\n')
+    self.assertEqual(self.Runs(), 1)
+    self.assertEqual(self.cache.hits, 1)
+
+    # expired but not too stale: old value now, refresh in the background.
+    self.now += 2
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 1\n')
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 1\n')
+    self.assertEqual(len(self.runner.runs), 1)  # only one refresh at a time
+    self.runner.Complete()
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 2\n')
+    self.assertEqual(self.cache.stale_hits, 2)
+
+    # far too stale: run it again while the caller waits.
+    self.now += 5 + cmdcache.STALE
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 3\n')
+    self.assertEqual(self.cache.misses, 2)
+
+  def testDifferentArgs(self):
+    self.cache.Get([self.script, 'a'])
+    self.cache.Get([self.script, 'b'])
+    self.cache.Get([self.script, 'a'])
+    self.assertEqual(self.Runs(), 2)
+
+  def testNonzeroExitIsCached(self):
+    self.SetScript('echo run >>%s; echo broken; exit 1' % self.counter)
+    self.assertEqual(self.cache.Get([self.script]), 'broken\n')
+    self.assertEqual(self.cache.Get([self.script]), 'broken\n')
+    self.assertEqual(self.Runs(), 1)
+    self.assertEqual(self.cache.failures, 0)
+
+  def testInvalidate(self):
+    self.cache.Get([self.script, 'a'])
+    self.cache.Get(['/bin/echo', 'b'])
+    self.cache.Invalidate([self.script])
+    self.assertEqual(self.cache.Get([self.script, 'a']), 'output 2\n')
+    self.assertEqual(self.cache.misses, 3)
+    self.cache.Get(['/bin/echo', 'b'])
+    self.assertEqual(self.cache.hits, 1)
+
+  def testInvalidateDuringRefresh(self):
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 1\n')
+    self.now += 6
+    self.cache.Get([self.script], ttl=5)  # starts a background refresh
+    (argv, callback) = self.runner.runs.pop()
+    # the command is changed while the refresh is still running...
+    self.cache.Invalidate([self.script])
+    d = self.cache.GetDeferred([self.script], ttl=5)
+    # ...and the refresh finishes with what it read before the change.
+    callback(executor.Result(0, 'before the change\n', False))
+    self.assertFalse(d.done)
+    self.assertEqual(len(self.runner.runs), 1)
+    self.runner.Complete()
+    self.assertEqual(d.Get(), 'output 2\n')
+    self.assertEqual(self.cache.Get([self.script], ttl=5), 'output 2\n')
+    self.assertEqual(argv, [self.script])
+
+  def testCircuitBreaker(self):
+    self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+    self.SetScript('echo run >>%s; exec sleep 30' % self.counter)
+    self.now += 100
+    # a timeout returns the last good output.
+    self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+    self.assertEqual(self.Runs(), 2)
+    # after that, nobody waits for it: it is retried in the background.
+    for unused_i in range(cmdcache.FAILURES - 1):
+      self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+      self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+      self.assertEqual(len(self.runner.runs), 1)
+      self.runner.TimeOut()
+    self.assertEqual(self.Runs(), 2)
+    self.assertEqual(self.cache.trips, 1)
+
+    # the breaker is open, we don't even try.
+    self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+    self.assertEqual(self.runner.runs, [])
+    self.assertEqual(self.cache.Stats()['open'], 1)
+
+    # after RESET, one more try however many ask.  It fails, so the
+    # breaker opens again.
+    self.now += cmdcache.RESET + 1
+    self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+    self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+    self.assertEqual(len(self.runner.runs), 1)
+    self.runner.TimeOut()
+    self.assertEqual(self.cache.trips, 2)
+
+    # when it works again, the breaker closes.
+    self.SetScript('echo run >>%s; echo fixed' % self.counter)
+    self.now += cmdcache.RESET + 1
+    self.assertEqual(self.cache.Get([self.script], ttl=1), 'output 1\n')
+    self.runner.Complete()
+    self.assertEqual(self.cache.Get([self.script], ttl=1), 'fixed\n')
+    self.assertEqual(self.cache.Stats()['open'], 0)
+
+  def testHungHelperBlocksOnce(self):
+    self.SetScript('echo run >>%s; exec sleep 30' % self.counter)
+    start = time.time()
+    # like a GetParameterValues reading 13 different wl commands.
+    self.assertEqual(self.cache.Get([self.script, 'cmd0']), '')
+    for i in range(1, 13):
+      self.assertRaises(cmdcache.CommandUnavailableError,
+                        self.cache.Get, [self.script, 'cmd%d' % i])
+    self.assertTrue(time.time() - start < 2 * self.cache.timeout)
+    self.assertEqual(self.Runs(), 1)
+    self.assertEqual(len(self.runner.runs), 12)
+
+  def testMaxSize(self):
+    self.SetScript('echo $1')
+    for i in range(cmdcache.MAXSIZE + 10):
+      self.cache.Get([self.script, str(i)])
+    stats = self.cache.Stats()
+    self.assertEqual(stats['size'], cmdcache.MAXSIZE)
+    self.assertEqual(stats['evictions'], 10)
+    # the least recently used went first.
+    self.cache.Get([self.script, str(cmdcache.MAXSIZE + 9)])
+    self.assertEqual(self.cache.hits, 1)
+    self.cache.Get([self.script, '0'])
+    self.assertEqual(self.cache.hits, 1)
+
+  def testCircuitBreakerNoOutput(self):
+    argv = [os.path.join(self.tmpdir, 'does_not_exist')]
+    for unused_i in range(cmdcache.FAILURES - 1):
+      self.assertEqual(self.cache.Get(argv), '')
+    self.assertRaises(cmdcache.CommandUnavailableError, self.cache.Get, argv)
+    self.assertRaises(cmdcache.CommandUnavailableError, self.cache.Get, argv)
+    stats = self.cache.Stats()
+    self.assertEqual(stats['failures'], cmdcache.FAILURES)
+    self.assertEqual(stats['trips'], 1)
+    self.assertEqual(stats['misses'], cmdcache.FAILURES)
+
+  def testGetDeferred(self):
+    d = self.cache.GetDeferred([self.script])
+    self.assertFalse(d.done)
+    self.runner.Complete()
+    self.assertEqual(d.Get(), 'output 1\n')
+    d = self.cache.GetDeferred([self.script])
+    self.assertEqual(d.Get(), 'output 1\n')
+    self.assertEqual(self.Runs(), 1)
+
+    argv = [os.path.join(self.tmpdir, 'does_not_exist')]
+    for unused_i in range(cmdcache.FAILURES):
+      d = self.cache.GetDeferred(argv)
+      self.runner.Complete()
+    self.assertRaises(cmdcache.CommandUnavailableError, d.Get)
+
+
+if __name__ == '__main__':
+  unittest.main()
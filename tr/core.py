@@ -26,7 +26,9 @@ Exporter yourself.
 
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
+import collections
 import string
+import sys
 
 
 class NotAddableError(KeyError):
@@ -116,6 +118,185 @@ class AutoDict(object):
     return list(self.iteritems())
 
 
+class Deferred(object):
+  """A parameter value which isn't available yet.
+
+  A getter which has to wait for something, like a helper command run
+  through tr.executor, can return a Deferred instead of its value.  When
+  the value arrives (from some later ioloop callback) call Resolve(value),
+  or Fail() from inside an except block if fetching it went wrong.
+  api.CPE.GetParameterValues waits for all of the Deferreds in a request
+  at once, so independent backends overlap instead of running serially.
+  Getters which return plain values keep working exactly as before.
+  """
+
+  def __init__(self):
+    self.done = False
+    self.value = None
+    self.exc_info = None
+    self._callbacks = []
+
+  def Resolve(self, value):
+    """Supply the value and run the callbacks."""
+    assert not self.done
+    self.done = True
+    self.value = value
+    self._RunCallbacks()
+
+  def Fail(self, exc_info=None):
+    """Mark the value as failed; Get() will raise the exception.
+
+    Args:
+      exc_info: a sys.exc_info() tuple.  Defaults to the exception
+        currently being handled.
+    """
+    assert not self.done
+    self.done = True
+    self.exc_info = exc_info or sys.exc_info()
+    self._RunCallbacks()
+
+  def Get(self):
+    """Return the value, or raise the exception it failed with."""
+    assert self.done
+    if self.exc_info:
+      raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+    return self.value
+
+  def AddCallback(self, callback):
+    """Call callback(self) when done, or right away if already done."""
+    if self.done:
+      callback(self)
+    else:
+      self._callbacks.append(callback)
+
+  def Then(self, func):
+    """Returns a Deferred for func(value), passing failures through.
+
+    If func itself returns a Deferred, the result waits for that too.
+    """
+    d = Deferred()
+
+    def Chained(value):
+      if value.exc_info:
+        d.Fail(value.exc_info)
+      else:
+        d.Resolve(value.value)
+
+    def Done(unused_self):
+      try:
+        value = func(self.Get())
+      except Exception:  #gpylint: disable-msg=W0703
+        d.Fail()
+      else:
+        if isinstance(value, Deferred):
+          value.AddCallback(Chained)
+        else:
+          d.Resolve(value)
+    self.AddCallback(Done)
+    return d
+
+  def _RunCallbacks(self):
+    callbacks = self._callbacks
+    self._callbacks = []
+    for callback in callbacks:
+      callback(self)
+
+
+def Gather(values):
+  """Wait for all of the Deferreds in a list.
+
+  Args:
+    values: a list of plain values and Deferred objects.
+  Returns:
+    a Deferred for the same list, with each Deferred replaced by its
+    value.  It fails with the first failure in the list, once all of the
+    values are done.
+  """
+  result = Deferred()
+  values = list(values)
+  pending = [d for d in values if isinstance(d, Deferred) and not d.done]
+  remaining = [len(pending)]
+
+  def Finish():
+    for d in values:
+      if isinstance(d, Deferred) and d.exc_info:
+        result.Fail(d.exc_info)
+        return
+    result.Resolve([d.value if isinstance(d, Deferred) else d
+                    for d in values])
+
+  def Done(unused_d):
+    remaining[0] -= 1
+    if not remaining[0]:
+      Finish()
+
+  if not pending:
+    Finish()
+  for d in pending:
+    d.AddCallback(Done)
+  return result
+
+
+class Limiter(object):
+  """Runs functions which may return Deferreds, a few at a time.
+
+  For fanning out work like one helper command per station or per node,
+  without starting all of them at once.  Functions beyond the limit wait
+  in a queue, in the order they were asked for.
+  """
+
+  def __init__(self, limit):
+    """Initialize a Limiter.
+
+    Args:
+      limit: the most functions to have waiting on a Deferred at once.
+    """
+    self.limit = limit
+    self.running = 0
+    self._queue = collections.deque()
+
+  def Run(self, func, *args):
+    """Call func(*args) as soon as fewer than limit calls are running.
+
+    Returns:
+      a Deferred for what func returned, which can be a plain value or
+      a Deferred.  If func raised, the Deferred fails.
+    """
+    d = Deferred()
+    self._queue.append((func, args, d))
+    self._Start()
+    return d
+
+  def _Start(self):
+    while self._queue and self.running < self.limit:
+      (func, args, d) = self._queue.popleft()
+      try:
+        value = func(*args)
+      except Exception:  #gpylint: disable-msg=W0703
+        d.Fail()
+        continue
+      if isinstance(value, Deferred) and not value.done:
+        self.running += 1
+        value.AddCallback(lambda value, d=d: self._Done(value, d))
+      else:
+        _Forward(value, d)
+
+  def _Done(self, value, d):
+    self.running -= 1
+    _Forward(value, d)
+    self._Start()
+
+
+def _Forward(value, d):
+  """Finish Deferred d with value, which may be a finished Deferred."""
+  if not isinstance(value, Deferred):
+    d.Resolve(value)
+  elif value.exc_info:
+    d.Fail(value.exc_info)
+  else:
+    d.Resolve(value.value)
+
+
 def _Int(s):
   """Try to convert s to an int.  If we can't, just return s."""
   try:
@@ -142,6 +323,7 @@ class Exporter(object):
     self.export_params = set()
     self.export_objects = set()
     self.export_object_lists = set()
+    self.export_prefetch = dict()
     self.dirty = False  # object has pending SetParameters to be committed.
     if defaults:
       for (key, value) in defaults.iteritems():
@@ -191,6 +373,30 @@ class Exporter(object):
     if lists:
       self.export_object_lists.remove(lists)
 
+  def DeclarePrefetch(self, params, snapshot, *args):
+    """Declare that some parameters are all computed from one snapshot.
+
+    api.CPE.GetParameterValues calls snapshot(*args) once for the whole
+    request, before running the getter of any parameter which needs it.
+    The snapshot should fill whatever cache those getters read from,
+    typically tr.cmdcache, and can return a Deferred to be waited for.
+    It is only an optimization: getters must still work on their own.
+
+    Args:
+      params: a list of parameter names in this object.
+      snapshot: a callable, usually a bound method.
+      args: arguments to pass to snapshot.
+    """
+    for param in params:
+      snapshots = self.export_prefetch.setdefault(param, [])
+      if (snapshot, args) not in snapshots:
+        snapshots.append((snapshot, args))
+
+  def GetPrefetch(self, name):
+    """Return the (snapshot, args) tuples declared for parameter name."""
+    parent, subname = self.FindExport(name)
+    return getattr(parent, 'export_prefetch', {}).get(subname, [])
+
   def GetCanonicalName(self, obj_to_find):
     """Generate a canonical name for an object.
 
@@ -339,7 +545,8 @@ class Exporter(object):
     Args:
       name: a dot-separated sub-object name to retrieve.
     Returns:
-      An Exporter instance or a parameter value.
+      An Exporter instance or a parameter value.  Parameter values may be
+      a Deferred if the getter can't produce the value right away.
     """
     parent, subname = self.FindExport(name)
     try:
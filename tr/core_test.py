@@ -102,6 +102,82 @@ class CoreTest(unittest.TestCase):
     name = o.GetCanonicalName(obj3)
     self.assertEqual('Counter.2', name)
 
+  def testDeferred(self):
+    d = core.Deferred()
+    seen = []
+    d.AddCallback(lambda x: seen.append(x.Get()))
+    doubled = d.Then(lambda v: v * 2)
+    self.assertFalse(d.done)
+    self.assertFalse(doubled.done)
+    d.Resolve(21)
+    self.assertEqual(seen, [21])
+    self.assertEqual(doubled.Get(), 42)
+    d.AddCallback(lambda x: seen.append('late'))
+    self.assertEqual(seen, [21, 'late'])
+
+    d = core.Deferred()
+    try:
+      raise KeyError('Nope')
+    except KeyError:
+      d.Fail()
+    self.assertRaises(KeyError, d.Get)
+    self.assertRaises(KeyError, d.Then(lambda v: v).Get)
+
+    # a func returning a Deferred chains onto it.
+    d = core.Deferred()
+    inner = core.Deferred()
+    chained = d.Then(lambda v: inner)
+    d.Resolve(1)
+    self.assertFalse(chained.done)
+    inner.Resolve(2)
+    self.assertEqual(chained.Get(), 2)
+
+  def testGather(self):
+    d1 = core.Deferred()
+    d2 = core.Deferred()
+    g = core.Gather([1, d1, 'two', d2])
+    self.assertFalse(g.done)
+    d2.Resolve(4)
+    self.assertFalse(g.done)
+    d1.Resolve(3)
+    self.assertEqual(g.Get(), [1, 3, 'two', 4])
+    self.assertEqual(core.Gather([5, 6]).Get(), [5, 6])
+
+    d1 = core.Deferred()
+    d2 = core.Deferred()
+    g = core.Gather([d1, d2])
+    try:
+      raise ValueError('bad')
+    except ValueError:
+      d1.Fail()
+    self.assertFalse(g.done)  # waits for everything to finish
+    d2.Resolve(2)
+    self.assertRaises(ValueError, g.Get)
+
+  def testLimiter(self):
+    limiter = core.Limiter(2)
+    pending = [core.Deferred() for unused_i in range(4)]
+    started = []
+
+    def Work(i):
+      started.append(i)
+      if i == 2:
+        raise ValueError('bad')
+      return pending[i]
+    results = [limiter.Run(Work, i) for i in range(4)]
+    self.assertEqual(started, [0, 1])
+    pending[1].Resolve('one')
+    # 2 failed right away, so 3 could start too.
+    self.assertEqual(started, [0, 1, 2, 3])
+    self.assertEqual(results[1].Get(), 'one')
+    self.assertRaises(ValueError, results[2].Get)
+    self.assertEqual(limiter.running, 2)
+    pending[0].Resolve('zero')
+    pending[3].Resolve('three')
+    self.assertEqual(core.Gather(results[:2] + results[3:]).Get(),
+                     ['zero', 'one', 'three'])
+    self.assertEqual(limiter.running, 0)
+    self.assertEqual(limiter.Run(lambda: 'now').Get(), 'now')
 
 
 if __name__ == '__main__':
@@ -21,9 +21,11 @@
 
 __author__ = 'dgentry@google.com (Denton Gentry)'
 
+import collections
 import functools
 import tornado.httpclient
 import tornado.ioloop
+import helpers
 
 # SPEC3 = TR-069_Amendment-3.pdf
 # http://www.broadband-forum.org/technical/download/TR-069_Amendment-3.pdf
@@ -66,6 +68,8 @@ class CwmpSession(object):
     self.my_ip = None
     self.ping_received = False
     self.state = self.CONNECT
+    self._closed = False
+    cache.session_start()
 
   def state_update(self, sent_inform=None, on_hold=None,
                    cpe_to_acs_empty=None, acs_to_cpe_empty=None):
@@ -115,13 +119,29 @@ class CwmpSession(object):
     self.close()
 
   def close(self):
-    cache.flush()
+    if not self._closed:
+      self._closed = True
+      cache.session_end()
     self.http = None
     return self.ping_received
 
 
+# Unit tests can override these
+TIMENOW = helpers.monotime
+
+
+class _CacheEntry(object):
+  """One cached value, and when it stops being valid."""
+  __slots__ = ['value', 'scope', 'expires']
+
+  def __init__(self, value, scope, expires):
+    self.value = value
+    self.scope = scope
+    self.expires = expires
+
+
 class cache(object):
-  """A global cache of arbitrary data for the lifetime of one CWMP session.
+  """A global cache of arbitrary data, by default for one CWMP session.
 
   @cwmp_session.cache is a decorator to cache the return
   value of a function for the remainder of the session with the ACS.
@@ -130,37 +150,158 @@ class cache(object):
 
   This is intended for very expensive operations, particularly where
   a process is forked and its output parsed.
+
+  @cwmp_session.cache(scope=..., ttl=...) picks how long values live:
+    cache.SESSION: until the CWMP session ends.  Outside of a session,
+      for example from rcommand or PeriodicStatistics, this is the same
+      as TICK so nobody sees stale data indefinitely.
+    cache.TICK: until the current ioloop callback returns.
+    cache.FOREVER: until evicted.
+  ttl, if given, additionally limits the lifetime to that many seconds.
+
+  Entries are keyed by the decorated function and the arguments tuple;
+  objects without an __eq__ of their own (like Exporters) compare by
+  identity.  At most MAXSIZE entries are kept, the least recently used
+  are evicted first.
   """
 
-  _thecache = dict()
+  SESSION = 'session'
+  TICK = 'tick'
+  FOREVER = 'forever'
+
+  # Unit tests can override these
+  MAXSIZE = 4096
+
+  _thecache = collections.OrderedDict()
+  _decorators = []
+  _sessions = 0
+  _tick_scheduled = False
+  _generation = 0
+  evictions = 0
 
   @staticmethod
   def flush():
-    """Flush all cached data."""
+    """Flush all cached data except the FOREVER scope."""
+    cache._generation += 1
+    for k, entry in cache._thecache.items():
+      if entry.scope != cache.FOREVER:
+        del cache._thecache[k]
+
+  @staticmethod
+  def new_tick():
+    """Flush the TICK scope."""
+    cache._tick_scheduled = False
+    cache._generation += 1
+    for k, entry in cache._thecache.items():
+      if entry.scope == cache.TICK:
+        del cache._thecache[k]
+
+  @staticmethod
+  def invalidate(obj):
+    """Drop every value cached by a method of obj, in any scope."""
     for k in cache._thecache.keys():
-      del cache._thecache[k]
+      args = k[1]
+      if isinstance(args, tuple) and args and args[0] is obj:
+        del cache._thecache[k]
 
-  def __init__(self, func):
+  @staticmethod
+  def generation():
+    """Return a number which changes whenever the TICK scope is flushed.
+
+    For caches which don't fit the decorator: what they hold is good
+    until the generation changes.  Like caching a TICK value, this makes
+    sure a new tick will come.
+
+    Returns:
+      an integer.
+    """
+    cache._ScheduleTick()
+    return cache._generation
+
+  @staticmethod
+  def session_start():
+    cache._sessions += 1
+
+  @staticmethod
+  def session_end():
+    cache._sessions -= 1
+    cache.flush()
+
+  @staticmethod
+  def stats():
+    """Return a dict of hit rate statistics, for monitoring."""
+    functions = dict()
+    for d in cache._decorators:
+      name = '%s.%s' % (d.func.__module__, d.func.__name__)
+      functions[name] = {'hits': d.hits, 'misses': d.misses,
+                         'hit_rate': _HitRate(d.hits, d.misses)}
+    hits = sum([d.hits for d in cache._decorators])
+    misses = sum([d.misses for d in cache._decorators])
+    return {'size': len(cache._thecache), 'evictions': cache.evictions,
+            'hits': hits, 'misses': misses,
+            'hit_rate': _HitRate(hits, misses), 'functions': functions}
+
+  def __init__(self, func=None, scope=SESSION, ttl=None):
+    self.func = None
+    self.scope = scope
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    if func is not None:
+      self._Wrap(func)
+
+  def _Wrap(self, func):
     self.func = func
-    self.obj = None
+    functools.update_wrapper(self, func)
+    cache._decorators.append(self)
+    return self
 
   def __get__(self, obj, objtype):
     """Support instance methods."""
-    self.obj = obj
+    if obj is None:
+      return self
     return functools.partial(self.__call__, obj)
 
   def __call__(self, *args):
-    key = self._cache_key(args)
+    if self.func is None:
+      # @cache(scope=..., ttl=...) is being applied to the function.
+      return self._Wrap(args[0])
     try:
-      return cache._thecache[key]
-    except KeyError:
-      val = self.func(*args)
-      cache._thecache[key] = val
-      return val
-
-  def _cache_key(self, *args):
-    """Concatenate the function, object, and all arguments."""
-    return '\0'.join([repr(x) for x in [self.func, self.obj, args]])
+      key = (self, args)
+      entry = cache._thecache.pop(key, None)
+    except TypeError:
+      # unhashable arguments, like lists.
+      key = (self, repr(args))
+      entry = cache._thecache.pop(key, None)
+    now = TIMENOW()
+    if entry is not None and (entry.expires is None or now < entry.expires):
+      self.hits += 1
+      cache._thecache[key] = entry  # now the most recently used
+      return entry.value
+    self.misses += 1
+    val = self.func(*args)
+    scope = self.scope
+    if scope == cache.SESSION and cache._sessions <= 0:
+      scope = cache.TICK
+    if scope == cache.TICK:
+      cache._ScheduleTick()
+    expires = now + self.ttl if self.ttl is not None else None
+    cache._thecache[key] = _CacheEntry(val, scope, expires)
+    while len(cache._thecache) > cache.MAXSIZE:
+      cache._thecache.popitem(last=False)
+      cache.evictions += 1
+    return val
+
+  @staticmethod
+  def _ScheduleTick():
+    if not cache._tick_scheduled:
+      cache._tick_scheduled = True
+      tornado.ioloop.IOLoop.instance().add_callback(cache.new_tick)
+
+
+def _HitRate(hits, misses):
+  total = hits + misses
+  return float(hits) / total if total else 0.0
 
 
 def main():
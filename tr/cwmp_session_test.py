@@ -205,9 +205,33 @@ def SimpleCacheFunction():
   return time.time()
 
 
+class ScopedCacheObject(object):
+  def __init__(self):
+    self.n = 0
+
+  def _Count(self):
+    self.n += 1
+    return self.n
+
+  @cwmp_session.cache(scope=cwmp_session.cache.TICK)
+  def tick(self):
+    return self._Count()
+
+  @cwmp_session.cache(scope=cwmp_session.cache.FOREVER, ttl=10)
+  def forever(self):
+    return self._Count()
+
+  @cwmp_session.cache
+  def session(self, arg):  #pylint: disable-msg=W0613
+    return self._Count()
+
+
 class SessionCacheTest(unittest.TestCase):
   """tests for SessionCache."""
 
+  def setUp(self):
+    cwmp_session.cache._thecache.clear()
+
   def testCacheObject(self):
     t1 = SimpleCacheObject()
     t2 = SimpleCacheObject()
@@ -250,6 +274,100 @@ class SessionCacheTest(unittest.TestCase):
       t.cache_function_with_args(99, arg)
     self.assertEqual(t.cache_this_function_args_n, 11)
 
+  def testTickScope(self):
+    cs = cwmp_session.CwmpSession('')
+    t = ScopedCacheObject()
+    self.assertEqual(t.tick(), 1)
+    self.assertEqual(t.tick(), 1)
+    cwmp_session.cache.new_tick()
+    self.assertEqual(t.tick(), 2)
+    cs.close()
+
+  def testInvalidate(self):
+    t = ScopedCacheObject()
+    other = ScopedCacheObject()
+    self.assertEqual(t.tick(), 1)
+    self.assertEqual(t.forever(), 2)
+    self.assertEqual(other.tick(), 1)
+    cwmp_session.cache.invalidate(t)
+    self.assertEqual(t.tick(), 3)
+    self.assertEqual(t.forever(), 4)
+    self.assertEqual(other.tick(), 1)
+
+  def testGeneration(self):
+    gen = cwmp_session.cache.generation()
+    self.assertEqual(cwmp_session.cache.generation(), gen)
+    cwmp_session.cache.new_tick()
+    self.assertNotEqual(cwmp_session.cache.generation(), gen)
+    gen = cwmp_session.cache.generation()
+    cwmp_session.cache.flush()
+    self.assertNotEqual(cwmp_session.cache.generation(), gen)
+
+  def testSessionScope(self):
+    t = ScopedCacheObject()
+    cs = cwmp_session.CwmpSession('')
+    self.assertEqual(t.session(0), 1)
+    cwmp_session.cache.new_tick()
+    self.assertEqual(t.session(0), 1)  # a session outlives ticks
+    cs.close()
+    cs.close()  # closing twice must not end some other session
+    self.assertEqual(t.session(0), 2)
+
+    # outside of a session, entries last only until the next tick
+    self.assertEqual(t.session(0), 2)
+    cwmp_session.cache.new_tick()
+    self.assertEqual(t.session(0), 3)
+
+  def testForeverScopeWithTtl(self):
+    old_TIMENOW = cwmp_session.TIMENOW
+    now = [1000.0]
+    cwmp_session.TIMENOW = lambda: now[0]
+    try:
+      t = ScopedCacheObject()
+      self.assertEqual(t.forever(), 1)
+      cwmp_session.cache.flush()
+      cwmp_session.cache.new_tick()
+      self.assertEqual(t.forever(), 1)
+      now[0] += 9
+      self.assertEqual(t.forever(), 1)
+      now[0] += 2
+      self.assertEqual(t.forever(), 2)
+    finally:
+      cwmp_session.TIMENOW = old_TIMENOW
+
+  def testLruBound(self):
+    old_MAXSIZE = cwmp_session.cache.MAXSIZE
+    cwmp_session.cache.MAXSIZE = 3
+    try:
+      evictions = cwmp_session.cache.evictions
+      t = ScopedCacheObject()
+      for i in range(3):
+        t.session(i)
+      t.session(0)  # now 1 is the least recently used
+      t.session(3)
+      self.assertEqual(cwmp_session.cache.evictions, evictions + 1)
+      self.assertEqual(t.n, 4)
+      t.session(0)
+      self.assertEqual(t.n, 4)
+      t.session(1)
+      self.assertEqual(t.n, 5)
+    finally:
+      cwmp_session.cache.MAXSIZE = old_MAXSIZE
+
+  def testStats(self):
+    t = ScopedCacheObject()
+    before = cwmp_session.cache.stats()
+    t.session('stats')
+    t.session('stats')
+    t.session('stats')
+    stats = cwmp_session.cache.stats()
+    self.assertEqual(stats['hits'], before['hits'] + 2)
+    self.assertEqual(stats['misses'], before['misses'] + 1)
+    self.assertTrue(0.0 < stats['hit_rate'] < 1.0)
+    name = '%s.session' % ScopedCacheObject.__module__
+    self.assertEqual(stats['functions'][name]['misses'],
+                     before['functions'][name]['misses'] + 1)
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run helper commands from the tornado ioloop without blocking it.
+
+Many of our Exporter getters need to run a helper like wl or mocactl to
+find out their value.  Doing that with subprocess.Popen().communicate()
+stops the whole ioloop until the child exits.  The Executor instead
+starts the child with a nonblocking stdout pipe registered with the
+ioloop, and calls you back when the child is done.
+
+Example:
+  def GotResult(result):
+    print result.returncode, result.out
+
+  tr.executor.Instance().Run(['wl', '-i', 'eth2', 'assoclist'], GotResult)
+
+The callback keyword is compatible with tornado.gen.Task, so a
+tornado.gen.engine function can simply:
+  result = yield tornado.gen.Task(tr.executor.Instance().Run, argv)
+
+An Exporter getter can return RunDeferred(argv).Then(ParseOutput) to let
+api.CPE.GetParameterValues run its command alongside everybody else's.
+"""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import collections
+import datetime
+import errno
+import fcntl
+import os
+import select
+import signal
+import subprocess
+import sys
+import traceback
+
+import google3
+import tornado.ioloop
+import core
+import helpers
+
+
+# Unit tests can override these
+MAX_CONCURRENT = 4
+TIMEOUT = 30.0
+
+
+# returncode: the exit code of the child, negative if killed by a signal.
+#   127 if the command could not be started at all, like the shell does.
+# out: everything the child wrote to stdout.
+# timedout: True if we killed the child for running too long.
+Result = collections.namedtuple('Result', ('returncode', 'out', 'timedout'))
+
+EXEC_FAILED = 127
+_READ_SIZE = 65536
+_REAP_INTERVAL = 0.005
+_REAP_INTERVAL_MAX = 0.1
+
+
+class _Job(object):
+  """A single command, plus everybody waiting for its output."""
+
+  def __init__(self, argv, timeout):
+    self.argv = list(argv)
+    self.timeout = timeout
+    self.callbacks = []
+    self.proc = None
+    self.fd = None
+    self.chunks = []
+    self.timer = None
+    self.timedout = False
+    self.finished = False
+    self.reap_interval = _REAP_INTERVAL
+
+
+class Executor(object):
+  """Runs helper commands asynchronously on a tornado ioloop.
+
+  At most max_concurrent children run at once, the rest are queued in
+  the order they were requested.  Asking for a command which is already
+  queued or running does not start another child; the caller is just
+  added to the list of callbacks for the existing one.
+  """
+
+  def __init__(self, ioloop=None, max_concurrent=None, timeout=None):
+    """Initialize an Executor.
+
+    Args:
+      ioloop: the tornado.ioloop.IOLoop to run on.
+      max_concurrent: the maximum number of children to run at once.
+      timeout: the default number of seconds a child may run before
+        we kill it.
+    """
+    self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+    self.max_concurrent = max_concurrent or MAX_CONCURRENT
+    self.timeout = timeout or TIMEOUT
+    self._jobs = {}
+    self._queue = collections.deque()
+    self.running = 0
+    self.started = 0
+    self.deduplicated = 0
+    self.timeouts = 0
+
+  def Run(self, argv, callback, timeout=None):
+    """Run argv, then call callback(Result).
+
+    Args:
+      argv: the command and its arguments, as for subprocess.Popen.
+      callback: called with a Result when the command is finished.
+      timeout: seconds to let the command run before killing it, or None
+        for the Executor's default.
+    """
+    key = tuple(argv)
+    job = self._jobs.get(key)
+    if job is not None:
+      self.deduplicated += 1
+      job.callbacks.append(callback)
+      return
+    job = _Job(argv, timeout or self.timeout)
+    job.callbacks.append(callback)
+    self._jobs[key] = job
+    if self.running < self.max_concurrent:
+      self._Start(job)
+    else:
+      self._queue.append(job)
+
+  def RunDeferred(self, argv, timeout=None):
+    """Like Run(), but returns a core.Deferred for the Result."""
+    d = core.Deferred()
+    self.Run(argv, d.Resolve, timeout=timeout)
+    return d
+
+  def Pending(self):
+    """Returns the number of commands which are running or queued."""
+    return len(self._jobs)
+
+  def _Start(self, job):
+    """Fork the child for job and register its stdout with the ioloop."""
+    self.running += 1
+    self.started += 1
+    try:
+      job.proc = subprocess.Popen(job.argv, stdout=subprocess.PIPE,
+                                  close_fds=True)
+    except OSError:
+      print 'executor: unable to run %r' % (job.argv,)
+      self._Finish(job, Result(EXEC_FAILED, '', False))
+      return
+    job.fd = job.proc.stdout.fileno()
+    flags = fcntl.fcntl(job.fd, fcntl.F_GETFL)
+    fcntl.fcntl(job.fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    self.ioloop.add_handler(job.fd, lambda fd, events: self._Read(job),
+                            self.ioloop.READ | self.ioloop.ERROR)
+    job.timer = self.ioloop.add_timeout(
+        datetime.timedelta(seconds=job.timeout), lambda: self._Timeout(job))
+
+  def _Read(self, job):
+    """Called by the ioloop whenever the child writes to stdout."""
+    try:
+      data = os.read(job.fd, _READ_SIZE)
+    except OSError, e:
+      if e.errno in (errno.EAGAIN, errno.EINTR):
+        return
+      data = ''
+    if data:
+      job.chunks.append(data)
+      return
+    self._ClosePipe(job)
+    self._Reap(job)
+
+  def _ClosePipe(self, job):
+    if job.fd is not None:
+      self.ioloop.remove_handler(job.fd)
+      job.proc.stdout.close()
+      job.fd = None
+
+  def _Reap(self, job):
+    """Collect the exit code of a child which has closed its stdout."""
+    if job.finished:
+      return  # _Timeout got there first
+    if job.proc.poll() is None:
+      # stdout is closed but the child hasn't exited quite yet.
+      self.ioloop.add_timeout(
+          datetime.timedelta(seconds=job.reap_interval),
+          lambda: self._Reap(job))
+      job.reap_interval = min(job.reap_interval * 2, _REAP_INTERVAL_MAX)
+      return
+    self.ioloop.remove_timeout(job.timer)
+    self._Finish(job, Result(job.proc.returncode, ''.join(job.chunks),
+                             job.timedout))
+
+  def _Timeout(self, job):
+    """The child ran for too long: kill it and return what we have."""
+    print 'executor: timeout after %.1fs: %r' % (job.timeout, job.argv)
+    self.timeouts += 1
+    job.timedout = True
+    try:
+      os.kill(job.proc.pid, signal.SIGKILL)
+    except OSError:
+      pass  # it already exited
+    self._ClosePipe(job)
+    job.proc.wait()
+    self._Finish(job, Result(job.proc.returncode, ''.join(job.chunks), True))
+
+  def _Finish(self, job, result):
+    """Deliver result to everyone waiting on job, then start the next one."""
+    job.finished = True
+    del self._jobs[tuple(job.argv)]
+    self.running -= 1
+    for callback in job.callbacks:
+      try:
+        callback(result)
+      except Exception:  #gpylint: disable-msg=W0703
+        print 'executor: callback for %r failed' % (job.argv,)
+        traceback.print_exc(file=sys.stdout)
+    while self._queue and self.running < self.max_concurrent:
+      self._Start(self._queue.popleft())
+
+
+def RunSync(argv, timeout=None):
+  """Run argv and wait for it, but kill it if it runs longer than timeout.
+
+  This blocks the ioloop, so only use it where the caller must have the
+  answer right now.  Unlike Popen().communicate(), a wedged helper can
+  only stall us for timeout seconds.
+
+  Args:
+    argv: the command and its arguments, as for subprocess.Popen.
+    timeout: seconds to let the command run, or None for TIMEOUT.
+  Returns:
+    a Result.
+  """
+  timeout = timeout or TIMEOUT
+  try:
+    proc = subprocess.Popen(argv, stdout=subprocess.PIPE, close_fds=True)
+  except OSError:
+    print 'executor: unable to run %r' % (argv,)
+    return Result(EXEC_FAILED, '', False)
+  fd = proc.stdout.fileno()
+  deadline = helpers.monotime() + timeout
+  chunks = []
+  while True:
+    remaining = deadline - helpers.monotime()
+    if remaining <= 0:
+      print 'executor: timeout after %.1fs: %r' % (timeout, argv)
+      try:
+        os.kill(proc.pid, signal.SIGKILL)
+      except OSError:
+        pass  # it already exited
+      proc.stdout.close()
+      proc.wait()
+      return Result(proc.returncode, ''.join(chunks), True)
+    try:
+      readable, _, _ = select.select([fd], [], [], remaining)
+    except select.error, e:
+      if e.args[0] == errno.EINTR:
+        continue
+      raise
+    if readable:
+      data = os.read(fd, _READ_SIZE)
+      if not data:
+        break
+      chunks.append(data)
+  proc.stdout.close()
+  proc.wait()
+  return Result(proc.returncode, ''.join(chunks), False)
+
+
+_executor = None
+
+
+def Instance():
+  """Returns the shared Executor for the global ioloop."""
+  global _executor
+  if _executor is None:
+    _executor = Executor()
+  return _executor
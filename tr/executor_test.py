@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+#pylint: disable-msg=C6409
+
+"""Unit tests for executor.py."""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import google3
+import tornado.gen
+import tornado.ioloop
+import executor
+
+
+class ExecutorTest(unittest.TestCase):
+  """Tests for executor.py."""
+
+  def setUp(self):
+    self.ioloop = tornado.ioloop.IOLoop()
+    self.tmpdir = tempfile.mkdtemp()
+    self.results = []
+
+  def tearDown(self):
+    self.ioloop.close(all_fds=True)
+    shutil.rmtree(self.tmpdir)
+
+  def _GotResult(self, result):
+    self.results.append(result)
+    if not self.ex.Pending():
+      self.ioloop.stop()
+
+  def _RunLoop(self):
+    tmo = self.ioloop.add_timeout(datetime.timedelta(seconds=10),
+                                  self.ioloop.stop)
+    self.ioloop.start()
+    self.ioloop.remove_timeout(tmo)
+
+  def testRun(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+    self.ex.Run(['echo', 'hello', 'world'], self._GotResult)
+    self._RunLoop()
+    self.assertEqual(len(self.results), 1)
+    self.assertEqual(self.results[0].returncode, 0)
+    self.assertEqual(self.results[0].out, 'hello world\n')
+    self.assertFalse(self.results[0].timedout)
+
+  def testExitCode(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+    self.ex.Run(['sh', '-c', 'echo partial; exit 3'], self._GotResult)
+    self._RunLoop()
+    self.assertEqual(self.results[0].returncode, 3)
+    self.assertEqual(self.results[0].out, 'partial\n')
+
+  def testNoSuchCommand(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+    self.ex.Run(['/no/such/command'], self._GotResult)
+    self.assertEqual(len(self.results), 1)
+    self.assertEqual(self.results[0].returncode, executor.EXEC_FAILED)
+    self.assertEqual(self.ex.Pending(), 0)
+
+  def testLargeOutput(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+    self.ex.Run(['dd', 'if=/dev/zero', 'bs=1024', 'count=1024'],
+                self._GotResult)
+    self._RunLoop()
+    self.assertEqual(len(self.results[0].out), 1024 * 1024)
+
+  def testTimeout(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+    self.ex.Run(['sh', '-c', 'echo started; exec sleep 30'], self._GotResult,
+                timeout=0.2)
+    self._RunLoop()
+    self.assertEqual(len(self.results), 1)
+    self.assertTrue(self.results[0].timedout)
+    self.assertEqual(self.results[0].out, 'started\n')
+    self.assertNotEqual(self.results[0].returncode, 0)
+    self.assertEqual(self.ex.timeouts, 1)
+
+  def testDeduplicate(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+    logfile = os.path.join(self.tmpdir, 'log')
+    cmd = ['sh', '-c', 'echo ran >>%s; echo out' % logfile]
+    self.ex.Run(cmd, self._GotResult)
+    self.ex.Run(cmd, self._GotResult)
+    self.ex.Run(cmd, self._GotResult)
+    self._RunLoop()
+    self.assertEqual(len(self.results), 3)
+    for result in self.results:
+      self.assertEqual(result.out, 'out\n')
+    self.assertEqual(open(logfile).read(), 'ran\n')
+    self.assertEqual(self.ex.started, 1)
+    self.assertEqual(self.ex.deduplicated, 2)
+
+    # once finished, the same command runs again.
+    self.results = []
+    self.ex.Run(cmd, self._GotResult)
+    self._RunLoop()
+    self.assertEqual(open(logfile).read(), 'ran\nran\n')
+
+  def testConcurrencyLimit(self):
+    self.ex = executor.Executor(ioloop=self.ioloop, max_concurrent=2)
+    logfile = os.path.join(self.tmpdir, 'log')
+    for i in range(5):
+      cmd = ['sh', '-c', 'echo start >>%s; sleep 0.1; echo end >>%s; echo %d'
+             % (logfile, logfile, i)]
+      self.ex.Run(cmd, self._GotResult)
+    self.assertEqual(self.ex.running, 2)
+    self.assertEqual(self.ex.Pending(), 5)
+    self._RunLoop()
+    self.assertEqual(sorted(r.out for r in self.results),
+                     ['0\n', '1\n', '2\n', '3\n', '4\n'])
+    # never more than two children between a start and an end.
+    inflight = peak = 0
+    for line in open(logfile):
+      inflight += 1 if line.strip() == 'start' else -1
+      peak = max(peak, inflight)
+    self.assertEqual(peak, 2)
+
+  def testCallbackException(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+
+    def Broken(unused_result):
+      raise ValueError('oops')
+
+    cmd = ['echo', 'x']
+    self.ex.Run(cmd, Broken)
+    self.ex.Run(cmd, self._GotResult)
+    self._RunLoop()
+    self.assertEqual(len(self.results), 1)
+
+  def testRunDeferred(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+    d = self.ex.RunDeferred(['echo', '42']).Then(lambda r: int(r.out))
+    d.AddCallback(lambda unused_d: self.ioloop.stop())
+    self.assertFalse(d.done)
+    self._RunLoop()
+    self.assertEqual(d.Get(), 42)
+
+  def testRunSync(self):
+    result = executor.RunSync(['sh', '-c', 'echo hi; exit 2'])
+    self.assertEqual(result, executor.Result(2, 'hi\n', False))
+    result = executor.RunSync(['sh', '-c', 'echo slow; exec sleep 30'],
+                              timeout=0.2)
+    self.assertTrue(result.timedout)
+    self.assertEqual(result.out, 'slow\n')
+    result = executor.RunSync(['/no/such/command'])
+    self.assertEqual(result.returncode, executor.EXEC_FAILED)
+
+  def testGenTask(self):
+    self.ex = executor.Executor(ioloop=self.ioloop)
+
+    @tornado.gen.engine
+    def Fetch():
+      first = yield tornado.gen.Task(self.ex.Run, ['echo', 'one'])
+      second = yield tornado.gen.Task(self.ex.Run, ['echo', 'two'])
+      self.results.extend([first, second])
+      self.ioloop.stop()
+
+    Fetch()
+    self._RunLoop()
+    self.assertEqual([r.out for r in self.results], ['one\n', 'two\n'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A per-tick cache of small files from /proc and /sys.
+
+A GetParameterValues of a whole tree reads the same few kernel files
+(/proc/uptime, a thermal sensor, an LED's state) many times over.  Read()
+returns the contents of a file as of this tick: the first caller reads
+it, everyone else gets the same string until the tr.cwmp_session.cache
+generation changes.  Failures are cached too, and raised again.
+
+Files under KEEPOPEN_PREFIXES, sysfs attributes, are regenerated by the
+kernel on every read from offset 0.  We keep those open and read them
+again from the start each tick instead of opening them every time.  Other
+files are opened afresh; /tmp files, for one, are often replaced by a
+rename and an open descriptor would never see the new contents.
+"""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import errno
+import io
+import os
+
+import google3
+import cwmp_session
+
+
+# Unit tests can override these
+KEEPOPEN_PREFIXES = ['/sys/']
+BUFSIZE = 4096
+
+# Approximate system calls needed to read a file with open(): open,
+# fstat, read until EOF (two, for a small file) and close.
+_OPEN_READ_SYSCALLS = 5
+# ... and to read it again on a descriptor we kept: lseek, then read
+# until EOF.
+_REREAD_SYSCALLS = 3
+
+
+class FileCache(object):
+  """Caches file contents for one tick, see the module docstring."""
+
+  def __init__(self):
+    self._contents = dict()
+    self._fds = dict()
+    self._generation = None
+    self.hits = 0
+    self.reads = 0
+    self.rereads = 0
+    self.errors = 0
+
+  def Read(self, filename):
+    """Return the contents of filename.
+
+    Args:
+      filename: the path to read.
+    Returns:
+      the contents of the file as of this tick, as a string.
+    Raises:
+      IOError: if the file couldn't be read.
+    """
+    generation = cwmp_session.cache.generation()
+    if generation != self._generation:
+      self._contents.clear()
+      self._generation = generation
+    result = self._contents.get(filename)
+    if result is None:
+      result = self._contents[filename] = self._ReadFile(filename)
+    else:
+      self.hits += 1
+    if isinstance(result, EnvironmentError):
+      raise result
+    return result
+
+  def Open(self, filename):
+    """Like open(filename), but with the contents from Read()."""
+    return io.BytesIO(self.Read(filename))
+
+  def Flush(self):
+    """Forget all contents, and close every file we kept open."""
+    self._contents.clear()
+    for fd in self._fds.itervalues():
+      os.close(fd)
+    self._fds.clear()
+
+  def Stats(self):
+    """Return a dict of counters, for monitoring."""
+    saved = (self.hits * _OPEN_READ_SYSCALLS +
+             self.rereads * (_OPEN_READ_SYSCALLS - _REREAD_SYSCALLS))
+    return {'hits': self.hits,
+            'reads': self.reads,
+            'rereads': self.rereads,
+            'errors': self.errors,
+            'open': len(self._fds),
+            'syscalls_saved': saved}
+
+  def _KeepOpen(self, filename):
+    for prefix in KEEPOPEN_PREFIXES:
+      if filename.startswith(prefix):
+        return True
+    return False
+
+  def _ReadFile(self, filename):
+    """Read filename, returning its contents or the IOError we got."""
+    self.reads += 1
+    fd = self._fds.pop(filename, None)
+    if fd is not None:
+      try:
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = self._ReadAll(fd)
+        self._fds[filename] = fd
+        self.rereads += 1
+        return data
+      except OSError:
+        # the attribute went away with its device, maybe to come back.
+        os.close(fd)
+    try:
+      fd = os.open(filename, os.O_RDONLY)
+    except OSError, e:
+      self.errors += 1
+      return IOError(e.errno, e.strerror, filename)
+    try:
+      data = self._ReadAll(fd)
+    except OSError, e:
+      os.close(fd)
+      self.errors += 1
+      return IOError(e.errno, e.strerror, filename)
+    if self._KeepOpen(filename):
+      self._fds[filename] = fd
+    else:
+      os.close(fd)
+    return data
+
+  def _ReadAll(self, fd):
+    chunks = []
+    while True:
+      try:
+        chunk = os.read(fd, BUFSIZE)
+      except OSError, e:
+        if e.errno == errno.EINTR:
+          continue
+        raise
+      if not chunk:
+        return ''.join(chunks)
+      chunks.append(chunk)
+
+
+_cache = None
+
+
+def Instance():
+  """Returns the shared FileCache."""
+  global _cache
+  if _cache is None:
+    _cache = FileCache()
+  return _cache
+
+
+def Read(filename):
+  """Read filename through the shared FileCache, see FileCache.Read()."""
+  return Instance().Read(filename)
+
+
+def Open(filename):
+  """Open filename through the shared FileCache, see FileCache.Open()."""
+  return Instance().Open(filename)
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+#pylint: disable-msg=C6409
+
+"""Unit tests for filecache.py."""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import google3
+import cwmp_session
+import filecache
+
+
+class FileCacheTest(unittest.TestCase):
+  """Tests for filecache.py."""
+
+  def setUp(self):
+    self.old_KEEPOPEN_PREFIXES = filecache.KEEPOPEN_PREFIXES
+    self.old_BUFSIZE = filecache.BUFSIZE
+    self.tmpdir = tempfile.mkdtemp()
+    self.sysdir = os.path.join(self.tmpdir, 'sys')
+    os.mkdir(self.sysdir)
+    filecache.KEEPOPEN_PREFIXES = [self.sysdir + '/']
+    cwmp_session.cache.new_tick()
+    self.cache = filecache.FileCache()
+
+  def tearDown(self):
+    self.cache.Flush()
+    filecache.KEEPOPEN_PREFIXES = self.old_KEEPOPEN_PREFIXES
+    filecache.BUFSIZE = self.old_BUFSIZE
+    shutil.rmtree(self.tmpdir)
+
+  def Write(self, filename, contents):
+    f = open(filename, 'w')
+    f.write(contents)
+    f.close()
+
+  def testOncePerTick(self):
+    filename = os.path.join(self.tmpdir, 'uptime')
+    self.Write(filename, '123.45 678.90\n')
+    self.assertEqual(self.cache.Read(filename), '123.45 678.90\n')
+    self.Write(filename, '124.45 679.90\n')
+    self.assertEqual(self.cache.Read(filename), '123.45 678.90\n')
+    self.assertEqual(self.cache.Open(filename).readline(), '123.45 678.90\n')
+    self.assertEqual(self.cache.hits, 2)
+    cwmp_session.cache.new_tick()
+    self.assertEqual(self.cache.Read(filename), '124.45 679.90\n')
+    self.assertEqual(self.cache.reads, 2)
+    self.assertEqual(self.cache.Stats()['open'], 0)
+
+  def testRenamedFile(self):
+    # files outside of sysfs are opened again, and see a replacement.
+    filename = os.path.join(self.tmpdir, 'fanspeed')
+    self.Write(filename, '10')
+    self.assertEqual(self.cache.Read(filename), '10')
+    self.Write(filename + '.new', '20')
+    os.rename(filename + '.new', filename)
+    cwmp_session.cache.new_tick()
+    self.assertEqual(self.cache.Read(filename), '20')
+
+  def testKeepOpen(self):
+    filename = os.path.join(self.sysdir, 'temp1_input')
+    self.Write(filename, '45000\n')
+    self.assertEqual(self.cache.Read(filename), '45000\n')
+    self.assertEqual(self.cache.Stats()['open'], 1)
+    self.Write(filename, '46000\n')  # rewritten in place, like sysfs
+    cwmp_session.cache.new_tick()
+    self.assertEqual(self.cache.Read(filename), '46000\n')
+    self.assertEqual(self.cache.rereads, 1)
+    self.cache.Read(filename)
+    stats = self.cache.Stats()
+    self.assertEqual(stats['hits'], 1)
+    self.assertEqual(stats['syscalls_saved'],
+                     filecache._OPEN_READ_SYSCALLS +
+                     filecache._OPEN_READ_SYSCALLS -
+                     filecache._REREAD_SYSCALLS)
+
+  def testLargeFile(self):
+    filecache.BUFSIZE = 16
+    filename = os.path.join(self.sysdir, 'igmp')
+    contents = ''.join(['line %d\n' % i for i in range(100)])
+    self.Write(filename, contents)
+    self.assertEqual(self.cache.Read(filename), contents)
+    cwmp_session.cache.new_tick()
+    self.assertEqual(self.cache.Read(filename), contents)
+
+  def testErrors(self):
+    filename = os.path.join(self.tmpdir, 'does_not_exist')
+    self.assertRaises(IOError, self.cache.Read, filename)
+    self.assertRaises(IOError, self.cache.Open, filename)
+    self.assertEqual(self.cache.errors, 1)
+    self.Write(filename, 'now it does')
+    self.assertRaises(IOError, self.cache.Read, filename)
+    cwmp_session.cache.new_tick()
+    self.assertEqual(self.cache.Read(filename), 'now it does')
+
+    self.assertRaises(IOError, self.cache.Read, self.tmpdir)  # EISDIR
+
+  def testKeptFileRemoved(self):
+    filename = os.path.join(self.sysdir, 'brightness')
+    self.Write(filename, '1\n')
+    self.assertEqual(self.cache.Read(filename), '1\n')
+    os.unlink(filename)
+    cwmp_session.cache.new_tick()
+    # like a regular file, ours is still there to read.  sysfs would
+    # return ENODEV, and we'd try opening it again.
+    self.assertEqual(self.cache.Read(filename), '1\n')
+    self.cache.Flush()
+    cwmp_session.cache.new_tick()
+    self.assertRaises(IOError, self.cache.Read, filename)
+
+
+if __name__ == '__main__':
+  unittest.main()
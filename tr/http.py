@@ -38,6 +38,7 @@ import tornado.util
 import tornado.web
 
 import api_soap
+import core
 import cpe_management_server
 import cwmp_session
 import helpers
@@ -151,11 +152,20 @@ class Handler(tornado.web.RequestHandler):
   def get(self):
     self.write('This is the cpe/acs handler.  It only takes POST requests.')
 
+  @tornado.web.asynchronous
   def post(self):
     print 'TR-069 server: request received:\n%s' % self.request.body
     if self.request.body.strip():
       result = self.soap_handler(self.request.body)
+      if isinstance(result, core.Deferred):
+        result.AddCallback(lambda d: self._Finish(d.Get()))
+        return
       self.write(str(result))
+    self.finish()
+
+  def _Finish(self, result):
+    self.write(str(result))
+    self.finish()
 
 
 class CPEStateMachine(object):
@@ -178,6 +188,7 @@ class CPEStateMachine(object):
     self.cpe_soap = api_soap.CPE(self.cpe)
     self.encode = api_soap.Encode()
     self.outstanding = None
+    self.pending_responses = 0
     self.response_queue = []
     self.request_queue = []
     self.event_queue = LimitDeque(MAX_EVENT_QUEUE_SIZE, self.EventQueueHandler)
@@ -322,6 +333,10 @@ class CPEStateMachine(object):
     if self.session.inform_required():
       self.session.state_update(sent_inform=True)
       return self.EncodeInform()
+    if self.pending_responses and not self.response_queue:
+      # Still computing the response to an ACS request, don't send
+      # anything (in particular not an empty message) until it is ready.
+      return None
     if self.response_queue and self.session.response_allowed():
       return self.response_queue.pop(0)
     if self.request_queue and self.session.request_allowed():
@@ -397,7 +412,11 @@ class CPEStateMachine(object):
       print _Shorten(response.body, 768, 256, 2048)
       if response.body:
         out = self.cpe_soap.Handle(response.body)
-        if out is not None:
+        if isinstance(out, core.Deferred):
+          self.pending_responses += 1
+          session = self.session
+          out.AddCallback(lambda d: self._GotDeferredResponse(session, d))
+        elif out is not None:
           self.SendResponse(out)
         # TODO(dgentry): $SPEC3 3.7.1.6 ACS Fault 8005 == retry same request
       else:
@@ -408,6 +427,18 @@ class CPEStateMachine(object):
     self.Run()
     return 200
 
+  def _GotDeferredResponse(self, session, deferred):
+    """A response from cpe_soap which wasn't ready right away is done."""
+    if session is not self.session:
+      print 'Session terminated, dropping response.'
+      return
+    self.pending_responses -= 1
+    out = deferred.Get()
+    if out is not None:
+      self.SendResponse(out)
+    else:
+      self.Run()
+
   def _ScheduleRetrySession(self, wait=None):
     """Start a timer to retry a CWMP session.
 
@@ -442,6 +473,7 @@ class CPEStateMachine(object):
     if not self.session:
       self._CancelSessionRetries()
       self.event_queue.appendleft((reason, None))
+      self.pending_responses = 0
       self.session = cwmp_session.CwmpSession(
           acs_url=self.cpe_management_server.URL, ioloop=self.ioloop)
       self.Run()
@@ -42,6 +42,7 @@ purposes.
 __author__ = 'apenwarr@google.com (Avery Pennarun)'
 
 
+import weakref
 import bup.shquote
 import mainloop
 
@@ -140,7 +141,8 @@ class QuotedBlockStreamer(object):
   accept incoming connections, and ProcessBlock() will be called
   automatically for each full block received from the remote.  It should
   return the lines that should be sent back to the remote.  We send back
-  the lines automatically using tornado.IOStream.
+  the lines automatically using tornado.IOStream.  A ProcessBlock() which
+  can't answer yet returns None, and calls SendBlock() when it can.
 
   Example:
       loop = mainloop.MainLoop()
@@ -157,14 +159,31 @@ class QuotedBlockStreamer(object):
     """
     self.sock = sock
     self.address = address
-    qb = QuotedBlockProtocol(self.ProcessBlock)
-    mainloop.LineReader(sock, address, qb.GotData)
+    self.qb = QuotedBlockProtocol(self.ProcessBlock)
+    reader = mainloop.LineReader(sock, address, self.qb.GotData)
+    # The reader refers to us, via self.qb.  A strong reference back would
+    # be a cycle, which the LineReader's __del__ would keep from being freed.
+    self._reader = weakref.ref(reader)
 
   def ProcessBlock(self, lines):
     """Redefine this function to respond to incoming requests how you want."""
     print 'lines: %r' % (lines,)
     return [['RESPONSE:']] + lines + [['EOR']]
 
+  def SendBlock(self, lines):
+    """Send a response for which ProcessBlock() returned None.
+
+    Args:
+      lines: the lines to send back to the remote.
+    Returns:
+      False if the remote has gone away in the meantime.
+    """
+    reader = self._reader()
+    if reader is None or reader.stream.closed():
+      return False
+    reader.Write(self.qb.RenderBlock(lines))
+    return True
+
 
 def main():
   loop = mainloop.MainLoop()
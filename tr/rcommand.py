@@ -64,8 +64,26 @@ class RemoteCommandStreamer(quotedblock.QuotedBlockStreamer):
     except Exception, e:
       print traceback.format_exc()
       return [['ERROR', '-1', str(e)]]
+    pending = [word for line in out for word in line
+               if isinstance(word, core.Deferred)]
+    if pending:
+      # Some getters returned a core.Deferred: answer when they're done.
+      core.Gather(pending).AddCallback(lambda d: self._SendDeferred(d, out))
+      return None
     return [['OK']] + out
 
+  def _SendDeferred(self, gathered, out):
+    """Send the response to a block whose values had to be waited for."""
+    try:
+      gathered.Get()
+      out = [[word.Get() if isinstance(word, core.Deferred) else word
+              for word in line] for line in out]
+      result = [['OK']] + out
+    except Exception, e:  #gpylint: disable-msg=W0703
+      print traceback.format_exc()
+      result = [['ERROR', '-1', str(e)]]
+    self.SendBlock(result)
+
   def CmdHelp(self):
     """Return a list of available commands."""
     for name in sorted(dir(self)):
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+#pylint: disable-msg=C6409
+
+"""Unit tests for rcommand.py."""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import datetime
+import socket
+import unittest
+
+import google3
+import tornado.ioloop
+import core
+import rcommand
+
+
+class Bad(core.Exporter):
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(params=['Broken'])
+
+  @property
+  def Broken(self):
+    d = core.Deferred()
+
+    def Fail():
+      try:
+        raise IOError('helper failed')
+      except IOError:
+        d.Fail()
+    tornado.ioloop.IOLoop.instance().add_callback(Fail)
+    return d
+
+
+class Root(core.Exporter):
+  def __init__(self):
+    core.Exporter.__init__(self)
+    self.Export(params=['Plain', 'Later'], objects=['Bad'])
+    self.Plain = 'plain'
+    self.Bad = Bad()
+
+  @property
+  def Later(self):
+    d = core.Deferred()
+    tornado.ioloop.IOLoop.instance().add_callback(lambda: d.Resolve('later'))
+    return d
+
+
+class RemoteCommandTest(unittest.TestCase):
+  """Tests for rcommand.py."""
+
+  def setUp(self):
+    self.ioloop = tornado.ioloop.IOLoop.instance()
+    (self.client, server) = socket.socketpair()
+    self.streamer = rcommand.RemoteCommandStreamer(server, 'test', Root())
+    self.received = ''
+
+  def tearDown(self):
+    self.client.close()
+
+  def Command(self, command):
+    """Send command, and return the response block."""
+    self.client.sendall(command + '\n\n')
+    self.received = ''
+
+    def Receive(unused_fd, unused_events):
+      self.received += self.client.recv(4096)
+      if self.received.endswith('\r\n\r\n'):
+        self.ioloop.stop()
+    self.ioloop.add_handler(self.client.fileno(), Receive, self.ioloop.READ)
+    tmo = self.ioloop.add_timeout(datetime.timedelta(seconds=5),
+                                  self.ioloop.stop)
+    self.ioloop.start()
+    self.ioloop.remove_timeout(tmo)
+    self.ioloop.remove_handler(self.client.fileno())
+    return self.received
+
+  def testGet(self):
+    self.assertEqual(self.Command('get Plain'), 'OK\r\nPlain plain\r\n\r\n')
+
+  def testGetDeferred(self):
+    self.assertEqual(self.Command('get Later'), 'OK\r\nLater later\r\n\r\n')
+    self.assertEqual(self.Command('list'),
+                     'OK\r\nBad.\r\nLater later\r\nPlain plain\r\n\r\n')
+
+  def testGetDeferredFails(self):
+    self.assertEqual(self.Command('get Bad.Broken'),
+                     'ERROR -1 \'helper failed\'\r\n\r\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""One timer for all of the periodic samplers.
+
+Each tornado PeriodicCallback keeps a timeout of its own, so a dozen
+samplers with the same period still wake the CPU a dozen times, at
+whatever moments they happened to be started.  A Scheduler keeps a
+single ioloop timeout instead:
+
+  - every deadline is rounded up to a multiple of SLOT seconds, and all
+    of the callbacks due in the same slot run from one wakeup.
+  - a callback with a period of P seconds runs at multiples of P, so
+    callbacks with the same (or a multiple of the same) period line up
+    no matter when they were added.
+  - a callback may ask for up to jitter seconds of random delay, for
+    things which shouldn't run at the same moment on every device.
+
+Runtime statistics are kept per callback name, see Stats().
+PeriodicCallback is a drop-in replacement for the tornado class.
+"""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import datetime
+import heapq
+import math
+import random
+import sys
+import traceback
+
+import google3
+import tornado.ioloop
+import helpers
+
+
+# Unit tests can override these
+TIMENOW = helpers.monotime
+RANDOM = random.random
+SLOT = 1.0
+
+
+class _Entry(object):
+  """One periodic callback."""
+
+  def __init__(self, callback, period, jitter, name):
+    self.callback = callback
+    self.period = period
+    self.jitter = jitter
+    self.name = name
+    self.deadline = None
+    self.active = True
+
+
+class _Stats(object):
+  """Counters for all of the callbacks with one name."""
+
+  def __init__(self):
+    self.calls = 0
+    self.errors = 0
+    self.total_secs = 0.0
+    self.max_secs = 0.0
+    self.max_late_secs = 0.0
+
+
+class Scheduler(object):
+  """Runs periodic callbacks on a timer wheel, see the module docstring."""
+
+  def __init__(self, ioloop=None, slot=None):
+    """Initialize a Scheduler.
+
+    Args:
+      ioloop: the tornado.ioloop.IOLoop to run on.
+      slot: seconds of timer resolution.  Deadlines are rounded up to it.
+    """
+    self.ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+    self.slot = slot or SLOT
+    self._heap = []
+    self._seq = 0
+    self._timeout = None
+    self._timeout_deadline = None
+    self._stats = {}
+    self.wakeups = 0
+
+  def Add(self, callback, period, jitter=0, name=None):
+    """Call callback() every period seconds, until Remove().
+
+    Args:
+      callback: the function to call.
+      period: seconds between calls.  The calls happen at multiples of
+        period, rounded up to the slot.
+      jitter: seconds of random delay to add to each call.
+      name: for Stats(), defaults to the name of the callback.
+    Returns:
+      a handle to pass to Remove().
+    """
+    if name is None:
+      name = _CallbackName(callback)
+    entry = _Entry(callback, float(period), jitter, name)
+    self._stats.setdefault(name, _Stats())
+    self._Schedule(entry, TIMENOW())
+    return entry
+
+  def Remove(self, entry):
+    """Stop calling the callback for a handle returned by Add()."""
+    entry.active = False
+    self._SetTimeout()
+
+  def Pending(self):
+    """Returns the number of callbacks scheduled."""
+    return len([e for (_, _, e) in self._heap if e.active])
+
+  def Stats(self):
+    """Return a dict of counters, for monitoring."""
+    callbacks = {}
+    for (name, st) in self._stats.iteritems():
+      callbacks[name] = {
+          'calls': st.calls,
+          'errors': st.errors,
+          'total_secs': st.total_secs,
+          'max_secs': st.max_secs,
+          'avg_secs': st.total_secs / st.calls if st.calls else 0.0,
+          'max_late_secs': st.max_late_secs}
+    return {'wakeups': self.wakeups,
+            'pending': self.Pending(),
+            'callbacks': callbacks}
+
+  def _Schedule(self, entry, now):
+    """Pick the next deadline for entry after now, and queue it."""
+    deadline = math.floor(now / entry.period + 1) * entry.period
+    if entry.jitter:
+      deadline += RANDOM() * entry.jitter
+    entry.deadline = math.ceil(deadline / self.slot) * self.slot
+    self._seq += 1
+    heapq.heappush(self._heap, (entry.deadline, self._seq, entry))
+    self._SetTimeout()
+
+  def _SetTimeout(self):
+    """Make sure the ioloop wakes us for the earliest deadline."""
+    while self._heap and not self._heap[0][2].active:
+      heapq.heappop(self._heap)
+    deadline = self._heap[0][0] if self._heap else None
+    if self._timeout is not None:
+      if self._timeout_deadline == deadline:
+        return
+      self.ioloop.remove_timeout(self._timeout)
+      self._timeout = self._timeout_deadline = None
+    if deadline is None:
+      return
+    delay = max(0, deadline - TIMENOW())
+    self._timeout_deadline = deadline
+    self._timeout = self.ioloop.add_timeout(
+        datetime.timedelta(seconds=delay), self._Run)
+
+  def _Run(self):
+    """Run every callback in the slot which is due."""
+    self._timeout = self._timeout_deadline = None
+    self.wakeups += 1
+    now = TIMENOW()
+    due = []
+    while self._heap and self._heap[0][0] <= now + self.slot / 2:
+      (deadline, _, entry) = heapq.heappop(self._heap)
+      if entry.active:
+        due.append((deadline, entry))
+    for (deadline, entry) in due:
+      if entry.active:
+        self._Call(entry, max(0.0, now - deadline))
+      if entry.active:
+        self._Schedule(entry, max(now, deadline))
+    self._SetTimeout()
+
+  def _Call(self, entry, late):
+    st = self._stats[entry.name]
+    start = TIMENOW()
+    try:
+      entry.callback()
+    except Exception:  #gpylint: disable-msg=W0703
+      st.errors += 1
+      print 'scheduler: %s failed' % entry.name
+      traceback.print_exc(file=sys.stdout)
+    elapsed = TIMENOW() - start
+    st.calls += 1
+    st.total_secs += elapsed
+    st.max_secs = max(st.max_secs, elapsed)
+    st.max_late_secs = max(st.max_late_secs, late)
+
+
+def _CallbackName(callback):
+  func = getattr(callback, 'im_func', callback)
+  name = getattr(func, '__name__', repr(func))
+  owner = getattr(callback, 'im_class', None)
+  if owner is not None:
+    name = '%s.%s' % (owner.__name__, name)
+  return name
+
+
+_schedulers = {}
+
+
+def Instance(ioloop=None):
+  """Returns the shared Scheduler for ioloop, the global ioloop by default."""
+  ioloop = ioloop or tornado.ioloop.IOLoop.instance()
+  sched = _schedulers.get(ioloop)
+  if sched is None:
+    sched = _schedulers[ioloop] = Scheduler(ioloop=ioloop)
+  return sched
+
+
+class PeriodicCallback(object):
+  """Like tornado.ioloop.PeriodicCallback, but on the shared Scheduler."""
+
+  def __init__(self, callback, callback_time, io_loop=None, jitter=0,
+               name=None):
+    """Initialize a PeriodicCallback.
+
+    Args:
+      callback: the function to call.
+      callback_time: milliseconds between calls.
+      io_loop: the tornado.ioloop.IOLoop to run on.
+      jitter: seconds of random delay, see Scheduler.Add().
+      name: for Scheduler.Stats().
+    """
+    self.callback = callback
+    self.callback_time = callback_time
+    self.io_loop = io_loop
+    self.jitter = jitter
+    self.name = name
+    self._entry = None
+
+  def start(self):
+    if self._entry is None:
+      self._entry = Instance(self.io_loop).Add(
+          self.callback, self.callback_time / 1000.0, jitter=self.jitter,
+          name=self.name)
+
+  def stop(self):
+    if self._entry is not None:
+      Instance(self.io_loop).Remove(self._entry)
+      self._entry = None
@@ -0,0 +1,183 @@
+#!/usr/bin/python
+# Copyright 2012 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# unittest requires method names starting in 'test'
+#pylint: disable-msg=C6409
+
+"""Unit tests for scheduler.py."""
+
+__author__ = 'dgentry@google.com (Denton Gentry)'
+
+import datetime
+import unittest
+
+import google3
+import tornado.ioloop
+import scheduler
+
+
+class FakeIOLoop(object):
+  """Remembers the timeouts instead of running them."""
+
+  def __init__(self):
+    self.timeouts = []
+
+  def add_timeout(self, deadline, callback):
+    tmo = (deadline, callback)
+    self.timeouts.append(tmo)
+    return tmo
+
+  def remove_timeout(self, tmo):
+    self.timeouts.remove(tmo)
+
+
+class SchedulerTest(unittest.TestCase):
+  """Tests for scheduler.py."""
+
+  def setUp(self):
+    self.old_RANDOM = scheduler.RANDOM
+    self.old_TIMENOW = scheduler.TIMENOW
+    self.now = 1003.2
+    scheduler.TIMENOW = lambda: self.now
+    self.ioloop = FakeIOLoop()
+    self.sched = scheduler.Scheduler(ioloop=self.ioloop, slot=1.0)
+    self.calls = []
+
+  def tearDown(self):
+    scheduler.RANDOM = self.old_RANDOM
+    scheduler.TIMENOW = self.old_TIMENOW
+
+  def Callback(self, name):
+    return lambda: self.calls.append((name, self.now))
+
+  def Fire(self, now):
+    """Advance the clock to now, and run the one timeout we expect."""
+    self.assertEqual(len(self.ioloop.timeouts), 1)
+    (delay, callback) = self.ioloop.timeouts.pop()
+    self.assertEqual(delay, datetime.timedelta(seconds=now - self.now))
+    self.now = now
+    callback()
+
+  def testAlignment(self):
+    self.sched.Add(self.Callback('a'), 10)
+    self.now = 1007.9
+    self.sched.Add(self.Callback('b'), 10)
+    self.sched.Add(self.Callback('c'), 5)
+    self.now = 1003.2
+    # c is due at 1010 too, so they all run from one wakeup.
+    self.Fire(1010.0)
+    self.assertEqual(sorted(self.calls),
+                     [('a', 1010.0), ('b', 1010.0), ('c', 1010.0)])
+    self.Fire(1015.0)
+    self.assertEqual(self.calls[-1], ('c', 1015.0))
+    self.Fire(1020.0)
+    self.assertEqual(len(self.calls), 7)
+    self.assertEqual(self.sched.wakeups, 3)
+
+  def testSlot(self):
+    self.sched.Add(self.Callback('a'), 2.5)
+    self.Fire(1005.0)  # 1005 is a multiple of 2.5
+    self.Fire(1008.0)  # 1007.5, rounded up to the slot
+    self.Fire(1010.0)
+    self.assertEqual([t for (unused_name, t) in self.calls],
+                     [1005.0, 1008.0, 1010.0])
+
+  def testLateWakeup(self):
+    self.sched.Add(self.Callback('a'), 10)
+    (unused_delay, callback) = self.ioloop.timeouts.pop()
+    self.now = 1032.0  # we slept through two periods
+    callback()
+    self.assertEqual(self.calls, [('a', 1032.0)])
+    self.Fire(1040.0)
+    stats = self.sched.Stats()['callbacks']['<lambda>']
+    self.assertEqual(stats['calls'], 2)
+    self.assertEqual(stats['max_late_secs'], 22.0)
+
+  def testJitter(self):
+    scheduler.RANDOM = lambda: 0.55
+    self.sched.Add(self.Callback('a'), 60, jitter=10)
+    self.Fire(1026.0)  # 1020 + 5.5, rounded up to the slot
+    self.Fire(1086.0)
+
+  def testRemove(self):
+    a = self.sched.Add(self.Callback('a'), 10)
+    self.sched.Add(self.Callback('b'), 20)
+    self.assertEqual(self.sched.Pending(), 2)
+    self.sched.Remove(a)
+    self.assertEqual(self.sched.Pending(), 1)
+    self.Fire(1020.0)
+    self.assertEqual(self.calls, [('b', 1020.0)])
+
+  def testEarlierDeadline(self):
+    self.sched.Add(self.Callback('a'), 300)
+    self.sched.Add(self.Callback('b'), 5)
+    # the timeout for 1200 was replaced by one for 1005.
+    self.Fire(1005.0)
+    self.assertEqual(self.calls, [('b', 1005.0)])
+
+  def testStats(self):
+    def Slow():
+      self.now += 0.25
+
+    def Broken():
+      raise ValueError('oops')
+    self.sched.Add(Slow, 10, name='slow')
+    self.sched.Add(Broken, 10)
+    self.Fire(1010.0)
+    self.Fire(1020.0)
+    stats = self.sched.Stats()
+    self.assertEqual(stats['wakeups'], 2)
+    self.assertEqual(stats['pending'], 2)
+    self.assertEqual(stats['callbacks']['slow']['calls'], 2)
+    self.assertEqual(stats['callbacks']['slow']['avg_secs'], 0.25)
+    self.assertEqual(stats['callbacks']['slow']['max_secs'], 0.25)
+    self.assertEqual(stats['callbacks']['Broken']['errors'], 2)
+
+  def testPeriodicCallback(self):
+    old_schedulers = scheduler._schedulers
+    scheduler._schedulers = {self.ioloop: self.sched}
+    try:
+      pc = scheduler.PeriodicCallback(self.Callback('a'), 10 * 1000,
+                                      io_loop=self.ioloop, name='a')
+      pc.start()
+      pc.start()
+      self.assertEqual(self.sched.Pending(), 1)
+      self.Fire(1010.0)
+      pc.stop()
+      self.assertEqual(self.sched.Pending(), 0)
+      self.assertEqual(self.calls, [('a', 1010.0)])
+    finally:
+      scheduler._schedulers = old_schedulers
+
+  def testRealIOLoop(self):
+    scheduler.TIMENOW = self.old_TIMENOW
+    ioloop = tornado.ioloop.IOLoop()
+    sched = scheduler.Scheduler(ioloop=ioloop, slot=0.01)
+    calls = []
+
+    def Tick():
+      calls.append(1)
+      if len(calls) == 3:
+        ioloop.stop()
+    sched.Add(Tick, 0.05)
+    tmo = ioloop.add_timeout(datetime.timedelta(seconds=5), ioloop.stop)
+    ioloop.start()
+    ioloop.remove_timeout(tmo)
+    ioloop.close(all_fds=True)
+    self.assertEqual(len(calls), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()